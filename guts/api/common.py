@@ -20,6 +20,7 @@ import re
 import enum
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import strutils
 from six.moves import urllib
 import webob
 
@@ -218,6 +219,62 @@ def get_sort_params(params, default_key='created_at', default_dir='desc'):
     return sort_keys, sort_dirs
 
 
+def get_list_params(request, sort_keys, filters=(), boolean_filters=(),
+                    integer_filters=(), aliases=None, default_sort_key='id',
+                    default_sort_dir='asc'):
+    """Return the pagination, sort and filter parameters of a list request.
+
+    :param request: ``wsgi.Request`` of the list.
+    :param sort_keys: keys the collection can be sorted by.
+    :param filters: keys the collection can be filtered on, other parameters
+                    are ignored.
+    :param boolean_filters: filters whose values are booleans.
+    :param integer_filters: filters whose values are integers.
+    :param aliases: dictionary of the column names of the keys which are
+                    named differently in the API.
+    :returns: (marker, limit, sort keys, sort dirs, filters) tuple, keys
+              being column names.
+    :raises webob.exc.HTTPBadRequest: for unknown sort keys or directions
+                                      and invalid boolean or integer
+                                      values.
+    """
+    aliases = aliases or {}
+    params = request.GET.copy()
+    marker, limit, __ = get_pagination_params(params)
+    keys, dirs = get_sort_params(params, default_key=default_sort_key,
+                                 default_dir=default_sort_dir)
+    for key in keys:
+        if key not in sort_keys:
+            msg = _('Invalid sort key %s') % key
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+    for sort_dir in dirs:
+        if sort_dir not in ('asc', 'desc'):
+            msg = _('Invalid sort direction %s') % sort_dir
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+
+    search_opts = {}
+    for key in filters:
+        if key not in params:
+            continue
+        value = params[key]
+        if key in boolean_filters:
+            try:
+                value = strutils.bool_from_string(value, strict=True)
+            except ValueError:
+                msg = _('%s param must be a boolean') % key
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+        elif key in integer_filters:
+            try:
+                value = int(value)
+            except ValueError:
+                msg = _('%s param must be an integer') % key
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+        search_opts[aliases.get(key, key)] = value
+
+    keys = [aliases.get(key, key) for key in keys]
+    return marker, limit, keys, dirs, search_opts
+
+
 def get_request_url(request):
     url = request.application_url
     headers = request.headers
@@ -348,6 +405,22 @@ class ViewBuilder(object):
         })
         return links
 
+    def get_collection(self, request, items, collection_name,
+                       link_path=None):
+        """Return the body of a page of a collection.
+
+        A '<collection>_links' list holds the link to the next page when
+        the page is full. link_path is the routed path of the collection
+        when it differs from its name.
+        """
+        collection = {collection_name: items}
+        links = self._get_collection_links(request, items,
+                                           link_path or collection_name,
+                                           id_key='id')
+        if links:
+            collection['%s_links' % collection_name] = links
+        return collection
+
     def _update_link_prefix(self, orig_url, prefix):
         if not prefix:
             return orig_url
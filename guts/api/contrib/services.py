@@ -20,6 +20,7 @@ from oslo_log import versionutils
 from oslo_utils import timeutils
 import webob.exc
 
+from guts.api import common
 from guts.api import extensions
 from guts.api.openstack import wsgi
 from guts.api import xmlutil
@@ -34,6 +35,10 @@ CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 authorize = extensions.extension_authorizer('migration', 'services')
 
+SERVICE_SORT_KEYS = ('id', 'host', 'binary', 'topic', 'created_at')
+SERVICE_FILTERS = ('host', 'binary', 'disabled')
+SERVICE_BOOLEAN_FILTERS = ('disabled',)
+
 
 class ServicesIndexTemplate(xmlutil.TemplateBuilder):
     def construct(self):
@@ -63,6 +68,9 @@ class ServicesUpdateTemplate(xmlutil.TemplateBuilder):
 
 
 class ServiceController(wsgi.Controller):
+
+    _view_builder_class = common.ViewBuilder
+
     def __init__(self, ext_mgr=None):
         self.ext_mgr = ext_mgr
         super(ServiceController, self).__init__()
@@ -77,26 +85,21 @@ class ServiceController(wsgi.Controller):
         authorize(context, action='index')
         detailed = self.ext_mgr.is_loaded('os-extended-services')
         now = timeutils.utcnow(with_timezone=True)
-        services = objects.ServiceList.get_all(context)
-
-        host = ''
-        if 'host' in req.GET:
-            host = req.GET['host']
-        service = ''
+        marker, limit, sort_keys, sort_dirs, filters = common.get_list_params(
+            req, SERVICE_SORT_KEYS, filters=SERVICE_FILTERS,
+            boolean_filters=SERVICE_BOOLEAN_FILTERS,
+            default_sort_key='host')
         if 'service' in req.GET:
-            service = req.GET['service']
             versionutils.report_deprecated_feature(LOG, _(
                 "Query by service parameter is deprecated. "
                 "Please use binary parameter instead."))
-        binary = ''
-        if 'binary' in req.GET:
-            binary = req.GET['binary']
-
-        if host:
-            services = [s for s in services if s.host == host]
-        binary_key = binary or service
-        if binary_key:
-            services = [s for s in services if s.binary == binary_key]
+            filters.setdefault('binary', req.GET['service'])
+        # Empty values used to mean no filter.
+        filters = {key: value for key, value in filters.items()
+                   if value != ''}
+        services = objects.ServiceList.get_all(
+            context, filters=filters, marker=marker, limit=limit,
+            sort_keys=sort_keys, sort_dirs=sort_dirs)
 
         svcs = []
         for svc in services:
@@ -120,7 +123,8 @@ class ServiceController(wsgi.Controller):
             if detailed:
                 ret_fields['disabled_reason'] = svc.disabled_reason
             svcs.append(ret_fields)
-        return {'services': svcs}
+        return self._view_builder.get_collection(req, svcs, 'services',
+                                                 link_path='os-services')
 
     def _is_valid_as_reason(self, reason):
         if not reason:
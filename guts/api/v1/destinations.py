@@ -21,8 +21,10 @@ from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import timeutils
 
+from guts.api import common
 from guts.api import extensions
 from guts.api.openstack import wsgi
+from guts.api.v1 import sources
 from guts import exception
 from guts import objects
 from guts import rpc
@@ -37,6 +39,8 @@ authorize = extensions.extension_authorizer('migration', 'destinations')
 class DestinationsController(wsgi.Controller):
     """The destination hypervisor API controller for the OpenStack API."""
 
+    _view_builder_class = common.ViewBuilder
+
     def __init__(self, ext_mgr):
         self.ext_mgr = ext_mgr
         super(DestinationsController, self).__init__()
@@ -53,8 +57,14 @@ class DestinationsController(wsgi.Controller):
     def index(self, req):
         """Returns the list of Source Hypervisors."""
         context = req.environ['guts.context']
-        src_services = objects.ServiceList.get_all_by_topic(context,
-                                                            'guts-destination')
+        marker, limit, sort_keys, sort_dirs, filters = common.get_list_params(
+            req, sources.HYPERVISOR_SORT_KEYS,
+            filters=sources.HYPERVISOR_FILTERS,
+            boolean_filters=sources.HYPERVISOR_BOOLEAN_FILTERS,
+            default_sort_key='host')
+        src_services = objects.ServiceList.get_all_by_topic(
+            context, 'guts-destination', filters=filters, marker=marker,
+            limit=limit, sort_keys=sort_keys, sort_dirs=sort_dirs)
         now = timeutils.utcnow(with_timezone=True)
 
         destinations = []
@@ -68,7 +78,8 @@ class DestinationsController(wsgi.Controller):
             dest['hypervisor_name'] = service.host.split('@')[1]
             dest['id'] = service.id
             destinations.append(dest)
-        return dict(destinations=destinations)
+        return self._view_builder.get_collection(req, destinations,
+                                                 'destinations')
 
     def show(self, req, id):
         """Returns data about given destination hypervisor."""
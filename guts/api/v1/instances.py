@@ -20,8 +20,10 @@ import webob
 from oslo_config import cfg
 from oslo_log import log as logging
 
+from guts.api import common
 from guts.api import extensions
 from guts.api.openstack import wsgi
+from guts.api.v1 import resources
 from guts import exception
 from guts import objects
 from guts import rpc
@@ -36,6 +38,8 @@ authorize = extensions.extension_authorizer('migration', 'instances')
 class InstancesController(wsgi.Controller):
     """The instance API controller for the OpenStack API."""
 
+    _view_builder_class = common.ViewBuilder
+
     def __init__(self, ext_mgr):
         self.ext_mgr = ext_mgr
         super(InstancesController, self).__init__()
@@ -52,8 +56,15 @@ class InstancesController(wsgi.Controller):
     def index(self, req):
         """Returns the list of Instances."""
         context = req.environ['guts.context']
-        db_instances = objects.ResourceList.get_all_by_type(context,
-                                                            'instance')
+        marker, limit, sort_keys, sort_dirs, filters = common.get_list_params(
+            req, resources.RESOURCE_SORT_KEYS,
+            filters=resources.RESOURCE_FILTERS,
+            boolean_filters=resources.RESOURCE_BOOLEAN_FILTERS,
+            integer_filters=resources.RESOURCE_INTEGER_FILTERS)
+        filters['type'] = 'instance'
+        db_instances = objects.ResourceList.get_all(
+            context, filters=filters, marker=marker, limit=limit,
+            sort_keys=sort_keys, sort_dirs=sort_dirs)
 
         instances = []
         for i in db_instances:
@@ -64,7 +75,7 @@ class InstancesController(wsgi.Controller):
             instance['migrated'] = i.migrated
 
             instances.append(instance)
-        return dict(instances=instances)
+        return self._view_builder.get_collection(req, instances, 'instances')
 
     def show(self, req, id):
         """Returns data about given instance."""
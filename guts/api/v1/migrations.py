@@ -19,14 +19,17 @@ import webob
 
 from oslo_config import cfg
 from oslo_log import log as logging
-import oslo_messaging as messaging
 
+from guts.api import common
 from guts.api import extensions
 from guts.api.openstack import wsgi
+from guts.api.v1 import resources
 from guts import exception
+from guts.i18n import _, _LI
+from guts.migration import rpcapi as migration_rpcapi
 from guts import objects
-from guts.objects import base as objects_base
 from guts import rpc
+from guts.scheduler import rpcapi as scheduler_rpcapi
 
 LOG = logging.getLogger(__name__)
 
@@ -34,12 +37,29 @@ CONF = cfg.CONF
 
 authorize = extensions.extension_authorizer('migration', 'migrations')
 
+# Related rows loaded along with the migrations, in the same query.
+MIGRATION_RELATED_ATTRS = ['resource', 'destination']
+
+MIGRATION_SORT_KEYS = ('id', 'name', 'status', 'resource_id', 'priority',
+                       'created_at')
+MIGRATION_FILTERS = ('name', 'status', 'resource_id',
+                     'destination_hypervisor', 'source_host', 'project_id')
+MIGRATION_INTEGER_FILTERS = ('priority',)
+MIGRATION_ALIASES = {'status': 'migration_status'}
+
+# Number of resource ids looked up by a single query of a bulk create.
+BULK_LOOKUP_SIZE = 500
+
 
 class MigrationsController(wsgi.Controller):
     """The migration API controller for the OpenStack API."""
 
+    _view_builder_class = common.ViewBuilder
+
     def __init__(self, ext_mgr):
         self.ext_mgr = ext_mgr
+        self.scheduler_rpcapi = scheduler_rpcapi.SchedulerAPI()
+        self.destination_rpcapi = migration_rpcapi.DestinationAPI()
         super(MigrationsController, self).__init__()
 
     def _notify_source_error(self, ctxt, method, err,
@@ -51,43 +71,56 @@ class MigrationsController(wsgi.Controller):
         payload = dict(sources=source)
         rpc.get_notifier('source').info(ctxt, method, payload)
 
+    def _format_migration(self, m):
+        migration = {}
+        migration['id'] = m.id
+        migration['name'] = m.name
+        migration['resource_id'] = m.resource_id
+        migration['resource_type'] = m.resource_type
+        migration['status'] = m.migration_status
+        migration['event'] = m.migration_event
+        migration['destination_hypervisor'] = m.destination_hypervisor
+        migration['destination_host'] = m.destination_host
+        migration['source_host'] = m.source_host
+        migration['priority'] = m.priority
+        migration['bytes_logical'] = m.bytes_logical
+        migration['bytes_transferred'] = m.bytes_transferred
+        return migration
+
+    def _get_priority(self, values, default=0):
+        priority = values.get('priority', default)
+        try:
+            return int(priority)
+        except (TypeError, ValueError):
+            msg = _('priority must be an integer, got %s.') % priority
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+
     def index(self, req):
         """Returns the list of Migrations."""
         context = req.environ['guts.context']
-        db_migrations = objects.MigrationList.get_all(context)
-
-        migrations = []
-        for m in db_migrations:
-            migration = {}
-            migration['id'] = m.id
-            migration['name'] = m.name
-            migration['resource_id'] = m.resource_id
-            r = objects.Resource.get(context, m.resource_id)
-            migration['resource_type'] = r.type
-            migration['status'] = m.migration_status
-            migration['event'] = m.migration_event
-            migration['destination_hypervisor'] = m.destination_hypervisor
+        marker, limit, sort_keys, sort_dirs, filters = common.get_list_params(
+            req, MIGRATION_SORT_KEYS, filters=MIGRATION_FILTERS,
+            integer_filters=MIGRATION_INTEGER_FILTERS,
+            aliases=MIGRATION_ALIASES, default_sort_key='created_at')
+        db_migrations = objects.MigrationList.get_all(
+            context, filters=filters, expected_attrs=MIGRATION_RELATED_ATTRS,
+            marker=marker, limit=limit, sort_keys=sort_keys,
+            sort_dirs=sort_dirs)
 
-            migrations.append(migration)
-        return dict(migrations=migrations)
+        migrations = [self._format_migration(m) for m in db_migrations]
+        return self._view_builder.get_collection(req, migrations,
+                                                 'migrations')
 
     def show(self, req, id):
         """Returns data about given migration."""
         context = req.environ['guts.context']
         try:
-            m = objects.Migration.get(context, id)
+            m = objects.Migration.get(
+                context, id, expected_attrs=MIGRATION_RELATED_ATTRS)
         except exception.NotFound:
             raise webob.exc.HTTPNotFound()
 
-        migration = {}
-        migration['id'] = m.id
-        migration['name'] = m.name
-        migration['resource_id'] = m.resource_id
-        r = objects.Resource.get(context, m.resource_id)
-        migration['resource_type'] = r.type
-        migration['status'] = m.migration_status
-        migration['event'] = m.migration_event
-        migration['destination_hypervisor'] = m.destination_hypervisor
+        migration = self._format_migration(m)
         migration['description'] = m.description
 
         return {'migration': migration}
@@ -97,13 +130,23 @@ class MigrationsController(wsgi.Controller):
         context = req.environ['guts.context']
         LOG.debug('Create migration request body: %s', body)
         mig_values = body['migration']
-        dest_hypervisor = mig_values['destination_hypervisor']
+        dest_hypervisor = mig_values.get('destination_hypervisor')
+        filter_properties = self._get_filter_properties(context,
+                                                        dest_hypervisor)
+        try:
+            resource_ref = objects.Resource.get(context,
+                                                mig_values['resource_id'])
+        except exception.NotFound:
+            msg = _('Resource %s not found.') % mig_values['resource_id']
+            raise webob.exc.HTTPBadRequest(explanation=msg)
         kwargs = {'name': mig_values['name'],
                   'description': mig_values['description'],
                   'resource_id': mig_values['resource_id'],
+                  'source_host': resource_ref.source,
+                  'project_id': context.project_id,
+                  'priority': self._get_priority(mig_values),
                   'migration_status': 'Initiating',
-                  'migration_event': 'Scheduling',
-                  'destination_hypervisor': dest_hypervisor, }
+                  'migration_event': 'Scheduling', }
 
         mig_ref = objects.Migration(context=context, **kwargs)
         mig_ref.create()
@@ -116,36 +159,147 @@ class MigrationsController(wsgi.Controller):
         migration['event'] = mig_ref.migration_event
         migration['destination_hypervisor'] = mig_ref.destination_hypervisor
         migration['description'] = mig_ref.description
+        migration['priority'] = mig_ref.priority
 
-        resource_ref = objects.Resource.get(context, mig_ref.resource_id)
-        self._cast_to_source(context, mig_ref, resource_ref)
+        self.scheduler_rpcapi.create_migrations(
+            context, [{'migration_ref': mig_ref,
+                       'resource_ref': resource_ref}],
+            filter_properties=filter_properties)
         return {'migration': migration}
 
-    def _cast_to_source(self, context, mig_ref, resource_ref):
-        src_host = resource_ref.source
-        dest_ref = objects.Service.get(context, mig_ref.destination_hypervisor)
-        dest_host = dest_ref.host
-        src_topic = ('guts-source.%s' % (src_host))
-        target = messaging.Target(topic=src_topic, version='1.8')
-        serializer = objects_base.GutsObjectSerializer()
-        client = rpc.get_client(target, version_cap=None,
-                                serializer=serializer)
-
-        ctxt = client.prepare(version='1.8')
-        ctxt.cast(context, 'get_resource',
-                  migration_ref=mig_ref,
-                  resource_ref=resource_ref,
-                  dest_host=dest_host)
+    def _get_filter_properties(self, context, dest_hypervisor):
+        """Restrict the placement to the requested destination, if any."""
+        if not dest_hypervisor:
+            return {}
+        try:
+            dest_ref = objects.Service.get(context, dest_hypervisor)
+        except exception.ServiceNotFound:
+            msg = _('Destination hypervisor %s not found.') % dest_hypervisor
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        return {'destination_hosts': [dest_ref.host]}
+
+    def _get_bulk_resources(self, context, mig_values):
+        """Return the (entry, resource) pairs of a bulk create request."""
+        if 'resources' in mig_values:
+            entries = []
+            for entry in mig_values['resources']:
+                if not isinstance(entry, dict):
+                    entry = {'resource_id': entry}
+                entries.append(entry)
+            ids = [entry.get('resource_id') for entry in entries]
+            if len(set(ids)) != len(ids):
+                msg = _('A resource can only be migrated once per request.')
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+
+            found = {}
+            for start in range(0, len(ids), BULK_LOOKUP_SIZE):
+                filters = {'id': ids[start:start + BULK_LOOKUP_SIZE]}
+                for resource_ref in objects.ResourceList.get_all(
+                        context, filters=filters):
+                    found[resource_ref.id] = resource_ref
+            missing = [resource_id for resource_id in ids
+                       if resource_id not in found]
+            if missing:
+                msg = _('Resources not found: %s') % ', '.join(
+                    str(resource_id) for resource_id in missing)
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+            return [(entry, found[entry['resource_id']])
+                    for entry in entries]
+
+        if 'filters' in mig_values:
+            filters = mig_values['filters']
+            if not isinstance(filters, dict):
+                msg = _('filters must be a dictionary.')
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+            invalid = set(filters) - set(resources.RESOURCE_FILTERS)
+            if invalid:
+                msg = _('Invalid filter keys: %s') % ', '.join(sorted(invalid))
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+            return [({'resource_id': resource_ref.id}, resource_ref)
+                    for resource_ref in objects.ResourceList.get_all(
+                        context, filters=filters)]
+
+        msg = _("Either 'resources' or 'filters' is required.")
+        raise webob.exc.HTTPBadRequest(explanation=msg)
+
+    def bulk(self, req, body):
+        """Create the migrations of many resources at once.
+
+        The resources are listed in 'resources', by id or as dictionaries
+        with a resource_id and optionally a name, description and
+        priority, or are selected by 'filters' on the fields of the
+        resource list. Migrations of the same priority are started in the
+        order they are queued, sharing the slots fairly between projects.
+        All the migrations are created in one transaction and handed to
+        the scheduler at once, which places them on the destinations, or on
+        the given destination_hypervisor only.
+        """
+        context = req.environ['guts.context']
+        LOG.debug('Bulk create migrations request body: %s', body)
+        if not self.is_valid_body(body, 'migrations'):
+            msg = _("Missing required element 'migrations' in request body.")
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        mig_values = body['migrations']
+        dest_hypervisor = mig_values.get('destination_hypervisor')
+        filter_properties = self._get_filter_properties(context,
+                                                        dest_hypervisor)
+
+        pairs = self._get_bulk_resources(context, mig_values)
+        if not pairs:
+            msg = _('No resource to migrate.')
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+
+        prefix = mig_values.get('name')
+        priority = self._get_priority(mig_values)
+        values_list = []
+        for entry, resource_ref in pairs:
+            name = entry.get('name')
+            if not name:
+                name = (prefix and '%s-%s' % (prefix, resource_ref.name) or
+                        resource_ref.name)
+            values_list.append({
+                'name': name,
+                'description': entry.get('description',
+                                         mig_values.get('description')),
+                'resource_id': resource_ref.id,
+                'source_host': resource_ref.source,
+                'project_id': context.project_id,
+                'priority': self._get_priority(entry, default=priority),
+                'migration_status': 'Initiating',
+                'migration_event': 'Scheduling'})
+        mig_refs = objects.MigrationList.create_all(context, values_list)
+
+        to_schedule = []
+        migrations = []
+        for mig_ref, (_entry, resource_ref) in zip(mig_refs, pairs):
+            mig_ref.resource_type = resource_ref.type
+            mig_ref.destination_host = None
+            mig_ref.obj_reset_changes(['resource_type', 'destination_host'])
+            to_schedule.append({'migration_ref': mig_ref,
+                                'resource_ref': resource_ref})
+            migration = self._format_migration(mig_ref)
+            migration['description'] = mig_ref.description
+            migrations.append(migration)
+
+        self.scheduler_rpcapi.create_migrations(
+            context, to_schedule, filter_properties=filter_properties)
+        return {'migrations': migrations}
 
     def delete(self, req, id):
         """Deletes given migration entry from database."""
         context = req.environ['guts.context']
         LOG.info(_LI("Delete migration with id: %s"), id, context=context)
         try:
-            m = objects.Migration.get(context, id)
+            m = objects.Migration.get(context, id,
+                                      expected_attrs=['destination'])
         except exception.NotFound:
             raise webob.exc.HTTPNotFound()
         m.destroy()
+        # The scheduler reserved space on the destination when it placed
+        # the migration, which will never start now.
+        if m.migration_status == 'Queued' and m.destination_host:
+            self.destination_rpcapi.release_space(context,
+                                                  m.destination_host, m.id)
 
 
 def create_resource(ext_mgr):
@@ -20,8 +20,10 @@ import webob
 from oslo_config import cfg
 from oslo_log import log as logging
 
+from guts.api import common
 from guts.api import extensions
 from guts.api.openstack import wsgi
+from guts.api.v1 import resources
 from guts import exception
 from guts import objects
 from guts import rpc
@@ -36,6 +38,8 @@ authorize = extensions.extension_authorizer('migration', 'networks')
 class NetworksController(wsgi.Controller):
     """The network API controller for the OpenStack API."""
 
+    _view_builder_class = common.ViewBuilder
+
     def __init__(self, ext_mgr):
         self.ext_mgr = ext_mgr
         super(NetworksController, self).__init__()
@@ -52,7 +56,15 @@ class NetworksController(wsgi.Controller):
     def index(self, req):
         """Returns the list of Networks."""
         context = req.environ['guts.context']
-        db_networks = objects.ResourceList.get_all_by_type(context, 'network')
+        marker, limit, sort_keys, sort_dirs, filters = common.get_list_params(
+            req, resources.RESOURCE_SORT_KEYS,
+            filters=resources.RESOURCE_FILTERS,
+            boolean_filters=resources.RESOURCE_BOOLEAN_FILTERS,
+            integer_filters=resources.RESOURCE_INTEGER_FILTERS)
+        filters['type'] = 'network'
+        db_networks = objects.ResourceList.get_all(
+            context, filters=filters, marker=marker, limit=limit,
+            sort_keys=sort_keys, sort_dirs=sort_dirs)
 
         networks = []
         for i in db_networks:
@@ -63,7 +75,7 @@ class NetworksController(wsgi.Controller):
             network['hypervisor_name'] = i.source.split('@')[1]
             networks.append(network)
 
-        return dict(networks=networks)
+        return self._view_builder.get_collection(req, networks, 'networks')
 
     def show(self, req, id):
         """Returns data about given network."""
@@ -20,6 +20,7 @@ import webob
 from oslo_config import cfg
 from oslo_log import log as logging
 
+from guts.api import common
 from guts.api import extensions
 from guts.api.openstack import wsgi
 from guts import exception
@@ -32,10 +33,19 @@ CONF = cfg.CONF
 
 authorize = extensions.extension_authorizer('migration', 'resources')
 
+RESOURCE_SORT_KEYS = ('id', 'name', 'type', 'source', 'migrated',
+                      'created_at', 'memory', 'vcpus', 'size')
+RESOURCE_FILTERS = ('name', 'type', 'source', 'migrated', 'memory', 'vcpus',
+                    'size')
+RESOURCE_BOOLEAN_FILTERS = ('migrated',)
+RESOURCE_INTEGER_FILTERS = ('memory', 'vcpus', 'size')
+
 
 class ResourcesController(wsgi.Controller):
     """The resource API controller for the OpenStack API."""
 
+    _view_builder_class = common.ViewBuilder
+
     def __init__(self, ext_mgr):
         self.ext_mgr = ext_mgr
         super(ResourcesController, self).__init__()
@@ -52,7 +62,13 @@ class ResourcesController(wsgi.Controller):
     def index(self, req):
         """Returns the list of Resources."""
         context = req.environ['guts.context']
-        db_resources = objects.ResourceList.get_all(context)
+        marker, limit, sort_keys, sort_dirs, filters = common.get_list_params(
+            req, RESOURCE_SORT_KEYS, filters=RESOURCE_FILTERS,
+            boolean_filters=RESOURCE_BOOLEAN_FILTERS,
+            integer_filters=RESOURCE_INTEGER_FILTERS)
+        db_resources = objects.ResourceList.get_all(
+            context, filters=filters, marker=marker, limit=limit,
+            sort_keys=sort_keys, sort_dirs=sort_dirs)
 
         resources = []
         for r in db_resources:
@@ -64,7 +80,7 @@ class ResourcesController(wsgi.Controller):
             resource['hypervisor_name'] = r.source.split('@')[1]
 
             resources.append(resource)
-        return dict(resources=resources)
+        return self._view_builder.get_collection(req, resources, 'resources')
 
     def show(self, req, id):
         """Returns data about given resource."""
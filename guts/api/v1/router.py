@@ -66,4 +66,5 @@ class APIRouter(guts.api.openstack.APIRouter):
 
         self.resources['migrations'] = migrations.create_resource(ext_mgr)
         mapper.resource("migration", "migrations",
-                        controller=self.resources['migrations'])
+                        controller=self.resources['migrations'],
+                        collection={'bulk': 'POST'})
@@ -21,6 +21,7 @@ from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import timeutils
 
+from guts.api import common
 from guts.api import extensions
 from guts.api.openstack import wsgi
 from guts import exception
@@ -33,10 +34,16 @@ CONF = cfg.CONF
 
 authorize = extensions.extension_authorizer('migration', 'sources')
 
+HYPERVISOR_SORT_KEYS = ('id', 'host', 'created_at')
+HYPERVISOR_FILTERS = ('host', 'disabled')
+HYPERVISOR_BOOLEAN_FILTERS = ('disabled',)
+
 
 class SourcesController(wsgi.Controller):
     """The source hypervisor API controller for the OpenStack API."""
 
+    _view_builder_class = common.ViewBuilder
+
     def __init__(self, ext_mgr):
         self.ext_mgr = ext_mgr
         super(SourcesController, self).__init__()
@@ -53,8 +60,13 @@ class SourcesController(wsgi.Controller):
     def index(self, req):
         """Returns the list of Source Hypervisors."""
         context = req.environ['guts.context']
-        src_services = objects.ServiceList.get_all_by_topic(context,
-                                                            'guts-source')
+        marker, limit, sort_keys, sort_dirs, filters = common.get_list_params(
+            req, HYPERVISOR_SORT_KEYS, filters=HYPERVISOR_FILTERS,
+            boolean_filters=HYPERVISOR_BOOLEAN_FILTERS,
+            default_sort_key='host')
+        src_services = objects.ServiceList.get_all_by_topic(
+            context, 'guts-source', filters=filters, marker=marker,
+            limit=limit, sort_keys=sort_keys, sort_dirs=sort_dirs)
         now = timeutils.utcnow(with_timezone=True)
 
         sources = []
@@ -68,7 +80,7 @@ class SourcesController(wsgi.Controller):
             source['hypervisor_name'] = service.host.split('@')[1]
             source['id'] = service.id
             sources.append(source)
-        return dict(sources=sources)
+        return self._view_builder.get_collection(req, sources, 'sources')
 
     def show(self, req, id):
         """Returns data about given source hypervisor."""
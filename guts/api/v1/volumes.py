@@ -20,8 +20,10 @@ import webob
 from oslo_config import cfg
 from oslo_log import log as logging
 
+from guts.api import common
 from guts.api import extensions
 from guts.api.openstack import wsgi
+from guts.api.v1 import resources
 from guts import exception
 from guts import objects
 from guts import rpc
@@ -36,6 +38,8 @@ authorize = extensions.extension_authorizer('migration', 'volumes')
 class VolumesController(wsgi.Controller):
     """The volume API controller for the OpenStack API."""
 
+    _view_builder_class = common.ViewBuilder
+
     def __init__(self, ext_mgr):
         self.ext_mgr = ext_mgr
         super(VolumesController, self).__init__()
@@ -52,7 +56,15 @@ class VolumesController(wsgi.Controller):
     def index(self, req):
         """Returns the list of Volumes."""
         context = req.environ['guts.context']
-        db_volumes = objects.ResourceList.get_all_by_type(context, 'volume')
+        marker, limit, sort_keys, sort_dirs, filters = common.get_list_params(
+            req, resources.RESOURCE_SORT_KEYS,
+            filters=resources.RESOURCE_FILTERS,
+            boolean_filters=resources.RESOURCE_BOOLEAN_FILTERS,
+            integer_filters=resources.RESOURCE_INTEGER_FILTERS)
+        filters['type'] = 'volume'
+        db_volumes = objects.ResourceList.get_all(
+            context, filters=filters, marker=marker, limit=limit,
+            sort_keys=sort_keys, sort_dirs=sort_dirs)
 
         volumes = []
         for v in db_volumes:
@@ -63,7 +75,7 @@ class VolumesController(wsgi.Controller):
             volume['hypervisor_name'] = v.source.split('@')[1]
 
             volumes.append(volume)
-        return dict(volumes=volumes)
+        return self._view_builder.get_collection(req, volumes, 'volumes')
 
     def show(self, req, id):
         """Returns data about given volume."""
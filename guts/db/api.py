@@ -159,15 +159,23 @@ def source_delete(context, source_id):
 
 # Resources
 
-def resource_get_all(context, inactive=False):
+def resource_get_all(context, inactive=False, filters=None, marker=None,
+                     limit=None, sort_keys=None, sort_dirs=None):
     """Get all resources.
 
     :param context: context to query under
     :param inactive: Include inactive sources to the result set
+    :param filters: dictionary of column values the resources must have
+    :param marker: id of the last resource of the previous page
+    :param limit: maximum number of resources to return
+    :param sort_keys: columns to sort by, the id is always sorted on last
+    :param sort_dirs: 'asc' or 'desc' direction of each sort key
 
     :returns: list of resources
     """
-    return IMPL.resource_get_all(context, inactive)
+    return IMPL.resource_get_all(context, inactive, filters=filters,
+                                 marker=marker, limit=limit,
+                                 sort_keys=sort_keys, sort_dirs=sort_dirs)
 
 
 def resource_get(context, id):
@@ -215,17 +223,47 @@ def resource_get_by_id_at_source(context, id_at_source):
     return IMPL.resource_get_by_id_at_source(context, id_at_source)
 
 
+def resource_sync_by_source(context, source, resources, removed=None,
+                            complete=False):
+    """Bring the stored resources of a source in line with its report.
+
+    :param resources: resources reported, dicts with 'id_at_source',
+                      'type', 'name' and 'properties'. Unknown ones are
+                      created, known ones updated if they changed.
+    :param removed: id_at_source of the resources to delete.
+    :param complete: True if the report lists all the resources of the
+                     source, the ones it does not list are deleted.
+
+    :returns: dict with the number of resources created, updated and
+              deleted.
+    """
+    return IMPL.resource_sync_by_source(context, source, resources,
+                                        removed, complete)
+
+
 # Migrations
 
 
-def migration_get_all(context, inactive=False):
-    """Get all migrations."""
-    return IMPL.migration_get_all(context, inactive)
+def migration_get_all(context, inactive=False, expected_fields=None,
+                      filters=None, marker=None, limit=None, sort_keys=None,
+                      sort_dirs=None):
+    """Get all migrations.
 
+    :param expected_fields: related rows to load in the same query,
+                            'resource' and/or 'destination'.
 
-def migration_get(context, id):
+    Filtering and pagination parameters are those of resource_get_all.
+    """
+    return IMPL.migration_get_all(context, inactive,
+                                  expected_fields=expected_fields,
+                                  filters=filters, marker=marker,
+                                  limit=limit, sort_keys=sort_keys,
+                                  sort_dirs=sort_dirs)
+
+
+def migration_get(context, id, expected_fields=None):
     """Get Migration."""
-    return IMPL.migration_get(context, id)
+    return IMPL.migration_get(context, id, expected_fields=expected_fields)
 
 
 def migration_delete(context, migration_id):
@@ -238,6 +276,11 @@ def migration_create(context, values):
     return IMPL.migration_create(context, values)
 
 
+def migration_create_all(context, values_list):
+    """Create several migrations in a single transaction."""
+    return IMPL.migration_create_all(context, values_list)
+
+
 def migration_get_by_name(context, name):
     """Migration get by name"""
     return IMPL.migration_get_by_name(context, name)
@@ -251,6 +294,37 @@ def migration_update(context, migration_id, values):
     return IMPL.migration_update(context, migration_id, values)
 
 
+def migration_claim_queued(context, source_host, count, destination_limits,
+                           default_destination_limit, expected_fields=None):
+    """Start up to count queued migrations of the given source host.
+
+    Migrations are taken by priority, then sharing the running slots fairly
+    between projects, without exceeding the number of running migrations
+    of each destination given in destination_limits, by service id.
+
+    :returns: the claimed migrations, now running.
+    """
+    return IMPL.migration_claim_queued(context, source_host, count,
+                                       destination_limits,
+                                       default_destination_limit,
+                                       expected_fields=expected_fields)
+
+
+def migration_fail_stale(context, service_down_time, timeout,
+                         expected_fields=None):
+    """Fail the running migrations which cannot complete anymore.
+
+    A running migration holds a slot of its destination until the
+    destination completes it. Those of destinations which did not report
+    for service_down_time seconds are failed, as are those not updated for
+    timeout seconds, 0 disabling the timeout.
+
+    :returns: the failed migrations.
+    """
+    return IMPL.migration_fail_stale(context, service_down_time, timeout,
+                                     expected_fields=expected_fields)
+
+
 # Service
 
 def service_destroy(context, service_id):
@@ -268,14 +342,22 @@ def service_get_by_host_and_topic(context, host, topic):
     return IMPL.service_get_by_host_and_topic(context, host, topic)
 
 
-def service_get_all(context, disabled=None):
+def service_get_all(context, disabled=None, filters=None, marker=None,
+                    limit=None, sort_keys=None, sort_dirs=None):
     """Get all services."""
-    return IMPL.service_get_all(context, disabled)
+    return IMPL.service_get_all(context, disabled, filters=filters,
+                                marker=marker, limit=limit,
+                                sort_keys=sort_keys, sort_dirs=sort_dirs)
 
 
-def service_get_all_by_topic(context, topic, disabled=None):
+def service_get_all_by_topic(context, topic, disabled=None, filters=None,
+                             marker=None, limit=None, sort_keys=None,
+                             sort_dirs=None):
     """Get all services for a given topic."""
-    return IMPL.service_get_all_by_topic(context, topic, disabled=disabled)
+    return IMPL.service_get_all_by_topic(context, topic, disabled=disabled,
+                                         filters=filters, marker=marker,
+                                         limit=limit, sort_keys=sort_keys,
+                                         sort_dirs=sort_dirs)
 
 
 def service_get_by_args(context, host, binary):
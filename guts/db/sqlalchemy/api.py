@@ -16,6 +16,7 @@
 """Implementation of SQLAlchemy backend."""
 
 
+import datetime
 import functools
 import re
 import sys
@@ -27,9 +28,12 @@ from oslo_config import cfg
 from oslo_db import exception as db_exc
 from oslo_db import options
 from oslo_db.sqlalchemy import session as db_session
+from oslo_db.sqlalchemy import utils as sqlalchemyutils
 from oslo_log import log as logging
 from oslo_utils import timeutils
+from sqlalchemy import func
 from sqlalchemy.orm import joinedload
+from sqlalchemy.sql.expression import bindparam
 from sqlalchemy.sql.expression import literal_column
 
 
@@ -37,6 +41,7 @@ from guts.db.sqlalchemy import models
 from guts import exception
 from guts.i18n import _
 from guts.i18n import _LW
+from guts import utils
 
 
 CONF = cfg.CONF
@@ -76,6 +81,13 @@ def dispose_engine():
 
 _DEFAULT_QUOTA_NAME = 'default'
 
+# Statuses of the migrations waiting for a slot on their source host, of
+# those holding one until the destination completes them, and of those
+# which failed.
+MIGRATION_QUEUED = 'Queued'
+MIGRATION_RUNNING = 'Inprogress'
+MIGRATION_ERROR = 'ERROR'
+
 
 def get_backend():
     """The backend is this module itself."""
@@ -202,6 +214,57 @@ def model_query(context, *args, **kwargs):
     return query
 
 
+def _process_filters(query, model, filters):
+    """Restrict the query to the rows equal to the given column values.
+
+    A list of values matches any of them.
+    """
+    for key, value in (filters or {}).items():
+        if key not in model.__table__.columns:
+            raise exception.InvalidInput(
+                reason=_("Invalid filter key %s") % key)
+        column = getattr(model, key)
+        if isinstance(value, (list, tuple, set)):
+            query = query.filter(column.in_(value))
+        else:
+            query = query.filter(column == value)
+    return query
+
+
+def _paginate_query(context, query, model, marker=None, limit=None,
+                    sort_keys=None, sort_dirs=None, session=None):
+    """Return a page of the query, starting after the marker row.
+
+    Pages are selected with a condition on the sort keys rather than an
+    offset, the id ends the sort keys so every row has a unique position.
+    """
+    sort_keys = list(sort_keys or [])
+    sort_dirs = list(sort_dirs or [])
+    if 'id' not in sort_keys:
+        sort_keys.append('id')
+        sort_dirs.append(sort_dirs[-1] if sort_dirs else 'asc')
+
+    marker_row = None
+    if marker is not None:
+        marker_row = model_query(context, model, session=session,
+                                 read_deleted='yes').\
+            filter_by(id=marker).\
+            first()
+        if not marker_row:
+            raise exception.MarkerNotFound(marker=marker)
+
+    try:
+        return sqlalchemyutils.paginate_query(query, model, limit,
+                                              sort_keys,
+                                              marker=marker_row,
+                                              sort_dirs=sort_dirs)
+    except db_exc.InvalidSortKey:
+        raise exception.InvalidInput(
+            reason=_("Invalid sort keys %s") % ', '.join(sort_keys))
+    except ValueError as e:
+        raise exception.InvalidInput(reason=e)
+
+
 # Resources
 
 def _resource_get_query(context, session=None, read_deleted=None,
@@ -219,12 +282,18 @@ def _resource_get_query(context, session=None, read_deleted=None,
 
 
 @require_context
-def resource_get_all(context, inactive=False):
+def resource_get_all(context, inactive=False, filters=None, marker=None,
+                     limit=None, sort_keys=None, sort_dirs=None):
     """Returns a dict describing all resources with id as key."""
     read_deleted = "yes" if inactive else "no"
-    query = _resource_get_query(context, read_deleted=read_deleted)
+    session = get_session()
+    query = _resource_get_query(context, session=session,
+                                read_deleted=read_deleted)
+    query = _process_filters(query, models.Resources, filters)
+    query = _paginate_query(context, query, models.Resources, marker, limit,
+                            sort_keys or ['id'], sort_dirs, session=session)
 
-    return query.order_by("id").all()
+    return query.all()
 
 
 @require_context
@@ -254,6 +323,9 @@ def resource_create(context, values):
 
     session = get_session()
 
+    if 'properties' in values:
+        values.update(utils.extract_indexed_properties(values['properties']))
+
     with session.begin():
         try:
             resource_ref = models.Resources()
@@ -326,9 +398,105 @@ def resource_update(context, resource_id, values):
     session = get_session()
     with session.begin():
         resource_ref = _resource_get(context, resource_id, session=session)
+        if 'properties' in values:
+            values.update(
+                utils.extract_indexed_properties(values['properties']))
         resource_ref.update(values)
         return resource_ref
 
+
+# Number of ids in a single IN clause of a batched statement.
+_BATCH_SIZE = 500
+
+
+@require_admin_context
+@_retry_on_deadlock
+def resource_sync_by_source(context, source, resources, removed=None,
+                            complete=False):
+    table = models.Resources.__table__
+    now = timeutils.utcnow()
+    session = get_session()
+    with session.begin():
+        # Deleted resources are included, there can only be one resource
+        # per id at source and a resource reported again is revived.
+        existing = {}
+        query = model_query(context, models.Resources.id,
+                            models.Resources.id_at_source,
+                            models.Resources.type,
+                            models.Resources.name,
+                            models.Resources.properties,
+                            models.Resources.deleted,
+                            session=session, read_deleted='yes').\
+            filter_by(source=source)
+        for row in query:
+            existing[row.id_at_source] = row
+
+        new_rows = []
+        changed_rows = []
+        reported = set()
+        for values in resources:
+            id_at_source = values['id_at_source']
+            reported.add(id_at_source)
+            row = existing.get(id_at_source)
+            properties = values.get('properties')
+            if row is None:
+                new_row = {'id': str(uuid.uuid4()),
+                           'source': source,
+                           'id_at_source': id_at_source,
+                           'type': values.get('type'),
+                           'name': values.get('name'),
+                           'properties': properties,
+                           'migrated': False,
+                           'deleted': False,
+                           'created_at': now}
+                new_row.update(utils.extract_indexed_properties(properties))
+                new_rows.append(new_row)
+            elif (row.deleted or row.name != values.get('name') or
+                    row.properties != properties):
+                changed_row = {'_id': row.id,
+                               'name': values.get('name'),
+                               'properties': properties}
+                changed_row.update(
+                    utils.extract_indexed_properties(properties))
+                changed_rows.append(changed_row)
+
+        if new_rows:
+            session.execute(table.insert(), new_rows)
+        if changed_rows:
+            indexed = {key: bindparam(key, type_=table.c[key].type)
+                       for key in utils.INDEXED_RESOURCE_PROPERTIES}
+            session.execute(
+                table.update().
+                where(table.c.id == bindparam('_id')).
+                values(name=bindparam('name'),
+                       properties=bindparam(
+                           'properties', type_=table.c.properties.type),
+                       deleted=False,
+                       deleted_at=None,
+                       updated_at=now,
+                       **indexed),
+                changed_rows)
+
+        gone = set(removed or [])
+        if complete:
+            gone.update(set(existing) - reported)
+        gone_ids = [existing[id_at_source].id for id_at_source in gone
+                    if id_at_source in existing and
+                    not existing[id_at_source].deleted]
+        for start in range(0, len(gone_ids), _BATCH_SIZE):
+            batch = gone_ids[start:start + _BATCH_SIZE]
+            model_query(context, models.Resources, session=session,
+                        read_deleted='yes').\
+                filter(models.Resources.id.in_(batch)).\
+                update({'deleted': True,
+                        'deleted_at': now,
+                        'updated_at': literal_column('updated_at')},
+                       synchronize_session=False)
+
+    return {'created': len(new_rows),
+            'updated': len(changed_rows),
+            'deleted': len(gone_ids)}
+
 # Migrations
 
 
@@ -342,22 +510,35 @@ def _migration_get_query(context, session=None, read_deleted=None,
 
     if 'projects' in expected_fields:
         query = query.options(joinedload('projects'))
+    if 'resource' in expected_fields:
+        query = query.options(joinedload('resource'))
+    if 'destination' in expected_fields:
+        query = query.options(joinedload('destination'))
 
     return query
 
 
 @require_context
-def migration_get_all(context, inactive=False):
+def migration_get_all(context, inactive=False, expected_fields=None,
+                      filters=None, marker=None, limit=None, sort_keys=None,
+                      sort_dirs=None):
     read_deleted = "yes" if inactive else "no"
-    query = _migration_get_query(context, read_deleted=read_deleted)
+    session = get_session()
+    query = _migration_get_query(context, session=session,
+                                 read_deleted=read_deleted,
+                                 expected_fields=expected_fields)
+    query = _process_filters(query, models.Migrations, filters)
+    query = _paginate_query(context, query, models.Migrations, marker, limit,
+                            sort_keys or ['created_at'], sort_dirs,
+                            session=session)
 
-    return query.order_by("name").all()
+    return query.all()
 
 
 @require_context
-def _migration_get(context, id, session=None):
+def _migration_get(context, id, session=None, expected_fields=None):
     result = _migration_get_query(
-        context, session).\
+        context, session, expected_fields=expected_fields).\
         filter_by(id=id).\
         first()
 
@@ -368,8 +549,8 @@ def _migration_get(context, id, session=None):
 
 
 @require_context
-def migration_get(context, id, session=None):
-    return _migration_get(context, id, session)
+def migration_get(context, id, session=None, expected_fields=None):
+    return _migration_get(context, id, session, expected_fields)
 
 
 @require_context
@@ -428,6 +609,26 @@ def migration_create(context, values, projects=None):
         return migration_ref
 
 
+@require_admin_context
+@_retry_on_deadlock
+def migration_create_all(context, values_list):
+    """Create several migrations in a single transaction."""
+    migration_refs = []
+    session = get_session()
+    with session.begin():
+        for values in values_list:
+            if not values.get('id'):
+                values['id'] = str(uuid.uuid4())
+            migration_ref = models.Migrations()
+            migration_ref.update(values)
+            migration_refs.append(migration_ref)
+        # Rows with their primary key set are inserted in a single
+        # executemany.
+        session.add_all(migration_refs)
+
+    return migration_refs
+
+
 @require_admin_context
 def migration_update(context, migration_id, values):
     session = get_session()
@@ -437,6 +638,144 @@ def migration_update(context, migration_id, values):
         return migration_ref
 
 
+def _pick_queued(queued, running_by_project, running_by_destination,
+                 destination_limits, default_destination_limit):
+    """Return the next queued migration to start, or None.
+
+    The highest priority wins. Among migrations of the same priority, the
+    project with the fewest running migrations goes first, the oldest
+    migration breaking ties.
+    """
+    best = None
+    best_key = None
+    for migration in queued:
+        destination = migration.destination_hypervisor
+        limit = destination_limits.get(destination,
+                                       default_destination_limit)
+        if running_by_destination.get(destination, 0) >= limit:
+            continue
+        key = (-(migration.priority or 0),
+               running_by_project.get(migration.project_id, 0))
+        if best_key is None or key < best_key:
+            best, best_key = migration, key
+    return best
+
+
+def _load_relations(migrations, expected_fields):
+    """Load the given relations of locked migrations, in their session."""
+    for migration_ref in migrations:
+        for relation in expected_fields or []:
+            getattr(migration_ref, relation)
+
+
+@require_admin_context
+@_retry_on_deadlock
+def migration_claim_queued(context, source_host, count, destination_limits,
+                           default_destination_limit,
+                           expected_fields=None):
+    session = get_session()
+    with session.begin():
+        # Only the migration rows are locked, FOR UPDATE cannot apply to
+        # the nullable side of the outer joins loading their relations.
+        queued = model_query(context, models.Migrations, session=session).\
+            filter_by(source_host=source_host,
+                      migration_status=MIGRATION_QUEUED).\
+            order_by(models.Migrations.created_at).\
+            with_for_update().\
+            all()
+        if not queued:
+            return []
+
+        destinations = set(m.destination_hypervisor for m in queued)
+        # Serialize the claims of all the sources sharing a destination.
+        model_query(context, models.Service.id, session=session).\
+            filter(models.Service.id.in_(destinations)).\
+            with_for_update().\
+            all()
+
+        running_by_destination = dict(
+            model_query(context, models.Migrations.destination_hypervisor,
+                        func.count(models.Migrations.id),
+                        session=session).
+            filter(models.Migrations.destination_hypervisor.in_(
+                destinations)).
+            filter_by(migration_status=MIGRATION_RUNNING).
+            group_by(models.Migrations.destination_hypervisor).
+            all())
+        running_by_project = dict(
+            model_query(context, models.Migrations.project_id,
+                        func.count(models.Migrations.id),
+                        session=session).
+            filter_by(source_host=source_host,
+                      migration_status=MIGRATION_RUNNING).
+            group_by(models.Migrations.project_id).
+            all())
+
+        claimed = []
+        while len(claimed) < count:
+            migration_ref = _pick_queued(queued, running_by_project,
+                                         running_by_destination,
+                                         destination_limits,
+                                         default_destination_limit)
+            if migration_ref is None:
+                break
+            queued.remove(migration_ref)
+            migration_ref.update({'migration_status': MIGRATION_RUNNING,
+                                  'migration_event': 'Starting'})
+            destination = migration_ref.destination_hypervisor
+            running_by_destination[destination] = (
+                running_by_destination.get(destination, 0) + 1)
+            running_by_project[migration_ref.project_id] = (
+                running_by_project.get(migration_ref.project_id, 0) + 1)
+            claimed.append(migration_ref)
+
+        _load_relations(claimed, expected_fields)
+
+    return claimed
+
+
+@require_admin_context
+@_retry_on_deadlock
+def migration_fail_stale(context, service_down_time, timeout,
+                         expected_fields=None):
+    now = timeutils.utcnow()
+    down_since = now - datetime.timedelta(seconds=service_down_time)
+    session = get_session()
+    with session.begin():
+        running = model_query(context, models.Migrations, session=session).\
+            filter_by(migration_status=MIGRATION_RUNNING).\
+            with_for_update().\
+            all()
+        if not running:
+            return []
+
+        destinations = set(m.destination_hypervisor for m in running)
+        services = model_query(context, models.Service, session=session).\
+            filter(models.Service.id.in_(destinations)).\
+            all()
+        heartbeats = {service.id: service.updated_at or service.created_at
+                      for service in services}
+
+        failed = []
+        for migration_ref in running:
+            heartbeat = heartbeats.get(migration_ref.destination_hypervisor)
+            updated_at = migration_ref.updated_at or migration_ref.created_at
+            if heartbeat is None or heartbeat < down_since:
+                event = 'Destination service down'
+            elif (timeout and
+                    updated_at < now - datetime.timedelta(seconds=timeout)):
+                event = 'Timed out'
+            else:
+                continue
+            migration_ref.update({'migration_status': MIGRATION_ERROR,
+                                  'migration_event': event})
+            failed.append(migration_ref)
+
+        _load_relations(failed, expected_fields)
+
+    return failed
+
+
 # Service
 
 @require_admin_context
@@ -467,23 +806,36 @@ def service_get(context, service_id):
 
 
 @require_admin_context
-def service_get_all(context, disabled=None):
-    query = model_query(context, models.Service)
+def service_get_all(context, disabled=None, filters=None, marker=None,
+                    limit=None, sort_keys=None, sort_dirs=None):
+    session = get_session()
+    query = model_query(context, models.Service, session=session)
 
     if disabled is not None:
         query = query.filter_by(disabled=disabled)
+    query = _process_filters(query, models.Service, filters)
+    query = _paginate_query(context, query, models.Service, marker, limit,
+                            sort_keys or ['host'], sort_dirs,
+                            session=session)
 
     return query.all()
 
 
 @require_admin_context
-def service_get_all_by_topic(context, topic, disabled=None):
+def service_get_all_by_topic(context, topic, disabled=None, filters=None,
+                             marker=None, limit=None, sort_keys=None,
+                             sort_dirs=None):
+    session = get_session()
     query = model_query(
-        context, models.Service, read_deleted="no").\
+        context, models.Service, session=session, read_deleted="no").\
         filter_by(topic=topic)
 
     if disabled is not None:
         query = query.filter_by(disabled=disabled)
+    query = _process_filters(query, models.Service, filters)
+    query = _paginate_query(context, query, models.Service, marker, limit,
+                            sort_keys or ['host'], sort_dirs,
+                            session=session)
 
     return query.all()
 
@@ -0,0 +1,34 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column, Float, MetaData, String, Table
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    migrations = Table('migrations', meta, autoload=True)
+    migrations.create_column(Column('disk_conversion', String(255)))
+    migrations.create_column(Column('conversion_time_saved', Float))
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    migrations = Table('migrations', meta, autoload=True)
+    migrations.drop_column('conversion_time_saved')
+    migrations.drop_column('disk_conversion')
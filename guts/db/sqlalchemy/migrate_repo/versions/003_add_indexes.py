@@ -0,0 +1,101 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+from migrate.changeset.constraint import UniqueConstraint
+from sqlalchemy import Index, MetaData, Table, select
+
+
+UNIQUE_RESOURCE = 'uniq_resources0source0id_at_source'
+
+INDEXES = [
+    # (table, index name, columns)
+    ('resources', 'resources_id_at_source_deleted_idx',
+     ['id_at_source', 'deleted']),
+    ('resources', 'resources_type_deleted_idx', ['type', 'deleted']),
+    ('migrations', 'migrations_name_deleted_idx', ['name', 'deleted']),
+    ('migrations', 'migrations_resource_id_idx', ['resource_id']),
+    ('services', 'services_host_binary_idx', ['host', 'binary']),
+    ('services', 'services_topic_disabled_idx', ['topic', 'disabled']),
+]
+
+
+def _remove_duplicate_resources(migrate_engine, resources, migrations):
+    """Keep a single resource per source and id at source.
+
+    The live resource, or the most recent one, is kept and the migrations
+    of the others are moved to it.
+    """
+    rows = migrate_engine.execute(
+        select([resources.c.id, resources.c.source,
+                resources.c.id_at_source, resources.c.deleted,
+                resources.c.created_at]).
+        order_by(resources.c.source, resources.c.id_at_source)).fetchall()
+
+    groups = {}
+    for row in rows:
+        groups.setdefault((row.source, row.id_at_source), []).append(row)
+
+    for duplicates in groups.values():
+        if len(duplicates) < 2:
+            continue
+        duplicates.sort(
+            key=lambda r: (not r.deleted,
+                           r.created_at or datetime.datetime.min),
+            reverse=True)
+        kept = duplicates[0]
+        for row in duplicates[1:]:
+            migrate_engine.execute(
+                migrations.update().
+                where(migrations.c.resource_id == row.id).
+                values(resource_id=kept.id))
+            migrate_engine.execute(
+                resources.delete().where(resources.c.id == row.id))
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    resources = Table('resources', meta, autoload=True)
+    migrations = Table('migrations', meta, autoload=True)
+    Table('services', meta, autoload=True)
+
+    _remove_duplicate_resources(migrate_engine, resources, migrations)
+    UniqueConstraint('source', 'id_at_source', table=resources,
+                     name=UNIQUE_RESOURCE).create()
+
+    for table_name, index_name, columns in INDEXES:
+        table = meta.tables[table_name]
+        Index(index_name, *[table.c[column] for column in columns]).create(
+            migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    resources = Table('resources', meta, autoload=True)
+    Table('migrations', meta, autoload=True)
+    Table('services', meta, autoload=True)
+
+    for table_name, index_name, columns in reversed(INDEXES):
+        table = meta.tables[table_name]
+        Index(index_name, *[table.c[column] for column in columns]).drop(
+            migrate_engine)
+
+    UniqueConstraint('source', 'id_at_source', table=resources,
+                     name=UNIQUE_RESOURCE).drop()
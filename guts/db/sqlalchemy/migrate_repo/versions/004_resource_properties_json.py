@@ -0,0 +1,122 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ast
+import json
+
+from oslo_log import log as logging
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table, Text
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects import mysql
+
+from guts.i18n import _LW
+
+
+LOG = logging.getLogger(__name__)
+
+INDEXED_PROPERTIES = ('memory', 'vcpus', 'size')
+
+INDEXES = [
+    # (index name, column)
+    ('resources_memory_idx', 'memory'),
+    ('resources_vcpus_idx', 'vcpus'),
+    ('resources_size_idx', 'size'),
+]
+
+# Number of rows rewritten by a single statement.
+BATCH_SIZE = 500
+
+
+def _properties_type():
+    return Text().with_variant(mysql.MEDIUMTEXT(), 'mysql')
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rewrite_properties(migrate_engine, resources, convert):
+    """Rewrite the properties of all the resources in batches."""
+    rows = migrate_engine.execute(
+        select([resources.c.id, resources.c.properties])).fetchall()
+    update = resources.update().\
+        where(resources.c.id == bindparam('_id')).\
+        values(**{key: bindparam(key)
+                  for key in ('properties',) + INDEXED_PROPERTIES})
+    updates = [convert(row) for row in rows]
+    for start in range(0, len(updates), BATCH_SIZE):
+        migrate_engine.execute(update, updates[start:start + BATCH_SIZE])
+
+
+def _to_json(row):
+    values = {'_id': row.id, 'properties': None}
+    properties = {}
+    if row.properties:
+        try:
+            properties = ast.literal_eval(row.properties)
+            values['properties'] = json.dumps(properties,
+                                              separators=(',', ':'))
+        except (SyntaxError, ValueError):
+            # Truncated by the former column size, the next report of the
+            # source stores them again.
+            LOG.warning(_LW('Dropping unreadable properties of resource '
+                            '%s.'), row.id)
+    for key in INDEXED_PROPERTIES:
+        values[key] = _to_int(properties.get(key))
+    return values
+
+
+def _to_literal(row):
+    values = {key: None for key in INDEXED_PROPERTIES}
+    values['_id'] = row.id
+    values['properties'] = None
+    if row.properties:
+        values['properties'] = str(json.loads(row.properties))[:1024]
+    return values
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    resources = Table('resources', meta, autoload=True)
+    resources.c.properties.alter(type=_properties_type())
+    for key in INDEXED_PROPERTIES:
+        resources.create_column(Column(key, Integer))
+    resources = Table('resources', MetaData(bind=migrate_engine),
+                      autoload=True)
+
+    _rewrite_properties(migrate_engine, resources, _to_json)
+
+    for index_name, column in INDEXES:
+        Index(index_name, resources.c[column]).create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    resources = Table('resources', meta, autoload=True)
+    for index_name, column in INDEXES:
+        Index(index_name, resources.c[column]).drop(migrate_engine)
+
+    _rewrite_properties(migrate_engine, resources, _to_literal)
+
+    for key in INDEXED_PROPERTIES:
+        resources.drop_column(key)
+    resources.c.properties.alter(type=String(1024))
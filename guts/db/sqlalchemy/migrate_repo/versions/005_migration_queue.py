@@ -0,0 +1,62 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table
+from sqlalchemy import select
+
+
+INDEXES = [
+    # (index name, columns)
+    ('migrations_source_host_status_idx',
+     ['source_host', 'migration_status']),
+    ('migrations_destination_status_idx',
+     ['destination_hypervisor', 'migration_status']),
+]
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    migrations = Table('migrations', meta, autoload=True)
+    resources = Table('resources', meta, autoload=True)
+
+    migrations.create_column(Column('source_host', String(255)))
+    migrations.create_column(Column('project_id', String(255)))
+    migrations.create_column(Column('priority', Integer, nullable=False,
+                                    server_default='0'))
+
+    migrate_engine.execute(
+        migrations.update().values(
+            source_host=select([resources.c.source]).
+            where(resources.c.id == migrations.c.resource_id).
+            as_scalar()))
+
+    for index_name, columns in INDEXES:
+        Index(index_name, *[migrations.c[column] for column in columns]).\
+            create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    migrations = Table('migrations', meta, autoload=True)
+    for index_name, columns in INDEXES:
+        Index(index_name, *[migrations.c[column] for column in columns]).\
+            drop(migrate_engine)
+
+    for column in ('priority', 'project_id', 'source_host'):
+        migrations.drop_column(column)
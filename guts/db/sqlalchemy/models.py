@@ -20,9 +20,15 @@ SQLAlchemy models for guts data.
 from oslo_config import cfg
 from oslo_db.sqlalchemy import models
 from oslo_utils import timeutils
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import BigInteger, Column, Float, Integer, String, Text
+from sqlalchemy.dialects import mysql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import ForeignKey, DateTime, Boolean
+from sqlalchemy import Index, UniqueConstraint
+from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
+
+from guts import utils
 
 
 CONF = cfg.CONF
@@ -46,14 +52,49 @@ class GutsBase(models.TimestampMixin,
         self.save(session=session)
 
 
+class JsonEncodedDict(TypeDecorator):
+    """Dictionary stored as JSON text."""
+
+    impl = Text
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'mysql':
+            return dialect.type_descriptor(mysql.MEDIUMTEXT())
+        return dialect.type_descriptor(self.impl)
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return utils.dump_properties(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return utils.load_properties(value)
+
+
 class Resources(BASE, GutsBase):
     """Represent resources to migrate."""
     __tablename__ = "resources"
+    __table_args__ = (
+        UniqueConstraint('source', 'id_at_source',
+                         name='uniq_resources0source0id_at_source'),
+        Index('resources_id_at_source_deleted_idx', 'id_at_source',
+              'deleted'),
+        Index('resources_type_deleted_idx', 'type', 'deleted'),
+        Index('resources_memory_idx', 'memory'),
+        Index('resources_vcpus_idx', 'vcpus'),
+        Index('resources_size_idx', 'size'),
+        GutsBase.__table_args__,
+    )
     id = Column(String(36), primary_key=True)
     name = Column(String(36))
     id_at_source = Column(String(36))
     type = Column(String(36))
-    properties = Column(String(1024))
+    properties = Column(JsonEncodedDict)
+    memory = Column(Integer)
+    vcpus = Column(Integer)
+    size = Column(Integer)
     migrated = Column(Boolean, default=False)
     source = Column(String(255),
                     nullable=False)
@@ -62,6 +103,15 @@ class Resources(BASE, GutsBase):
 class Migrations(BASE, GutsBase):
     """Represent migration."""
     __tablename__ = "migrations"
+    __table_args__ = (
+        Index('migrations_name_deleted_idx', 'name', 'deleted'),
+        Index('migrations_resource_id_idx', 'resource_id'),
+        Index('migrations_source_host_status_idx', 'source_host',
+              'migration_status'),
+        Index('migrations_destination_status_idx', 'destination_hypervisor',
+              'migration_status'),
+        GutsBase.__table_args__,
+    )
     id = Column(String(36), primary_key=True)
     name = Column(String(255))
     description = Column(String(255))
@@ -71,11 +121,26 @@ class Migrations(BASE, GutsBase):
                          ForeignKey('resources.id'))
     destination_hypervisor = Column(String(36),
                                     ForeignKey('services.id'))
+    disk_conversion = Column(String(255))
+    conversion_time_saved = Column(Float)
+    source_host = Column(String(255))
+    project_id = Column(String(255))
+    priority = Column(Integer, nullable=False, default=0)
+    bytes_logical = Column(BigInteger)
+    bytes_transferred = Column(BigInteger)
+
+    resource = relationship(Resources, lazy='select')
+    destination = relationship('Service', lazy='select')
 
 
 class Service(BASE, GutsBase):
     """Represents a running service on a host."""
     __tablename__ = 'services'
+    __table_args__ = (
+        Index('services_host_binary_idx', 'host', 'binary'),
+        Index('services_topic_disabled_idx', 'topic', 'disabled'),
+        GutsBase.__table_args__,
+    )
     id = Column(String(36), primary_key=True)
     host = Column(String(255))
     binary = Column(String(255))
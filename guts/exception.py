@@ -247,6 +247,10 @@ class InvalidSource(Invalid):
     message = _("Invalid source: %(reason)s.")
 
 
+class MarkerNotFound(Invalid):
+    message = _("Marker %(marker)s could not be found.")
+
+
 class MalformedRequestBody(GutsException):
     message = _("Malformed message body: %(reason)s")
 
@@ -272,6 +276,10 @@ class SourceCreateFailed(GutsException):
     message = _("Failed to create source %(name)s")
 
 
+class NoValidHost(GutsException):
+    message = _("No valid host was found. %(reason)s")
+
+
 class SchedulerHostFilterNotFound(NotFound):
     message = _("Scheduler Host Filter %(filter_name)s could not be found.")
 
@@ -305,6 +313,10 @@ class NetworkCreationFailed(GutsException):
     message = _("Failed to create network on destination. Reason: %(reason)s")
 
 
+class InstanceCreationFailed(GutsException):
+    message = _("Failed to create instance %(name)s: %(reason)s")
+
+
 class VolumeCreationFailed(GutsException):
     message = _("Failed to create volume on destination. Reason: %(reason)s")
 
@@ -319,6 +331,33 @@ class InstanceImageDownloadFailed(GutsException):
                 "Reason: %(reason)s")
 
 
+class DiskTransferFailed(GutsException):
+    message = _("Failed to transfer disk from %(url)s. Reason: %(reason)s")
+
+
+class DiskStreamFailed(GutsException):
+    message = _("Failed to stream disk through %(path)s. Reason: %(reason)s")
+
+
+class ImageChecksumMismatch(GutsException):
+    message = _("Checksum of image %(image_id)s does not match, expected "
+                "%(expected)s, got %(actual)s.")
+
+
+class ResourceWaitFailed(GutsException):
+    message = _("The %(resource)s %(id)s went into status %(status)s.")
+
+
+class ResourceWaitTimeout(GutsException):
+    message = _("Timed out waiting for the %(resource)s %(id)s, last status "
+                "%(status)s.")
+
+
+class InsufficientConversionSpace(GutsException):
+    message = _("Not enough space in %(path)s for migration %(id)s: "
+                "%(requested)s bytes requested, %(available)s available.")
+
+
 class InvalidPowerState(MigrationValidationFailed):
     message = _("Instance: %(instance_id)s cannot be migrated in its current "
                 "power state. Please shutdown virtual instance and retry.")
@@ -13,12 +13,39 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+"""Access to the Glance image service."""
 
-from glanceclient import Client
+import hashlib
 
+from glanceclient import Client
 from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import excutils
+from oslo_utils import timeutils
+from oslo_utils import units
+
+from guts import exception
+from guts.i18n import _LI, _LW
+from guts.migration import sparse
+
+
+image_transfer_opts = [
+    cfg.IntOpt('image_transfer_chunk_size',
+               default=1024,
+               min=4,
+               help='Size in KiB of the blocks image data is read and '
+                    'written in when transferring images to and from '
+                    'Glance.'),
+    cfg.BoolOpt('image_transfer_verify_checksum',
+                default=True,
+                help='Verify the checksum of the images transferred to and '
+                     'from Glance against the one recorded by Glance.'),
+]
 
 CONF = cfg.CONF
+CONF.register_opts(image_transfer_opts)
+
+LOG = logging.getLogger(__name__)
 
 
 class GlanceAPI(object):
@@ -36,3 +63,146 @@ class GlanceAPI(object):
             return img
         except Exception:
             raise
+
+
+class _ChecksumReader(object):
+    """File wrapper computing the checksum of the data read through it.
+
+    When the expected size or checksum of the data is given, reaching the
+    end of a file which does not match raises DiskStreamFailed, before
+    the reader of the data can take it as complete.
+    """
+
+    def __init__(self, fileobj, chunk_size, expected_size=None,
+                 expected_checksum=None):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.expected_size = expected_size
+        self.expected_checksum = expected_checksum
+        self.checksum = hashlib.md5()
+        self.bytes_read = 0
+
+    def _check_complete(self):
+        reason = None
+        if (self.expected_size is not None and
+                self.bytes_read != self.expected_size):
+            reason = 'read %d of %d bytes' % (self.bytes_read,
+                                              self.expected_size)
+        elif (self.expected_checksum and
+                self.checksum.hexdigest() != self.expected_checksum):
+            reason = 'checksum %s, expected %s' % (self.checksum.hexdigest(),
+                                                   self.expected_checksum)
+        if reason:
+            raise exception.DiskStreamFailed(path=self.fileobj.name,
+                                             reason=reason)
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.checksum.update(data)
+        self.bytes_read += len(data)
+        if not data or size < 0:
+            self._check_complete()
+        return data
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class ImageTransfer(object):
+    """Streams image data through an authenticated glanceclient.
+
+    Data goes through the client session of the driver, no process is
+    spawned and no new token is requested for a transfer.
+    """
+
+    def __init__(self, client, configuration):
+        self.client = client
+        self.chunk_size = configuration.image_transfer_chunk_size * units.Ki
+        self.verify_checksum = configuration.image_transfer_verify_checksum
+
+    def _verify(self, image, checksum):
+        if (self.verify_checksum and image.checksum and
+                image.checksum != checksum):
+            raise exception.ImageChecksumMismatch(image_id=image.id,
+                                                  expected=image.checksum,
+                                                  actual=checksum)
+
+    def _delete(self, image_id):
+        try:
+            self.client.images.delete(image_id)
+        except Exception as e:
+            LOG.warning(_LW('Failed to delete image %(id)s: %(err)s'),
+                        {'id': image_id, 'err': e})
+
+    def _log_throughput(self, action, image_id, nbytes, start_time):
+        duration = max(timeutils.delta_seconds(start_time,
+                                               timeutils.utcnow()), 1)
+        size_mb = float(nbytes) / units.Mi
+        LOG.info(_LI('%(action)s image %(id)s, %(sz).2f MB at '
+                     '%(mbps).2f MB/s'),
+                 {'action': action, 'id': image_id, 'sz': size_mb,
+                  'mbps': size_mb / duration})
+
+    def download(self, image_id, path):
+        """Write the data of the given image to path.
+
+        Blocks of zeroes are left as holes in the file.
+        """
+        image = self.client.images.get(image_id)
+        checksum = hashlib.md5()
+        nbytes = 0
+        start_time = timeutils.utcnow()
+        # glanceclient only checks the checksum once all the data has been
+        # read, the one computed here is checked instead.
+        data = self.client.images.data(image_id, do_checksum=False) or []
+        with open(path, 'wb', self.chunk_size) as f:
+            writer = sparse.SparseWriter(f)
+            for chunk in data:
+                checksum.update(chunk)
+                writer.write(chunk)
+                nbytes += len(chunk)
+            writer.finish()
+        self._verify(image, checksum.hexdigest())
+        self._log_throughput('Downloaded', image_id, nbytes, start_time)
+        if writer.skipped_bytes:
+            LOG.info(_LI('Left %(bytes)d bytes of zeroes of image %(id)s '
+                         'as holes.'),
+                     {'bytes': writer.skipped_bytes, 'id': image_id})
+        return image
+
+    def upload(self, name, path, disk_format, container_format='bare',
+               expected_size=None, expected_checksum=None):
+        """Create an image from the data at path and return it.
+
+        :param expected_size: size of the data, the upload fails and the
+                              image is deleted when less or more is read.
+        :param expected_checksum: md5 checksum of the data, checked the
+                                  same way.
+        """
+        start_time = timeutils.utcnow()
+        with open(path, 'rb') as f:
+            reader = _ChecksumReader(f, self.chunk_size,
+                                     expected_size=expected_size,
+                                     expected_checksum=expected_checksum)
+            if hasattr(self.client.images, 'upload'):
+                image = self.client.images.create(
+                    name=name, disk_format=disk_format,
+                    container_format=container_format)
+                try:
+                    self.client.images.upload(image.id, reader)
+                except Exception:
+                    with excutils.save_and_reraise_exception():
+                        self._delete(image.id)
+                image = self.client.images.get(image.id)
+            else:
+                image = self.client.images.create(
+                    name=name, disk_format=disk_format,
+                    container_format=container_format, data=reader)
+        self._verify(image, reader.checksum.hexdigest())
+        self._log_throughput('Uploaded', image.id, reader.bytes_read,
+                             start_time)
+        return image
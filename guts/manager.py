@@ -50,13 +50,25 @@ from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
 from oslo_service import periodic_task
+from oslo_utils import timeutils
 
 from guts.db import base
+from guts.scheduler import capabilities as capabilities_report
 from guts.scheduler import rpcapi as scheduler_rpcapi
 from guts import version
 
 
+manager_opts = [
+    cfg.IntOpt('capabilities_full_report_interval',
+               default=600,
+               min=0,
+               help='Seconds between two reports of the full capabilities '
+                    'of a service to the schedulers. Only the changes are '
+                    'reported in between.'),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(manager_opts)
 LOG = logging.getLogger(__name__)
 
 
@@ -111,6 +123,10 @@ class Manager(base.Base, PeriodicTasks):
             config[key] = CONF.get(key, None)
         return config
 
+    def reset(self):
+        """Hook called when the service is reset, e.g. on SIGHUP."""
+        pass
+
     def is_working(self):
         """Method indicating if service is working correctly.
 
@@ -134,22 +150,56 @@ class SchedulerDependentManager(Manager):
         self.last_capabilities = None
         self.service_name = service_name
         self.scheduler_rpcapi = scheduler_rpcapi.SchedulerAPI()
+        # Capabilities as of the last report sent, and its generation.
+        self._reported_capabilities = None
+        self._capabilities_generation = 0
+        self._last_full_report = None
         super(SchedulerDependentManager, self).__init__(host, db_driver)
 
     def update_service_capabilities(self, capabilities):
         """Remember these capabilities to send on next periodic update."""
         self.last_capabilities = capabilities
 
+    def _full_report_due(self):
+        return (self._reported_capabilities is None or
+                self._last_full_report is None or
+                timeutils.is_older_than(
+                    self._last_full_report,
+                    CONF.capabilities_full_report_interval))
+
     @periodic_task.periodic_task
-    def _publish_service_capabilities(self, context):
-        """Pass data back to the scheduler at a periodic interval."""
-        if self.last_capabilities:
-            LOG.debug('Notifying Schedulers of capabilities ...')
-            self.scheduler_rpcapi.update_service_capabilities(
-                context,
-                self.service_name,
-                self.host,
+    def _publish_service_capabilities(self, context, full=False):
+        """Pass data back to the scheduler at a periodic interval.
+
+        Only the changes since the previous report are sent, nothing at all
+        when there are none, except for a full report when asked for and
+        every capabilities_full_report_interval seconds.
+        """
+        if not self.last_capabilities:
+            return
+        generation = self._capabilities_generation + 1
+        full = full or self._full_report_due()
+        if full:
+            report = capabilities_report.make_full_report(
+                generation, self.last_capabilities)
+        else:
+            report = capabilities_report.make_delta_report(
+                generation, self._reported_capabilities,
                 self.last_capabilities)
+            if capabilities_report.is_empty(report):
+                return
+
+        LOG.debug('Notifying Schedulers of capabilities, generation %d ...',
+                  generation)
+        self.scheduler_rpcapi.update_service_capabilities(
+            context,
+            self.service_name,
+            self.host,
+            report)
+        self._capabilities_generation = generation
+        self._reported_capabilities = self.last_capabilities
+        if full:
+            self._last_full_report = timeutils.utcnow()
 
     def reset(self):
         super(SchedulerDependentManager, self).reset()
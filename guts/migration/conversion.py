@@ -0,0 +1,217 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Disk format negotiation and concurrent disk conversion.
+
+Every exported disk is probed once and compared with the formats the
+destination accepts. Disks already in an accepted format are used as they
+are, VMDK descriptors around a raw flat extent are dropped in favour of the
+extent, and only the remaining disks are converted.
+
+Conversions run in a bounded pool of workers. Every conversion also holds
+one of a fixed number of host wide slots, shared by all the migration
+services running on the host, so concurrent migrations do not
+oversubscribe its CPU and I/O.
+"""
+
+import contextlib
+import os
+import time
+
+from eventlet import greenpool
+from oslo_concurrency import lockutils
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import timeutils
+from oslo_utils import units
+
+from guts.i18n import _LI
+from guts import utils
+
+
+conversion_opts = [
+    cfg.IntOpt('host_max_conversions',
+               default=4,
+               min=1,
+               help='Maximum number of disk conversions running at the '
+                    'same time on this host, across all the source '
+                    'hypervisors and in-flight migrations.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(conversion_opts)
+
+LOG = logging.getLogger(__name__)
+
+SKIP = 'skip'
+REWRITE = 'rewrite'
+CONVERT = 'convert'
+
+# Conversion throughput assumed until one has been measured, in bytes/s.
+DEFAULT_THROUGHPUT = 100 * units.Mi
+
+# VMDK create types whose data lives in a raw flat extent.
+FLAT_VMDK_TYPES = ('monolithicFlat', 'vmfs')
+
+
+def negotiate(info, accepted_formats):
+    """Decide how to turn a probed disk into an accepted format.
+
+    :param info: QemuImgInfo of the disk.
+    :param accepted_formats: formats accepted by the destination, the
+                             first one is used when converting.
+    :returns: (action, target format) tuple.
+    """
+    if info.file_format in accepted_formats and not info.backing_file:
+        return SKIP, info.file_format
+    if (info.file_format == 'vmdk' and 'raw' in accepted_formats and
+            info.create_type in FLAT_VMDK_TYPES and info.extent_filename):
+        return REWRITE, 'raw'
+    return CONVERT, accepted_formats[0]
+
+
+def _get_converted_path(path, out_format):
+    base = os.path.splitext(path)[0]
+    converted_path = '%s.%s' % (base, out_format)
+    if converted_path == path:
+        converted_path = '%s.converted.%s' % (base, out_format)
+    return converted_path
+
+
+class Disk(object):
+    """A disk of a resource and what negotiation decided for it."""
+
+    def __init__(self, index, path):
+        self.index = index
+        self.source_path = path
+        self.path = path
+        self.info = None
+        self.action = None
+        self.disk_format = None
+
+    def describe(self):
+        if self.action == CONVERT:
+            return '%s:%s(%s->%s)' % (self.index, self.action,
+                                      self.info.file_format, self.disk_format)
+        return '%s:%s(%s)' % (self.index, self.action, self.disk_format)
+
+
+class HostSlots(object):
+    """Counting semaphore shared by all the processes of a host.
+
+    Each slot is an external lock file. Services are run in separate
+    processes, and green threads of one process share its file locks, so
+    slots held by this process are tracked separately.
+    """
+
+    _held = set()
+
+    def __init__(self, name, count):
+        self.name = name
+        self.count = count
+
+    def _try_acquire(self):
+        for index in range(self.count):
+            if index in self._held:
+                continue
+            lock = lockutils.external_lock('%s-%d' % (self.name, index),
+                                           lock_file_prefix='guts-')
+            if lock.acquire(blocking=False):
+                self._held.add(index)
+                return index, lock
+        return None, None
+
+    @contextlib.contextmanager
+    def slot(self):
+        index, lock = self._try_acquire()
+        while lock is None:
+            time.sleep(1)
+            index, lock = self._try_acquire()
+        try:
+            yield index
+        finally:
+            self._held.discard(index)
+            lock.release()
+
+
+class ConversionPool(object):
+    """Negotiates formats and converts the disks of a resource."""
+
+    def __init__(self, configuration):
+        self.workers = configuration.conversion_workers
+        self.coroutines = configuration.qemu_img_coroutines
+        self.out_of_order = configuration.qemu_img_out_of_order
+        self.host_slots = HostSlots('conversion-slot',
+                                    CONF.host_max_conversions)
+        self.throughput = DEFAULT_THROUGHPUT
+
+    def _record_throughput(self, nbytes, duration):
+        # Exponential moving average over the conversions of this service.
+        if nbytes and duration > 0:
+            self.throughput = (self.throughput + nbytes / duration) / 2
+
+    def estimate_duration(self, disk):
+        """Estimated seconds a conversion of the given disk would take."""
+        return float(disk.info.virtual_size or 0) / self.throughput
+
+    def _convert(self, disk):
+        with self.host_slots.slot() as index:
+            LOG.info(_LI('Converting %(src)s to %(fmt)s in host slot '
+                         '%(slot)d.'),
+                     {'src': disk.source_path, 'fmt': disk.disk_format,
+                      'slot': index})
+            start_time = timeutils.utcnow()
+            utils.convert_image(disk.source_path, disk.path,
+                                disk.disk_format,
+                                coroutines=self.coroutines,
+                                out_of_order=self.out_of_order)
+            duration = timeutils.delta_seconds(start_time,
+                                               timeutils.utcnow())
+        self._record_throughput(disk.info.virtual_size, duration)
+
+    def negotiate(self, disk, accepted_formats):
+        """Probe the disk and decide how it reaches an accepted format."""
+        disk.info = utils.qemu_img_info(disk.source_path)
+        disk.action, disk.disk_format = negotiate(disk.info,
+                                                  accepted_formats)
+        if disk.action == REWRITE:
+            # Extents are named relative to their descriptor.
+            disk.path = os.path.join(os.path.dirname(disk.source_path),
+                                     disk.info.extent_filename)
+        elif disk.action == CONVERT:
+            disk.path = _get_converted_path(disk.source_path,
+                                            disk.disk_format)
+        LOG.info(_LI('Disk %(path)s is %(fmt)s, %(action)s.'),
+                 {'path': disk.source_path, 'fmt': disk.info.file_format,
+                  'action': disk.describe()})
+        return disk
+
+    def convert(self, disks):
+        """Convert the given negotiated disks which need it."""
+        pool = greenpool.GreenPool(self.workers)
+        errors = []
+
+        def _worker(disk):
+            try:
+                self._convert(disk)
+            except Exception as e:
+                errors.append(e)
+
+        for disk in disks:
+            if disk.action == CONVERT:
+                pool.spawn_n(_worker, disk)
+        pool.waitall()
+        if errors:
+            raise errors[0]
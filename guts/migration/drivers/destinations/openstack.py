@@ -13,11 +13,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import math
+
 from cinderclient import client as cinder_client
+from eventlet import greenthread
+from eventlet import semaphore
 from glanceclient import client as glance_client
 from guts import exception
-from guts.i18n import _, _LE
+from guts.i18n import _, _LE, _LI, _LW
+from guts.image import glance
 from guts.migration.drivers import driver
+from guts.migration.drivers.destinations import volume_targets
+from guts.migration import pipeline
+from guts.migration import waiter
 from guts import utils
 from keystoneauth1.identity import v3
 from keystoneauth1 import session as v3_session
@@ -26,6 +34,8 @@ from keystoneclient import session as v2_session
 from novaclient import client as nova_client
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import excutils
+from oslo_utils import units
 
 openstack_destination_opts = [
     cfg.StrOpt('auth_url',
@@ -47,6 +57,38 @@ openstack_destination_opts = [
                default='v2',
                choices=['v2', 'v3'],
                help="User's domain ID for authentication"),
+    cfg.StrOpt('instance_boot_mode',
+               default='image',
+               choices=['image', 'volume'],
+               help='Boot migrated instances from a Glance image of their '
+                    'root disk, copied to the compute node at first boot, '
+                    'or from a Cinder volume holding it.'),
+    cfg.StrOpt('default_flavor',
+               default='2',
+               help='ID of the flavor of migrated instances whose source '
+                    'does not report their vcpus and memory.'),
+    cfg.StrOpt('volume_import_mode',
+               default='glance',
+               choices=['glance', 'attach'],
+               help='How volumes are imported: uploaded to Glance and '
+                    'copied by Cinder from the image, or written directly '
+                    'to a new volume attached to this host with os-brick.'),
+    cfg.BoolOpt('volume_import_multipath',
+                default=False,
+                help='Attach volumes imported directly with multipath.'),
+    cfg.BoolOpt('volume_import_target_is_zero',
+                default=False,
+                help='New volumes of the destination read as zeroes, as '
+                     'thin provisioned or wiped volumes do. Holes and '
+                     'zeroes of the disks imported directly are then not '
+                     'written to them at all. Requires qemu-img 5.0 or '
+                     'later.'),
+    cfg.IntOpt('max_concurrent_uploads',
+               default=4,
+               min=1,
+               help='Maximum number of disk images uploaded to Glance at '
+                    'the same time by this destination, across all the '
+                    'migrations.'),
 ]
 
 LOG = logging.getLogger(__name__)
@@ -54,9 +96,17 @@ LOG = logging.getLogger(__name__)
 
 class OpenStackDestinationDriver(driver.DestinationDriver):
     """OpenStack Destination Hypervisor"""
+
+    accepted_disk_formats = ['qcow2', 'raw']
+
     def __init__(self, *args, **kwargs):
         super(OpenStackDestinationDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(openstack_destination_opts)
+        self.configuration.append_config_values(waiter.waiter_opts)
+        self.configuration.append_config_values(
+            glance.image_transfer_opts)
+        self._upload_slots = semaphore.Semaphore(
+            self.configuration.max_concurrent_uploads)
 
     def do_setup(self, context):
         """Any initialization the destination driver does while starting."""
@@ -87,6 +137,23 @@ class OpenStackDestinationDriver(driver.DestinationDriver):
         self.nova = nova_client.Client(nova_api_version, session=sess)
         self.cinder = cinder_client.Client(cinder_api_version, session=sess)
         self.glance = glance_client.Client(glance_api_version, session=sess)
+        self.volume_waiter = waiter.ResourceWaiter(
+            'volume', '%s:volume' % auth_url, self.cinder.volumes.get,
+            lambda status: self.cinder.volumes.list(
+                search_opts={'status': status}),
+            self.configuration)
+        self.server_waiter = waiter.ResourceWaiter(
+            'server', '%s:compute' % auth_url, self.nova.servers.get,
+            lambda status: self.nova.servers.list(
+                search_opts={'status': status}),
+            self.configuration)
+        self.volume_target = None
+        import_mode = self.configuration.volume_import_mode
+        if import_mode in volume_targets.TARGETS:
+            self.volume_target = volume_targets.TARGETS[import_mode](
+                self.cinder, self.configuration)
+        self.image_transfer = glance.ImageTransfer(self.glance,
+                                                   self.configuration)
         self._initialized = True
 
     def create_network(self, context, **kwargs):
@@ -99,62 +166,269 @@ class OpenStackDestinationDriver(driver.DestinationDriver):
                           "destination: %s"), kwargs['label'], e) 
             raise exception.NetworkCreationFailed(reason=e.message)
 
+    def get_sparse_imports(self):
+        # Only disks written by qemu-img leave their holes out, Glance
+        # uploads carry every byte.
+        if self.configuration.volume_import_mode not in volume_targets.TARGETS:
+            return []
+        kinds = ['volume', 'disk']
+        if self.configuration.instance_boot_mode == 'volume':
+            kinds.append('root_disk')
+        return kinds
+
+    def _can_import_directly(self, path, disk_format):
+        # qemu-img reads streamed disks itself, their size and checksum
+        # could not be checked before the volume is kept.
+        return (self.volume_target is not None and
+                not pipeline.is_pipe(path))
+
+    def _write_volume(self, path, disk_format, device):
+        # qemu-img only reads the data extents of a sparse disk and writes
+        # its holes and zeroes as such. The format negotiated by the source
+        # is always given, qemu-img must not probe a guest controlled disk
+        # as root.
+        cmd = ['qemu-img', 'convert', '-n', '-t', 'none',
+               '-f', disk_format, '-O', 'raw']
+        if self.configuration.volume_import_target_is_zero:
+            cmd.append('--target-is-zero')
+        utils.execute(*(cmd + [path, device]), run_as_root=True)
+
+    def _import_volume(self, name, path, disk_format, size):
+        """Write a disk to a new volume, without going through Glance."""
+        vol = self.cinder.volumes.create(display_name=name, size=size)
+        try:
+            vol = self.volume_waiter.wait(vol.id, ready=('available',),
+                                          failed=('error',))
+            with self.volume_target.attached(vol) as device:
+                self._write_volume(path, disk_format, device)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                try:
+                    self.cinder.volumes.delete(vol.id)
+                except Exception as e:
+                    LOG.warning(_LW('Failed to delete volume %(id)s: '
+                                    '%(err)s'), {'id': vol.id, 'err': e})
+        LOG.info(_LI('Imported %(path)s directly into volume %(id)s.'),
+                 {'path': path, 'id': vol.id})
+        return vol
+
     def create_volume(self, context, **kwargs):
         if not self._initialized:
             self.do_setup(context)
+        disk_format = kwargs.get('disk_format', 'raw')
+        if self._can_import_directly(kwargs['path'], disk_format):
+            try:
+                self._import_volume(kwargs['name'], kwargs['path'],
+                                    disk_format, int(kwargs['size']))
+                utils.execute('rm', '-f', kwargs['path'], run_as_root=True)
+            except Exception as e:
+                LOG.error(_LE('Failed to import volume %(name)s at '
+                              'destination: %(err)s'),
+                          {'name': kwargs['name'], 'err': e})
+                raise exception.VolumeCreationFailed(reason=e)
+            return
+
         image_name = kwargs['mig_ref_id']
         try:
-            self._upload_image_to_glance(image_name, kwargs['path'])
-            utils.execute('rm', kwargs['path'], run_as_root=True)
-            img = self.glance.images.find(name=image_name)
+            img = self._upload_image_to_glance(
+                image_name, kwargs['path'], kwargs.get('disk_format', 'raw'),
+                stream=kwargs.get('stream'))
+            # Streamed disks are removed by the source once consumed.
+            utils.execute('rm', '-f', kwargs['path'], run_as_root=True)
             if img.status != 'active':
                 raise Exception
             vol = self.cinder.volumes.create(display_name=kwargs['name'],
                                              size=int(kwargs['size']),
                                              imageRef=img.id)
-            while vol.status != 'available':
-                vol = self.cinder.volumes.get(vol.id)
+            self.volume_waiter.wait(vol.id, ready=('available',),
+                                    failed=('error',))
             self.glance.images.delete(img.id)
         except Exception as e:
             LOG.error(_LE('Failed to create volume from image at destination '
                           'image_name: %s %s'), image_name, e)
             raise exception.VolumeCreationFailed(reason=e.message)
 
-    def _upload_image_to_glance(self, image_name, file_path):
-        out, err = utils.execute('glance', '--os-username',
-                                 self.configuration.username,
-                                 '--os-password', self.configuration.password,
-                                 '--os-tenant-name',
-                                 self.configuration.tenant_name,
-                                 '--os-auth-url', self.configuration.auth_url,
-                                 'image-create', '--file', file_path,
-                                 '--disk-format', 'raw', '--container-format',
-                                 'bare', '--name', image_name,
-                                 run_as_root=True)
-
-    def nova_boot(self, instance_name, image_name):
-        out, err = utils.execute('nova', '--os-username',
-                                 self.configuration.username, '--os-password',
-                                 self.configuration.password,
-                                 '--os-tenant-name',
-                                 self.configuration.tenant_name,
-                                 '--os-auth-url', self.configuration.auth_url,
-                                 'boot', '--image', image_name, '--flavor',
-                                 '2', instance_name, run_as_root=True)
+    def _upload_image_to_glance(self, image_name, file_path,
+                                disk_format='raw', stream=None):
+        """Upload a disk to a new image.
 
-    def create_instance(self, context, **kwargs):
-        disks = kwargs['disks']
-        mig_ref = kwargs['mig_ref_id']
-        count = 0
-        for disk in disks:
-            image_name = "%s_%s" % (mig_ref, count)
-            self._upload_image_to_glance(image_name, disk[str(count)])
-            if count == 0:
-                self.nova_boot(kwargs['name'], image_name)
+        :param stream: expected 'size' and 'checksum' of a streamed disk.
+        """
+        stream = stream or {}
+        return self.image_transfer.upload(
+            image_name, file_path, disk_format,
+            expected_size=stream.get('size'),
+            expected_checksum=stream.get('checksum'))
+
+    def _choose_flavor(self, name, vcpus, memory, root_gb=None):
+        """Return the smallest flavor fitting the source instance.
+
+        :param root_gb: size of the root disk the flavor needs room for,
+                        None when booting from a volume.
+        """
+        if not vcpus or not memory:
+            return self.nova.flavors.get(self.configuration.default_flavor)
+        candidates = [flavor for flavor in self.nova.flavors.list()
+                      if flavor.vcpus >= int(vcpus) and
+                      flavor.ram >= int(memory) and
+                      (not root_gb or not flavor.disk or
+                       flavor.disk >= root_gb)]
+        if not candidates:
+            raise exception.InstanceCreationFailed(
+                name=name,
+                reason=_('no flavor has %(vcpus)s vcpus and %(memory)s MB '
+                         'of memory') % {'vcpus': vcpus, 'memory': memory})
+        return min(candidates,
+                   key=lambda flavor: (flavor.vcpus, flavor.ram, flavor.disk))
+
+    def _boot(self, instance, image=None, volume=None, root_gb=None):
+        """Boot the instance from its root disk image or volume.
+
+        A server which does not become active is deleted.
+        """
+        name = instance['name']
+        flavor = self._choose_flavor(name, instance.get('vcpus'),
+                                     instance.get('memory'),
+                                     root_gb=None if volume else root_gb)
+        if volume is not None:
+            bdm = [{'boot_index': 0,
+                    'uuid': volume.id,
+                    'source_type': 'volume',
+                    'destination_type': 'volume',
+                    'delete_on_termination': False}]
+            server = self.nova.servers.create(name, None, flavor,
+                                              block_device_mapping_v2=bdm)
+        else:
+            server = self.nova.servers.create(name, image.id, flavor)
+        LOG.info(_LI('Booting instance %(name)s as %(id)s with flavor '
+                     '%(flavor)s.'),
+                 {'name': name, 'id': server.id, 'flavor': flavor.name})
+        try:
+            self.server_waiter.wait(server.id, ready=('ACTIVE',),
+                                    failed=('ERROR',))
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                try:
+                    self.nova.servers.delete(server.id)
+                except Exception as e:
+                    LOG.warning(_LW('Failed to delete server %(id)s: '
+                                    '%(err)s'), {'id': server.id, 'err': e})
+
+    def _delete_root_volume(self, volume):
+        """Delete the root volume of an instance which failed to boot."""
+        try:
+            # The volume is detached once its server is deleted.
+            self.volume_waiter.wait(volume.id, ready=('available',),
+                                    failed=('error',))
+            self.cinder.volumes.delete(volume.id)
+        except Exception as e:
+            LOG.warning(_LW('Failed to delete volume %(id)s: %(err)s'),
+                        {'id': volume.id, 'err': e})
+
+    def _get_disk_size(self, path, disk_size, disk_format, image=None):
+        """Return the virtual size of a disk in GB, rounded up.
+
+        None is returned when the size is unknown.
+        """
+        if not disk_size and not pipeline.is_pipe(path):
+            # The disk comes from the guest, its format is not probed.
+            disk_size = utils.qemu_img_info(
+                path, disk_format=disk_format).virtual_size
+        if not disk_size and image is not None:
+            disk_size = getattr(image, 'virtual_size', None) or image.size
+        if not disk_size:
+            return None
+        return max(1, int(math.ceil(float(disk_size) / units.Gi)))
+
+    def _upload_disk(self, image_name, path, disk_format, stream=None):
+        if pipeline.is_pipe(path):
+            # Streamed disks are paced by the source, which gives up when
+            # they are not read in time.
+            return self._upload_image_to_glance(image_name, path,
+                                                disk_format, stream=stream)
+        with self._upload_slots:
+            return self._upload_image_to_glance(image_name, path,
+                                                disk_format)
+
+    def _create_disk_volume(self, display_name, image_name, path,
+                            disk_format, disk_size, stream=None):
+        """Create a volume holding a disk of an instance."""
+        size = self._get_disk_size(path, disk_size, disk_format)
+        if size and self._can_import_directly(path, disk_format):
+            return self._import_volume(display_name, path, disk_format, size)
+
+        img = self._upload_disk(image_name, path, disk_format, stream=stream)
+        vol = self.cinder.volumes.create(
+            display_name=display_name,
+            size=size or self._get_disk_size(path, disk_size, disk_format,
+                                             img),
+            imageRef=img.id)
+        vol = self.volume_waiter.wait(vol.id, ready=('available',),
+                                      failed=('error',))
+        self.glance.images.delete(img.id)
+        return vol
+
+    def _import_disk(self, instance, image_name, index, path, disk_format,
+                     disk_size):
+        """Create what the instance needs from one of its disks."""
+        name = instance['name']
+        stream = instance.get('disk_streams', {}).get(index)
+        if index == '0':
+            if self.configuration.instance_boot_mode == 'volume':
+                vol = self._create_disk_volume("%s_root" % name, image_name,
+                                               path, disk_format, disk_size,
+                                               stream=stream)
+                try:
+                    self._boot(instance, volume=vol)
+                except Exception:
+                    with excutils.save_and_reraise_exception():
+                        self._delete_root_volume(vol)
             else:
-                img = self.glance.images.find(name=image_name)
-                self.cinder.volumes.create(
-                    display_name="%s_vol" % kwargs['name'],
-                    size=8,
-                    imageRef=img.id)
-            count += 1
+                img = self._upload_disk(image_name, path, disk_format,
+                                        stream=stream)
+                self._boot(instance, image=img,
+                           root_gb=self._get_disk_size(path, disk_size,
+                                                       disk_format, img))
+            return
+        vol = self._create_disk_volume("%s_vol%s" % (name, index),
+                                       image_name, path, disk_format,
+                                       disk_size, stream=stream)
+        LOG.info(_LI('Created volume %(vol)s from disk %(index)s of '
+                     '%(name)s.'),
+                 {'vol': vol.id, 'index': index, 'name': name})
+
+    def create_instance(self, context, **kwargs):
+        """Import all the disks of an instance concurrently.
+
+        The instance boots as soon as its root disk is uploaded, or turned
+        into a volume when booting from volumes, while the other disks are
+        still being uploaded or turned into volumes.
+        """
+        if not self._initialized:
+            self.do_setup(context)
+        disk_formats = kwargs.get('disk_formats', {})
+        disk_sizes = kwargs.get('disk_sizes', {})
+        name = kwargs['name']
+        threads = []
+        for disk in kwargs['disks']:
+            index, path = list(disk.items())[0]
+            image_name = "%s_%s" % (kwargs['mig_ref_id'], index)
+            threads.append((index, path, greenthread.spawn(
+                self._import_disk, kwargs, image_name, index, path,
+                disk_formats.get(index, 'raw'), disk_sizes.get(index))))
+
+        errors = []
+        for index, path, thread in threads:
+            try:
+                thread.wait()
+            except Exception as e:
+                LOG.error(_LE('Failed to import disk %(index)s of instance '
+                              '%(name)s: %(err)s'),
+                          {'index': index, 'name': name, 'err': e})
+                errors.append('%s: %s' % (index, e))
+            finally:
+                # Imported or not, the staged disk is of no use anymore.
+                utils.execute('rm', '-f', path, run_as_root=True)
+        if errors:
+            raise exception.InstanceCreationFailed(name=name,
+                                                   reason='; '.join(errors))
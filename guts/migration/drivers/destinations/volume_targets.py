@@ -0,0 +1,131 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Attaching destination volumes as local block devices.
+
+Disks imported directly into Cinder are written to an empty volume
+attached to the destination host, instead of being uploaded to Glance and
+copied again by Cinder from the image.
+"""
+
+import contextlib
+import os
+import socket
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import units
+
+from guts import exception
+from guts.i18n import _LW
+from guts import utils
+
+
+CONF = cfg.CONF
+CONF.import_opt('my_ip', 'guts.common.config')
+
+LOG = logging.getLogger(__name__)
+
+
+class VolumeTarget(object):
+    """Attaches Cinder volumes to this host as block devices."""
+
+    def __init__(self, cinder, configuration):
+        self.cinder = cinder
+        self.configuration = configuration
+
+    @contextlib.contextmanager
+    def attached(self, volume):
+        """Attach the volume for the duration of the context.
+
+        Yields the path of the local block device of the volume.
+        """
+        raise NotImplementedError()
+
+
+class BrickVolumeTarget(VolumeTarget):
+    """Attaches volumes with os-brick, over the protocol of the backend."""
+
+    def __init__(self, *args, **kwargs):
+        super(BrickVolumeTarget, self).__init__(*args, **kwargs)
+        # Imported here, the other import modes do not need os-brick.
+        from os_brick.initiator import connector
+        self._connector_module = connector
+        self.multipath = self.configuration.volume_import_multipath
+        self.properties = connector.get_connector_properties(
+            utils.get_root_helper(), CONF.my_ip, self.multipath,
+            enforce_multipath=False)
+
+    @contextlib.contextmanager
+    def attached(self, volume):
+        self.cinder.volumes.reserve(volume)
+        try:
+            conn_info = self.cinder.volumes.initialize_connection(
+                volume, self.properties)
+        except Exception:
+            self.cinder.volumes.unreserve(volume)
+            raise
+        protocol = conn_info['driver_volume_type']
+        brick = self._connector_module.InitiatorConnector.factory(
+            protocol, utils.get_root_helper(), use_multipath=self.multipath)
+        try:
+            device = brick.connect_volume(conn_info['data'])
+            try:
+                self.cinder.volumes.attach(volume, None, None,
+                                           host_name=socket.gethostname())
+                try:
+                    yield device['path']
+                finally:
+                    self.cinder.volumes.detach(volume)
+            finally:
+                brick.disconnect_volume(conn_info['data'], device)
+        finally:
+            self.cinder.volumes.terminate_connection(volume, self.properties)
+
+
+class LoopVolumeTarget(VolumeTarget):
+    """Stands in for an attached volume with a local loop device.
+
+    The data stays in a file of the conversion directory and never reaches
+    the volume, this is only meant to exercise the direct import path
+    without a storage backend. It is not one of the import modes, and an
+    import through it always fails once the disk is written, so it cannot
+    leave an empty volume behind as a migrated one.
+    """
+
+    @contextlib.contextmanager
+    def attached(self, volume):
+        path = os.path.join(self.configuration.conversion_dir,
+                            '%s.loop' % volume.id)
+        with open(path, 'wb') as f:
+            f.truncate(int(volume.size) * units.Gi)
+        device = utils.execute('losetup', '--find', '--show', path,
+                               run_as_root=True)[0].strip()
+        LOG.warning(_LW('Volume %(id)s is written to the loop device '
+                        '%(device)s, its data does not reach Cinder.'),
+                    {'id': volume.id, 'device': device})
+        try:
+            yield device
+        finally:
+            utils.execute('losetup', '--detach', device, run_as_root=True)
+            os.remove(path)
+        raise exception.VolumeCreationFailed(
+            reason='volume %s was written to a test loop device' % volume.id)
+
+
+# Import modes writing to volumes attached to this host.
+TARGETS = {
+    'attach': BrickVolumeTarget,
+}
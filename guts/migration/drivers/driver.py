@@ -34,6 +34,12 @@ class MigrationDriver(object):
 
 class SourceDriver(MigrationDriver):
     """This is the base class for all source hypervisor drivers."""
+
+    # Drivers able to export disks as sequential byte streams, in a format
+    # the destination accepts without conversion, set this to True and
+    # implement stream_instance() and stream_volume().
+    supports_streaming = False
+
     def __init__(self, *args, **kwargs):
         super(SourceDriver, self).__init__(*args, **kwargs)
         self.exclude = self.configuration.exclude.split(',')
@@ -50,8 +56,51 @@ class SourceDriver(MigrationDriver):
         msg = _("The method get_networks_list is not implemented.")
         raise NotImplementedError(msg)
 
+    def get_resource_changes(self, context, resource_type):
+        """Return the resources changed since the previous call.
+
+        Drivers able to track their inventory incrementally return a dict
+        with the 'updated' resources and the ids of the 'removed' ones.
+        None means the full list has to be retrieved instead.
+        """
+        return None
+
+    def stream_instance(self, context, instance_id):
+        """Export the disks of an instance as byte streams.
+
+        :returns: list of (disk index, disk format, size, md5 checksum,
+                  chunk iterable) tuples. The checksum may be None. A
+                  chunk iterable with a close() method is closed once the
+                  migration is done with it, streamed or not.
+        """
+        msg = _("The method stream_instance is not implemented.")
+        raise NotImplementedError(msg)
+
+    def stream_volume(self, context, volume_id, migration_ref_id):
+        """Export a volume as a byte stream.
+
+        :returns: (disk format, size, md5 checksum, chunk iterable) tuple.
+                  The checksum may be None. The chunk iterable is closed
+                  as in stream_instance().
+        """
+        msg = _("The method stream_volume is not implemented.")
+        raise NotImplementedError(msg)
+
 
 class DestinationDriver(MigrationDriver):
     """This is the base class for all destination hypervisor drivers."""
+
+    # Disk formats the destination can import, in order of preference.
+    # Disks in any other format are converted to the first one.
+    accepted_disk_formats = ['qcow2']
+
     def __init__(self, *args, **kwargs):
         super(DestinationDriver, self).__init__(*args, **kwargs)
+
+    def get_sparse_imports(self):
+        """Return the kinds of disks written without their holes.
+
+        Kinds are 'volume', 'root_disk' and 'disk' for the other disks of
+        an instance. Every byte of the other disks is sent, holes included.
+        """
+        return []
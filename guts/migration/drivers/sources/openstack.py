@@ -19,9 +19,10 @@ import os
 from cinderclient import client as cinder_client
 from glanceclient import client as glance_client
 from guts import exception
-from guts.i18n import _, _LE
+from guts.i18n import _, _LE, _LW
+from guts.image import glance
 from guts.migration.drivers import driver
-from guts import utils
+from guts.migration import waiter
 from keystoneauth1.identity import v3
 from keystoneauth1 import session as v3_session
 from keystoneclient.auth.identity import v2
@@ -30,6 +31,7 @@ from novaclient import client as nova_client
 
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import excutils
 
 
 openstack_source_opts = [
@@ -61,11 +63,45 @@ openstack_source_opts = [
 LOG = logging.getLogger(__name__)
 
 
+class _ImageStream(object):
+    """Data of an intermediate image, which is deleted once closed.
+
+    The stream is closed whether it was read or not, so the image does
+    not outlive a migration which failed before streaming began.
+    """
+
+    def __init__(self, glance_client, image_id):
+        self.glance = glance_client
+        self.image_id = image_id
+        self._closed = False
+
+    def __iter__(self):
+        for chunk in self.glance.images.data(self.image_id):
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.glance.images.delete(self.image_id)
+        except Exception as e:
+            LOG.warning(_LW('Failed to delete intermediate image %(id)s: '
+                            '%(err)s'), {'id': self.image_id, 'err': e})
+
+
 class OpenStackSourceDriver(driver.SourceDriver):
     """OpenStack Source Hypervisor"""
+
+    # Glance images are already in a format the destination accepts.
+    supports_streaming = True
+
     def __init__(self, *args, **kwargs):
         super(OpenStackSourceDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(openstack_source_opts)
+        self.configuration.append_config_values(waiter.waiter_opts)
+        self.configuration.append_config_values(
+            glance.image_transfer_opts)
 
     def do_setup(self, context):
         """Any initialization the source driver does while starting."""
@@ -97,6 +133,13 @@ class OpenStackSourceDriver(driver.SourceDriver):
         self.nova = nova_client.Client(nova_api_version, session=sess)
         self.cinder = cinder_client.Client(cinder_api_version, session=sess)
         self.glance = glance_client.Client(glance_api_version, session=sess)
+        self.image_waiter = waiter.ResourceWaiter(
+            'image', '%s:image' % auth_url, self.glance.images.get,
+            lambda status: self.glance.images.list(
+                filters={'status': status}),
+            self.configuration)
+        self.image_transfer = glance.ImageTransfer(self.glance,
+                                                   self.configuration)
         self._initialized = True
 
     def get_instances_list(self, context):
@@ -148,16 +191,38 @@ class OpenStackSourceDriver(driver.SourceDriver):
 
         return networks
 
+    def _create_instance_image(self, instance_id):
+        """Snapshot the given instance and return the active image."""
+        instance = self.nova.servers.get(instance_id)
+        image_id = instance.create_image(instance_id)
+        return self._wait_for_image(image_id)
+
+    def _wait_for_image(self, image_id):
+        try:
+            return self.image_waiter.wait(image_id, ready=('active',),
+                                          failed=('killed', 'deleted'))
+        except exception.GutsException:
+            with excutils.save_and_reraise_exception():
+                self.glance.images.delete(image_id)
+
+    def _create_volume_image(self, volume_id, image_name):
+        """Upload the given volume to an image and return it once active."""
+        vol = self.cinder.volumes.get(volume_id)
+        status = self.cinder.volumes.upload_to_image(vol, True, image_name,
+                                                     'bare', 'raw')
+        img_id = status[1]['os-volume_upload_image']['image_id']
+        return self._wait_for_image(img_id)
+
+    def _stream_image(self, image_id):
+        """Return the image data, the image is deleted once closed."""
+        return _ImageStream(self.glance, image_id)
+
     def get_instance(self, context, instance_id):
         """Downloads given instance to local conversion directory."""
         if not self._initialized:
             self.do_setup()
         try:
-            instance = self.nova.servers.get(instance_id)
-            image_id = instance.create_image(instance_id)
-            img = self.glance.images.get(image_id)
-            while img.status != 'active':
-                img = self.glance.images.get(image_id)
+            image_id = self._create_instance_image(instance_id).id
             image_path = os.path.join(self.configuration.conversion_dir,
                                       image_id)
             self._download_image_from_glance(image_id, image_path)
@@ -168,6 +233,19 @@ class OpenStackSourceDriver(driver.SourceDriver):
             raise exception.InstanceImageDownloadFailed(reason=e.message)
         return [{'0': image_path}]
 
+    def stream_instance(self, context, instance_id):
+        """Streams the image of the given instance."""
+        if not self._initialized:
+            self.do_setup(context)
+        try:
+            img = self._create_instance_image(instance_id)
+        except Exception as e:
+            LOG.error(_LE('Failed to create instance image at source, '
+                          'instance_id: %s, %s'), instance_id, e)
+            raise exception.InstanceImageDownloadFailed(reason=e)
+        return [('0', img.disk_format, img.size, img.checksum,
+                 self._stream_image(img.id))]
+
     def get_network(self, context, network_id):
         """Get Network information from source hypervisor.
 
@@ -182,14 +260,7 @@ class OpenStackSourceDriver(driver.SourceDriver):
         if not self._initialized:
             self.do_setup()
         try:
-            vol = self.cinder.volumes.get(volume_id)
-            status = self.cinder.volumes.upload_to_image(vol, True,
-                                                         migration_ref_id,
-                                                         'bare', 'raw')
-            img_id = status[1]['os-volume_upload_image']['image_id']
-            vol_img = self.glance.images.get(img_id)
-            while vol_img.status != 'active':
-                vol_img = self.glance.images.get(img_id)
+            vol_img = self._create_volume_image(volume_id, migration_ref_id)
             image_path = os.path.join(self.configuration.conversion_dir,
                                       migration_ref_id)
             self._download_image_from_glance(vol_img.id, image_path)
@@ -200,11 +271,18 @@ class OpenStackSourceDriver(driver.SourceDriver):
             raise exception.VolumeDownloadFailed(reason=e.message)
         return image_path
 
+    def stream_volume(self, context, volume_id, migration_ref_id):
+        """Streams the given volume through an intermediate image."""
+        if not self._initialized:
+            self.do_setup(context)
+        try:
+            vol_img = self._create_volume_image(volume_id, migration_ref_id)
+        except Exception as e:
+            LOG.error(_LE('Failed to create volume image at source, id: %s, '
+                          '%s'), volume_id, e)
+            raise exception.VolumeDownloadFailed(reason=e)
+        return (vol_img.disk_format, vol_img.size, vol_img.checksum,
+                self._stream_image(vol_img.id))
+
     def _download_image_from_glance(self, image_id, file_path):
-            out, err = utils.execute(
-                'glance', '--os-username', self.configuration.username,
-                '--os-password', self.configuration.password,
-                '--os-tenant-name', self.configuration.tenant_name,
-                '--os-auth-url', self.configuration.auth_url,
-                'image-download', '--file', file_path,
-                image_id, run_as_root=True)
+        self.image_transfer.download(image_id, file_path)
@@ -15,17 +15,23 @@
 
 
 import atexit
+import math
 import os
+import threading
 import time
 
 from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import excutils
+from oslo_utils import units
 
 from pyVim import connect
 from pyVmomi import vim
-from threading import Thread
+from pyVmomi import vmodl
 
+from guts.i18n import _LW
 from guts.migration.drivers import driver
-from guts import utils
+from guts.migration import transfer
 
 vsphere_source_opts = [
     cfg.StrOpt('vsphere_host',
@@ -40,28 +46,133 @@ vsphere_source_opts = [
     cfg.StrOpt('vsphere_port',
                default='443',
                help='Port to connect to VShpere server'),
+    cfg.IntOpt('vsphere_page_size',
+               default=500,
+               min=1,
+               help='Maximum number of objects returned by a single '
+                    'VSphere inventory request.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(vsphere_source_opts)
 
+LOG = logging.getLogger(__name__)
 
-def get_obj(content, vimtype):
-    """Get VIMType Object.
 
-       Return an object by name, if name is None the
-       first found object is returned
+def _get_filter_spec(view, vimtype, properties):
+    """Filter selecting the given properties of all the objects of a view."""
+    collector = vmodl.query.PropertyCollector
+    traversal_spec = collector.TraversalSpec(
+        name='traverseView', path='view', skip=False,
+        type=vim.view.ContainerView)
+    object_spec = collector.ObjectSpec(obj=view, skip=True,
+                                       selectSet=[traversal_spec])
+    property_spec = collector.PropertySpec(type=vimtype,
+                                           pathSet=properties,
+                                           all=False)
+    return collector.FilterSpec(objectSet=[object_spec],
+                                propSet=[property_spec])
+
+
+class InventoryTracker(object):
+    """Local copy of the vSphere objects of a type, kept up to date.
+
+    A property filter stays open on a private PropertyCollector. The first
+    poll retrieves the requested properties of all the objects in pages of
+    page_size objects, later polls only consume the updates WaitForUpdatesEx
+    returns since the previous one, so their cost follows the number of
+    changes rather than the size of the inventory.
     """
-    container = content.viewManager.CreateContainerView(
-        content.rootFolder, vimtype, True)
-    return container.view
+
+    def __init__(self, content, vimtype, properties, page_size):
+        self.page_size = page_size
+        self.version = ''
+        self.objects = {}
+        self._updated = {}
+        self._removed = {}
+        self._lock = threading.Lock()
+
+        self._collector = content.propertyCollector.CreatePropertyCollector()
+        self._view = content.viewManager.CreateContainerView(
+            content.rootFolder, [vimtype], True)
+        filter_spec = _get_filter_spec(self._view, vimtype, properties)
+        self._filter = self._collector.CreateFilter(filter_spec,
+                                                    partialUpdates=False)
+
+    def _apply(self, object_update):
+        key = object_update.obj._moId
+        if object_update.kind == 'leave':
+            props = self.objects.pop(key, None)
+            self._updated.pop(key, None)
+            if props is not None:
+                self._removed[key] = props
+            return
+        props = self.objects.setdefault(key, {})
+        for change in object_update.changeSet:
+            if change.op in ('assign', 'add'):
+                props[change.name] = change.val
+            else:
+                props.pop(change.name, None)
+        self._updated[key] = props
+        self._removed.pop(key, None)
+
+    def poll(self):
+        """Apply the updates which happened since the last poll."""
+        options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=0, maxObjectUpdates=self.page_size)
+        with self._lock:
+            while True:
+                update_set = self._collector.WaitForUpdatesEx(self.version,
+                                                              options)
+                # No update set is returned when nothing changed.
+                if update_set is None:
+                    return
+                self.version = update_set.version
+                for filter_update in update_set.filterSet:
+                    for object_update in filter_update.objectSet:
+                        self._apply(object_update)
+                if not update_set.truncated:
+                    return
+
+    def pop_changes(self):
+        """Return the objects updated and removed since the last call.
+
+        :returns: (updated, removed) lists of property dicts.
+        """
+        with self._lock:
+            updated = list(self._updated.values())
+            removed = list(self._removed.values())
+            self._updated = {}
+            self._removed = {}
+        return updated, removed
+
+    def destroy(self):
+        for obj in (self._filter, self._view, self._collector):
+            try:
+                obj.Destroy()
+            except Exception:
+                pass
 
 
 class VSphereSourceDriver(driver.SourceDriver):
     """VSphere Source Hypervisor"""
+
+    # Managed object type and properties of the inventory, by resource.
+    TRACKED_RESOURCES = {
+        'instance': (vim.VirtualMachine,
+                     ['config.instanceUuid', 'config.name',
+                      'config.hardware.memoryMB', 'config.hardware.numCPU',
+                      'summary.storage.committed',
+                      'summary.storage.uncommitted']),
+        'network': (vim.Network,
+                    ['name', 'summary.ipPoolName', 'summary.ipPoolId']),
+    }
+
     def __init__(self, *args, **kwargs):
         super(VSphereSourceDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(vsphere_source_opts)
+        self.configuration.append_config_values(transfer.transfer_opts)
+        self._trackers = {}
 
     def do_setup(self, context):
         """Any initialization the source driver does while starting."""
@@ -75,26 +186,92 @@ class VSphereSourceDriver(driver.SourceDriver):
                                             pwd=password, port=port)
             atexit.register(connect.Disconnect, self.con)
             self.content = self.con.RetrieveContent()
+            # Trackers of a previous connection are gone with its session.
+            self._trackers = {}
         except Exception:
             raise
         self._initialized = True
 
-    def get_instances_list(self, context):
+    def _get_tracker(self, resource_type):
+        """Return the up to date inventory tracker of a resource type.
+
+        The second value is False when the tracker had to be created, its
+        changes then cover the whole inventory.
+        """
+        vimtype, properties = self.TRACKED_RESOURCES[resource_type]
+        tracker = self._trackers.get(resource_type)
+        if tracker is not None:
+            try:
+                tracker.poll()
+                return tracker, True
+            except Exception as e:
+                LOG.warning(_LW('Lost track of the %(type)s inventory, '
+                                'retrieving it again: %(err)s'),
+                            {'type': resource_type, 'err': e})
+                tracker.destroy()
+        tracker = InventoryTracker(self.content, vimtype, properties,
+                                   self.configuration.vsphere_page_size)
+        self._trackers[resource_type] = tracker
+        tracker.poll()
+        return tracker, False
+
+    def _to_resource(self, resource_type, props):
+        if resource_type == 'instance':
+            return self._instance_from_props(props)
+        return self._network_from_props(props)
+
+    def get_resource_changes(self, context, resource_type):
         if not self._initialized:
             self.do_setup(context)
+        if resource_type not in self.TRACKED_RESOURCES:
+            return None
+        tracker, tracked = self._get_tracker(resource_type)
+        updated, removed = tracker.pop_changes()
+        if not tracked:
+            return None
+        changes = {'updated': [], 'removed': []}
+        for props in updated:
+            resource = self._to_resource(resource_type, props)
+            if resource is not None:
+                changes['updated'].append(resource)
+        for props in removed:
+            resource = self._to_resource(resource_type, props)
+            if resource is not None:
+                changes['removed'].append(resource['id'])
+        return changes
 
-        instances = get_obj(self.content, [vim.VirtualMachine])
+    def _instance_from_props(self, props):
+        # VMs being created have no configuration yet.
+        if 'config.instanceUuid' not in props:
+            return None
+        if props['config.instanceUuid'] in self.exclude:
+            return None
+        inst = {}
+        inst["id"] = props['config.instanceUuid']
+        inst["name"] = props.get('config.name')
+        inst["memory"] = props.get('config.hardware.memoryMB')
+        inst['vcpus'] = props.get('config.hardware.numCPU')
+        committed = props.get('summary.storage.committed')
+        if committed is not None:
+            # Bytes the disks take on the datastore, and once grown to
+            # their full size.
+            inst['allocated_size'] = committed
+            inst['virtual_size'] = committed + (
+                props.get('summary.storage.uncommitted') or 0)
+            inst['size'] = int(math.ceil(
+                float(inst['virtual_size']) / units.Gi))
+        return inst
+
+    def get_instances_list(self, context):
+        if not self._initialized:
+            self.do_setup(context)
 
+        tracker, _tracked = self._get_tracker('instance')
         instance_list = []
-        for instance in instances:
-            if instance.config.instanceUuid in self.exclude:
-                continue
-            inst = {}
-            inst["id"] = instance.config.instanceUuid
-            inst["name"] = instance.config.name
-            inst["memory"] = instance.config.hardware.memoryMB
-            inst['vcpus'] = instance.config.hardware.numCPU
-            instance_list.append(inst)
+        for props in tracker.objects.values():
+            inst = self._instance_from_props(props)
+            if inst is not None:
+                instance_list.append(inst)
 
         return instance_list
 
@@ -105,19 +282,22 @@ class VSphereSourceDriver(driver.SourceDriver):
         if not self._initialized:
             self.do_setup(context)
 
-        networks = get_obj(self.content, [vim.Network])
-
+        tracker, _tracked = self._get_tracker('network')
         network_list = []
-        for network in networks:
-            if network.summary.name in self.exclude:
-                continue
-            net = {'id': network.name,
-                   'name': network.name,
-                   'ip_pool': network.summary.ipPoolName,
-                   'ip_pool_id': network.summary.ipPoolId}
-            network_list.append(net)
+        for props in tracker.objects.values():
+            net = self._network_from_props(props)
+            if net is not None:
+                network_list.append(net)
         return network_list
 
+    def _network_from_props(self, props):
+        if props.get('name') is None or props['name'] in self.exclude:
+            return None
+        return {'id': props['name'],
+                'name': props['name'],
+                'ip_pool': props.get('summary.ipPoolName'),
+                'ip_pool_id': props.get('summary.ipPoolId')}
+
     def _find_instance_by_uuid(self, instance_uuid):
         search_index = self.content.searchIndex
         instance = search_index.FindByUuid(None, instance_uuid,
@@ -145,23 +325,28 @@ class VSphereSourceDriver(driver.SourceDriver):
             device_urls = lease.info.deviceUrl
         return device_urls
 
-    def _get_instance_disk(self, device_url, dest_disk_path):
-        url = device_url.url
-        if not os.path.exists(dest_disk_path):
-            utils.execute('wget', url, '--no-check-certificate',
-                          '-O', dest_disk_path, run_as_root=True)
+    def _get_transfer_engine(self):
+        # NFC device URLs are authenticated with the session cookie of the
+        # API connection.
+        headers = {'Cookie': self.con._stub.cookie}
+        return transfer.HttpTransferEngine(self.configuration,
+                                           headers=headers)
+
+    def _get_device_url(self, device_url):
+        # ESXi hosts hand out URLs with '*' in place of their address.
+        return device_url.url.replace('*', self.configuration.vsphere_host)
 
     def get_instance(self, context, instance_id):
         instance = self._find_instance_by_uuid(instance_id)
         lease = self._get_instance_lease(instance)
+        engine = self._get_transfer_engine()
 
         def keep_lease_alive(lease):
             """Keeps the lease alive while GETing the VMDK."""
             while(True):
                 time.sleep(5)
                 try:
-                    # Choosing arbitrary percentage to keep the lease alive.
-                    lease.HttpNfcLeaseProgress(50)
+                    lease.HttpNfcLeaseProgress(engine.progress)
                     if (lease.state == vim.HttpNfcLease.State.done):
                         return
                     # If the lease is released, we get an exception.
@@ -171,20 +356,31 @@ class VSphereSourceDriver(driver.SourceDriver):
         disks = []
         try:
             if lease.state == vim.HttpNfcLease.State.ready:
-                keepalive_thread = Thread(target=keep_lease_alive,
-                                          args=(lease,))
+                keepalive_thread = threading.Thread(target=keep_lease_alive,
+                                                    args=(lease,))
 
                 keepalive_thread.daemon = True
                 keepalive_thread.start()
                 device_urls = self._get_device_urls(lease)
 
+                downloads = []
                 for device_url in device_urls:
-                    data = {}
                     path = os.path.join(self.configuration.conversion_dir,
                                         device_url.targetId)
-                    self._get_instance_disk(device_url, path)
-                    data = {device_url.key.split(':')[1]: path}
-                    disks.append(data)
+                    downloads.append((self._get_device_url(device_url),
+                                      path))
+                    disks.append({device_url.key.split(':')[1]: path})
+
+                expected_size = lease.info.totalDiskCapacityInKB * units.Ki
+                try:
+                    engine.download(downloads, expected_size=expected_size)
+                except Exception:
+                    # Completed ranges stay checkpointed, a new lease
+                    # resumes the export from where this one stopped.
+                    with excutils.save_and_reraise_exception():
+                        lease.HttpNfcLeaseAbort()
+                finally:
+                    engine.close()
 
                 lease.HttpNfcLeaseComplete()
                 keepalive_thread.join()
@@ -18,23 +18,30 @@
 Migration Service
 """
 
-import ast
 import functools
+import os
 
+from eventlet import greenthread
+from eventlet import semaphore
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
 from oslo_service import periodic_task
+from oslo_utils import excutils
 from oslo_utils import importutils
 
 from guts import context
 from guts import exception
 from guts.migration import configuration as config
-from guts.i18n import _, _LI, _LE
+from guts.migration import conversion
+from guts.migration import pipeline
+from guts.migration import space
+from guts.migration import sparse
+from guts.i18n import _LI, _LE, _LW
 from guts import manager
 from guts import objects
-from guts.objects import base as objects_base
 from guts import rpc
+from guts.scheduler import capabilities as capabilities_report
 from guts import utils
 
 
@@ -61,6 +68,30 @@ source_manager_opts = [
     cfg.StrOpt('glance_api_version',
                default='1',
                help='Glance client version.'),
+    cfg.IntOpt('conversion_workers',
+               default=2,
+               min=1,
+               help='Number of disks of a resource converted concurrently.'),
+    cfg.IntOpt('qemu_img_coroutines',
+               min=1,
+               max=16,
+               help='Number of parallel coroutines qemu-img uses for a '
+                    'conversion (qemu-img convert -m).'),
+    cfg.BoolOpt('qemu_img_out_of_order',
+                default=False,
+                help='Allow qemu-img to write converted disks out of order '
+                     '(qemu-img convert -W).'),
+    cfg.IntOpt('max_concurrent_migrations',
+               default=4,
+               min=1,
+               help='Number of migrations this source exports at the same '
+                    'time, the others wait in the queue.'),
+    cfg.IntOpt('max_migrations_per_destination',
+               default=4,
+               min=1,
+               help='Number of running migrations of a destination this '
+                    'source assumes until the scheduler reports its '
+                    'limit.'),
 ]
 
 destination_manager_opts = [
@@ -83,6 +114,11 @@ OpenStackDestinationDriver',
     cfg.StrOpt('glance_api_version',
                default='1',
                help='Glance client version.'),
+    cfg.IntOpt('max_concurrent_migrations',
+               default=4,
+               min=1,
+               help='Number of migrations the scheduler places on this '
+                    'destination to run at the same time.'),
 ]
 
 CONF = cfg.CONF
@@ -97,31 +133,29 @@ wrap_exception = functools.partial(exception.wrap_exception,
 def _cast_to_destination(context, dest_host, method, migration_ref,
                          resource_ref, **kwargs):
     dest_topic = ('guts-destination.%s' % (dest_host))
-    target = messaging.Target(topic=dest_topic,
-                              version='1.8')
-    serializer = objects_base.GutsObjectSerializer()
-    client = rpc.get_client(target, version_cap=None,
-                            serializer=serializer)
-
-    ctxt = client.prepare(version='1.8')
+    ctxt = rpc.get_cached_client(dest_topic, '1.8')
     ctxt.cast(context, method, migration_ref=migration_ref,
               resource_ref=resource_ref, **kwargs)
 
 
-def _get_free_space(conversion_dir):
-    """Calculate and return free space available."""
-    try:
-        out = utils.execute('df', '--portability', '--block-size', '1',
-                            conversion_dir,
-                            run_as_root=True)[0]
-        out = out.splitlines()[1]
-        available = int(out.split()[3])
-    except Exception:
-        msg = _("Failed to get the available free space.")
-        LOG.exception(msg)
-        raise exception.GutsException(msg)
+def _call_destination(context, dest_host, method, **kwargs):
+    dest_topic = ('guts-destination.%s' % (dest_host))
+    ctxt = rpc.get_cached_client(dest_topic, '1.8')
+    return ctxt.call(context, method, **kwargs)
+
+
+def _release_destination_space(context, dest_host, migration_id):
+    dest_topic = ('guts-destination.%s' % (dest_host))
+    ctxt = rpc.get_cached_client(dest_topic, '1.8')
+    ctxt.cast(context, 'release_space', migration_id=migration_id)
+
 
-    return available
+def _discard_streams(disk_pipes, chunk_iterables):
+    """Clean up streams which failed before they were fed."""
+    for disk_pipe in disk_pipes:
+        disk_pipe.remove()
+    for chunks in chunk_iterables:
+        pipeline.close_chunks(chunks)
 
 
 def locked_migration_operation(f):
@@ -163,7 +197,18 @@ class SourceManager(manager.SchedulerDependentManager):
                                             *args, **kwargs)
         self.configuration = config.Configuration(source_manager_opts,
                                                   config_group=service_name)
+        self.configuration.append_config_values(pipeline.pipeline_opts)
+        self.conversion_pool = conversion.ConversionPool(self.configuration)
         self.stats = {}
+        # Migrations of this source being exported, and the limits of
+        # running migrations of the destinations, by service id.
+        self._running_migrations = 0
+        self._destination_limits = {}
+        # Claiming yields to other green threads, which would count the
+        # same free slots.
+        self._claim_lock = semaphore.Semaphore()
+        self.space_ledger = space.SpaceLedger(
+            self.configuration.conversion_dir)
 
         if not source_driver:
             # Get from configuration, which will get the default
@@ -213,17 +258,191 @@ class SourceManager(manager.SchedulerDependentManager):
             self._get_network(context, migration_ref, resource_ref,
                               dest_host)
 
-    def _convert_disks(self, disks):
+    def start_queued_migrations(self, context, destination_limits=None):
+        """Start the queued migrations of this source which fit.
+
+        :param destination_limits: number of running migrations each
+                                   destination accepts, by service id.
+        """
+        if destination_limits:
+            self._destination_limits.update(destination_limits)
+        self._start_queued_migrations(context)
+
+    def _start_queued_migrations(self, context):
+        with self._claim_lock:
+            free = (self.configuration.max_concurrent_migrations -
+                    self._running_migrations)
+            if free <= 0:
+                return
+            migrations = objects.MigrationList.claim_queued(
+                context, self.host, free, self._destination_limits,
+                self.configuration.max_migrations_per_destination,
+                expected_attrs=['destination'])
+            self._running_migrations += len(migrations)
+        for migration_ref in migrations:
+            greenthread.spawn_n(self._run_migration, context, migration_ref)
+
+    def _reserve_space(self, migration_ref, resource_ref):
+        """Reserve the space the exported disks take, if written here."""
+        if pipeline.is_enabled(self.configuration, self.driver, self.host,
+                               migration_ref.destination_host):
+            return True
+        size = space.expected_size(resource_ref)
+        if not size:
+            return True
+        if resource_ref.type == 'instance':
+            # Converted disks are written next to the exported ones, both
+            # are on disk until the conversion ends.
+            size *= 2
+        try:
+            self.space_ledger.reserve(migration_ref.id, size)
+        except exception.InsufficientConversionSpace as e:
+            LOG.info(_LI('Migration %(migration)s waits for space: %(err)s'),
+                     {'migration': migration_ref.id, 'err': e})
+            migration_ref.migration_status = 'Queued'
+            migration_ref.migration_event = 'Waiting for conversion space'
+            migration_ref.save()
+            return False
+        return True
+
+    def _run_migration(self, context, migration_ref):
+        start_next = True
+        try:
+            resource_ref = objects.Resource.get(context,
+                                                migration_ref.resource_id)
+            start_next = self._reserve_space(migration_ref, resource_ref)
+            if start_next:
+                self.get_resource(context, migration_ref, resource_ref,
+                                  migration_ref.destination_host)
+        except Exception:
+            LOG.exception(_LE('Migration %(migration)s of resource '
+                              '%(resource)s failed.'),
+                          {'migration': migration_ref.id,
+                           'resource': migration_ref.resource_id})
+            migration_ref.migration_status = 'ERROR'
+            migration_ref.save()
+            self.space_ledger.release(migration_ref.id)
+            _release_destination_space(context,
+                                       migration_ref.destination_host,
+                                       migration_ref.id)
+        finally:
+            # Staged files keep their space reserved until the destination
+            # deletes them.
+            self.space_ledger.release_untracked(migration_ref.id)
+            self._running_migrations -= 1
+            # Waiting for space, the next queued migrations would too.
+            if start_next:
+                self._start_queued_migrations(context)
+
+    @periodic_task.periodic_task
+    def _start_queued_migrations_task(self, context):
+        # Destinations free their slots without telling the sources.
+        self._start_queued_migrations(context)
+
+    def _get_accepted_disk_formats(self, context, dest_host):
+        try:
+            return _call_destination(context, dest_host, 'get_disk_formats')
+        except messaging.MessagingException:
+            LOG.warning(_LW('Unable to get accepted disk formats from '
+                            '%s, converting disks to qcow2.'), dest_host)
+            return ['qcow2']
+
+    def _get_sparse_imports(self, context, dest_host):
+        try:
+            return _call_destination(context, dest_host,
+                                     'get_sparse_imports')
+        except messaging.MessagingException:
+            LOG.warning(_LW('Unable to get sparse imports from %s, '
+                            'counting every byte as transferred.'),
+                        dest_host)
+            return []
+
+    def _record_transfer_sizes(self, migration_ref, paths,
+                               sparse_paths=(), logical_sizes=None):
+        """Record on the migration how many bytes its disks hold.
+
+        Only the data extents of the disks the destination writes without
+        their holes count as transferred, the whole file of the others.
+
+        :param sparse_paths: paths of the disks written without holes.
+        :param logical_sizes: virtual sizes of the disks, the size of their
+                              files by default.
+        """
+        bytes_logical = 0
+        bytes_transferred = 0
+        for path in paths:
+            size, data_size = sparse.get_usage(path)
+            bytes_logical += size
+            bytes_transferred += data_size if path in sparse_paths else size
+        if logical_sizes is not None:
+            bytes_logical = sum(logical_sizes)
+        migration_ref.bytes_logical = bytes_logical
+        migration_ref.bytes_transferred = bytes_transferred
+        LOG.info(_LI('Migration %(migration)s moves %(moved)d of '
+                     '%(logical)d bytes.'),
+                 {'migration': migration_ref.id, 'moved': bytes_transferred,
+                  'logical': bytes_logical})
+
+    def _hold_space(self, migration_ref, paths, pending=0):
+        """Keep the space of staged files reserved until they are deleted.
+
+        :param pending: bytes the migration is still going to write.
+        """
+        self.space_ledger.track(migration_ref.id, paths)
+        self.space_ledger.reserve(
+            migration_ref.id,
+            self.space_ledger.used(migration_ref.id) + pending,
+            check=False)
+
+    def _convert_disks(self, context, migration_ref, disks, dest_host):
+        """Bring the disks into a format accepted by the destination.
+
+        Returns the disks, their formats and virtual sizes, and records on
+        the migration what was done to every disk, the conversion time it
+        saved and how many bytes the disks hold.
+        """
         LOG.info(_LI('Disk conversion started: %s'), disks)
-        converted_disks = []
+        accepted_formats = self._get_accepted_disk_formats(context,
+                                                           dest_host)
+        negotiated = []
         for disk in disks:
             index = disk.keys()[0]
-            path = disk[index]
-            disk[index] = path.replace('.vmdk', '.qcow2')
-            utils.convert_image(path, disk[index],
-                                'qcow2', run_as_root=False)
-            converted_disks.append(disk)
-        return converted_disks
+            negotiated.append(self.conversion_pool.negotiate(
+                conversion.Disk(index, disk[index]), accepted_formats))
+        converting = [disk for disk in negotiated
+                      if disk.action == conversion.CONVERT]
+        self._hold_space(
+            migration_ref,
+            ([disk.source_path for disk in negotiated] +
+             [disk.path for disk in converting]),
+            pending=sum(disk.info.virtual_size or 0 for disk in converting))
+        self.conversion_pool.convert(negotiated)
+        # Only the converted disks are sent to the destination.
+        for disk in converting:
+            os.remove(disk.source_path)
+        self._hold_space(migration_ref, [disk.path for disk in negotiated])
+
+        time_saved = sum(self.conversion_pool.estimate_duration(disk)
+                         for disk in negotiated
+                         if disk.action != conversion.CONVERT)
+        migration_ref.disk_conversion = ','.join(disk.describe()
+                                                 for disk in negotiated)
+        migration_ref.conversion_time_saved = time_saved
+        sparse_imports = self._get_sparse_imports(context, dest_host)
+        self._record_transfer_sizes(
+            migration_ref, [disk.path for disk in negotiated],
+            sparse_paths=[disk.path for disk in negotiated
+                          if ('root_disk' if disk.index == '0' else 'disk')
+                          in sparse_imports],
+            logical_sizes=[disk.info.virtual_size or 0
+                           for disk in negotiated])
+        migration_ref.save()
+
+        converted_disks = [{disk.index: disk.path} for disk in negotiated]
+        disk_formats = {disk.index: disk.disk_format for disk in negotiated}
+        disk_sizes = {disk.index: disk.info.virtual_size
+                      for disk in negotiated}
+        return converted_disks, disk_formats, disk_sizes
 
     def _get_instance(self, context, migration_ref,
                       resource_ref, dest_host):
@@ -231,14 +450,73 @@ class SourceManager(manager.SchedulerDependentManager):
         LOG.info(_LI('Getting instance from source hypervisor, '
                      'instance_id: %s'), instance_id)
         migration_ref.save()
+        instance_info = dict(resource_ref.properties or {})
+        if pipeline.is_enabled(self.configuration, self.driver, self.host,
+                               dest_host):
+            self._stream_instance(context, migration_ref, resource_ref,
+                                  dest_host, instance_info)
+            return
+
         instance_disks = self.driver.get_instance(context, instance_id)
-        instance_disks = self._convert_disks(instance_disks)
+        instance_disks, disk_formats, disk_sizes = self._convert_disks(
+            context, migration_ref, instance_disks, dest_host)
 
-        instance_info = ast.literal_eval(resource_ref.properties)
         instance_info['disks'] = instance_disks
+        instance_info['disk_formats'] = disk_formats
+        instance_info['disk_sizes'] = disk_sizes
         _cast_to_destination(context, dest_host, 'create_instance',
                              migration_ref, resource_ref, **instance_info)
 
+    def _get_pipe_path(self, migration_ref, index):
+        return os.path.join(self.configuration.conversion_dir,
+                            '%s_%s.pipe' % (migration_ref.id, index))
+
+    def _stream_instance(self, context, migration_ref, resource_ref,
+                         dest_host, instance_info):
+        """Stream instance disks to the destination while exporting them."""
+        LOG.info(_LI('Streaming instance %s to destination.'),
+                 resource_ref.id_at_source)
+        streams = self.driver.stream_instance(context,
+                                              resource_ref.id_at_source)
+        disks = []
+        disk_formats = {}
+        disk_streams = {}
+        pipes = []
+        try:
+            for index, disk_format, size, checksum, chunks in streams:
+                disk_pipe = pipeline.DiskPipe(
+                    self._get_pipe_path(migration_ref, index),
+                    self.configuration)
+                pipes.append((disk_pipe, chunks, size))
+                disks.append({index: disk_pipe.path})
+                disk_formats[index] = disk_format
+                disk_streams[index] = {'size': size, 'checksum': checksum}
+
+            instance_info['disks'] = disks
+            instance_info['disk_formats'] = disk_formats
+            # Checked by the destination, which cannot tell a complete
+            # stream from an interrupted one.
+            instance_info['disk_streams'] = disk_streams
+            # The destination starts reading the pipes as soon as it gets
+            # the cast, the disks are fed to it concurrently from here on.
+            _cast_to_destination(context, dest_host, 'create_instance',
+                                 migration_ref, resource_ref,
+                                 **instance_info)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                _discard_streams([pipe[0] for pipe in pipes],
+                                 [stream[-1] for stream in streams])
+        pipeline.feed_all(pipes)
+        self._record_streamed_sizes(migration_ref,
+                                    [pipe[0] for pipe in pipes])
+
+    def _record_streamed_sizes(self, migration_ref, disk_pipes):
+        # Every byte of a stream is moved, holes included.
+        moved = sum(disk_pipe.transferred_bytes for disk_pipe in disk_pipes)
+        migration_ref.bytes_logical = moved
+        migration_ref.bytes_transferred = moved
+        migration_ref.save()
+
     def _get_volume(self, context, migration_ref,
                     resource_ref, dest_host):
         volume_id = resource_ref.id_at_source
@@ -247,16 +525,46 @@ class SourceManager(manager.SchedulerDependentManager):
         migration_ref.migration_status = "Inprogress"
         migration_ref.migration_event = "Fetching from source"
         migration_ref.save()
+        volume_info = dict(resource_ref.properties or {})
+        if pipeline.is_enabled(self.configuration, self.driver, self.host,
+                               dest_host):
+            disk_format, size, checksum, chunks = self.driver.stream_volume(
+                context, volume_id, migration_ref.id)
+            disk_pipes = []
+            try:
+                disk_pipe = pipeline.DiskPipe(
+                    self._get_pipe_path(migration_ref, 0),
+                    self.configuration)
+                disk_pipes.append(disk_pipe)
+                volume_info['path'] = disk_pipe.path
+                volume_info['disk_format'] = disk_format
+                volume_info['stream'] = {'size': size, 'checksum': checksum}
+                _cast_to_destination(context, dest_host, 'create_volume',
+                                     migration_ref, resource_ref,
+                                     **volume_info)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    _discard_streams(disk_pipes, [chunks])
+            pipeline.feed_all([(disk_pipe, chunks, size)])
+            self._record_streamed_sizes(migration_ref, [disk_pipe])
+            return
+
         volume_path = self.driver.get_volume(context, volume_id,
                                              migration_ref.id)
-        volume_info = ast.literal_eval(resource_ref.properties)
+        sparse_paths = []
+        if 'volume' in self._get_sparse_imports(context, dest_host):
+            sparse_paths.append(volume_path)
+        self._record_transfer_sizes(migration_ref, [volume_path],
+                                    sparse_paths=sparse_paths)
+        migration_ref.save()
+        self._hold_space(migration_ref, [volume_path])
         volume_info['path'] = volume_path
         _cast_to_destination(context, dest_host, 'create_volume',
                              migration_ref, resource_ref, **volume_info)
 
     def _get_network(self, context, migration_ref,
                      resource_ref, dest_host):
-        network_info = ast.literal_eval(resource_ref.properties)
+        network_info = dict(resource_ref.properties or {})
         LOG.info(_LI('Getting network information from source hypervisor, '
                      'network_info: %s'), network_info)
         migration_ref.migration_status = "Inprogress"
@@ -269,20 +577,22 @@ class SourceManager(manager.SchedulerDependentManager):
     def _report_driver_status(self, context):
         status = {}
         status["capabilities"] = self.configuration.capabilities.split(',')
-        status["free_space"] = _get_free_space(
-            self.configuration.conversion_dir)
+        self.space_ledger.report(status)
         resources = {}
         for capab in status["capabilities"]:
             if capab == 'instance':
-                instances = self.driver.get_instances_list(context)
+                instances = self._get_resources_list(
+                    context, capab, self.driver.get_instances_list)
                 if instances:
                     resources['instance'] = instances
             elif capab == 'volume':
-                volumes = self.driver.get_volumes_list(context)
+                volumes = self._get_resources_list(
+                    context, capab, self.driver.get_volumes_list)
                 if volumes:
                     resources['volume'] = volumes
             elif capab == 'network':
-                networks = self.driver.get_networks_list(context)
+                networks = self._get_resources_list(
+                    context, capab, self.driver.get_networks_list)
                 if networks:
                     resources['network'] = networks
             else:
@@ -290,10 +600,25 @@ class SourceManager(manager.SchedulerDependentManager):
         status['resources'] = resources
         self.update_service_capabilities(status)
 
+    def _get_resources_list(self, context, resource_type, list_func):
+        """Return the resources of a type, from the driver changes if any.
+
+        Drivers tracking their inventory only return what changed since
+        the previous report, which is applied to the reported list.
+        """
+        previous = (self.last_capabilities or {}).get('resources', {})
+        if resource_type in previous:
+            changes = self.driver.get_resource_changes(context,
+                                                       resource_type)
+            if changes is not None:
+                return capabilities_report.apply_resource_changes(
+                    previous[resource_type], changes)
+        return list_func(context)
+
     def publish_service_capabilities(self, context):
         """Collect driver status and then publish."""
         self._report_driver_status(context)
-        self._publish_service_capabilities(context)
+        self._publish_service_capabilities(context, full=True)
 
 
 class DestinationManager(manager.SchedulerDependentManager):
@@ -312,6 +637,8 @@ class DestinationManager(manager.SchedulerDependentManager):
         self.configuration = config.Configuration(destination_manager_opts,
                                                   config_group=service_name)
         self.stats = {}
+        self.space_ledger = space.SpaceLedger(
+            self.configuration.conversion_dir)
 
         if not destination_driver:
             # Get from configuration, which will get the default
@@ -350,15 +677,33 @@ class DestinationManager(manager.SchedulerDependentManager):
     @periodic_task.periodic_task
     def _report_driver_status(self, context):
         status = {}
-        status["capabilities"] = self.configuration.capabilities
-        con_dir = self.configuration.conversion_dir
-        status["free_space"] = _get_free_space(con_dir)
+        status["capabilities"] = self.configuration.capabilities.split(',')
+        self.space_ledger.report(status)
+        status["max_concurrent_migrations"] = (
+            self.configuration.max_concurrent_migrations)
         self.update_service_capabilities(status)
 
     def publish_service_capabilities(self, context):
         """Collect driver status and then publish."""
         self._report_driver_status(context)
-        self._publish_service_capabilities(context)
+        self._publish_service_capabilities(context, full=True)
+
+    def get_disk_formats(self, context):
+        """Returns the disk formats the destination driver accepts."""
+        return self.driver.accepted_disk_formats
+
+    def get_sparse_imports(self, context):
+        """Returns the kinds of disks imported without their holes."""
+        return self.driver.get_sparse_imports()
+
+    def reserve_space(self, context, migration_id, size):
+        """Reserve the space of a migration placed on this destination."""
+        # The scheduler already checked the space, it is not checked again
+        # against a report which may not include its earlier placements.
+        self.space_ledger.reserve(migration_id, size, check=False)
+
+    def release_space(self, context, migration_id):
+        self.space_ledger.release(migration_id)
 
     def create_network(self, context, **kwargs):
         """Creates new network on destination OpenStack hypervisor."""
@@ -393,11 +738,13 @@ class DestinationManager(manager.SchedulerDependentManager):
         kwargs['mig_ref_id'] = migration_ref.id
         try:
             self.driver.create_volume(context, **kwargs)
-        except exception.NetworkCreationFailed:
+        except exception.VolumeCreationFailed:
             migration_ref.migration_status = 'ERROR'
             migration_ref.migration_event = None
             migration_ref.save()
             raise
+        finally:
+            self.space_ledger.release(migration_ref.id)
         migration_ref.migration_status = 'COMPLETE'
         migration_ref.migration_event = None
         migration_ref.save()
@@ -414,11 +761,13 @@ class DestinationManager(manager.SchedulerDependentManager):
         kwargs['mig_ref_id'] = migration_ref.id
         try:
             self.driver.create_instance(context, **kwargs)
-        except exception.NetworkCreationFailed:
+        except exception.InstanceCreationFailed:
             migration_ref.migration_status = 'ERROR'
             migration_ref.migration_event = None
             migration_ref.save()
             raise
+        finally:
+            self.space_ledger.release(migration_ref.id)
         migration_ref.migration_status = 'COMPLETE'
         migration_ref.migration_event = None
         migration_ref.save()
@@ -0,0 +1,199 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Streaming transfer of disks from a source to a destination driver.
+
+Instead of staging a full copy of every disk in the conversion directory,
+the source service creates a named pipe per disk, hands the pipe paths to
+the destination service and feeds the exported bytes into the pipes while
+the destination uploads them. The conversion directory only ever holds
+the pipe window of each disk.
+
+A closed pipe looks the same to the destination whether the export
+finished or failed, so the size and checksum of every streamed disk are
+sent along with the pipe and checked by the destination before it keeps
+what it read. Named pipes only connect services of the same host, disks
+sent to another host are staged as files.
+"""
+
+import errno
+import fcntl
+import os
+import stat
+import time
+
+from eventlet import greenpool
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import units
+
+from guts import exception
+from guts.i18n import _LI
+from guts import utils
+
+
+pipeline_opts = [
+    cfg.ListOpt('pipeline_destinations',
+                default=[],
+                help='Destination hypervisors, by backend name, to which '
+                     'resources of this source are streamed instead of '
+                     'being staged as files in the conversion directory. '
+                     'Only used when the source driver supports streaming.'),
+    cfg.IntOpt('pipeline_window_size',
+               default=1024,
+               min=64,
+               help='Size in KiB of the in-flight window of a streamed '
+                    'disk.'),
+    cfg.IntOpt('pipeline_open_timeout',
+               default=300,
+               min=1,
+               help='Seconds to wait for the destination to start reading '
+                    'a streamed disk before the migration fails.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(pipeline_opts)
+
+LOG = logging.getLogger(__name__)
+
+# fcntl command to resize a pipe buffer, Linux only.
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
+def is_enabled(configuration, driver, source_host, dest_host):
+    """Check whether disks sent to dest_host should be streamed."""
+    if not getattr(driver, 'supports_streaming', False):
+        return False
+    dest_backend = dest_host.split('@')[-1]
+    if dest_backend not in (configuration.pipeline_destinations or []):
+        return False
+    if utils.extract_host(source_host) != utils.extract_host(dest_host):
+        LOG.info(_LI('Destination %s runs on another host, staging disks '
+                     'instead of streaming them.'), dest_host)
+        return False
+    return True
+
+
+def is_pipe(path):
+    """Return True if the given disk path is a streamed disk."""
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+class DiskPipe(object):
+    """Named pipe a single disk is streamed through."""
+
+    def __init__(self, path, configuration):
+        self.path = path
+        self.window_size = configuration.pipeline_window_size * units.Ki
+        self.open_timeout = configuration.pipeline_open_timeout
+        self.transferred_bytes = 0
+        if os.path.exists(path):
+            os.remove(path)
+        os.mkfifo(path, 0o600)
+
+    def _open_writer(self):
+        # Opening the write end blocks until there is a reader, open it
+        # non-blocking and poll so we can give up on a dead destination.
+        deadline = time.time() + self.open_timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                if time.time() > deadline:
+                    raise exception.DiskStreamFailed(
+                        path=self.path,
+                        reason='destination did not open the stream')
+                time.sleep(1)
+        try:
+            fcntl.fcntl(fd, F_SETPIPE_SZ, self.window_size)
+        except IOError:
+            pass
+        return fd
+
+    def feed(self, chunks, expected_size=None):
+        """Write the given chunks of data into the pipe.
+
+        :param expected_size: size of the disk, a stream ending short of
+                              it fails.
+        """
+        fd = self._open_writer()
+        try:
+            for chunk in chunks:
+                view = memoryview(chunk)
+                while len(view):
+                    try:
+                        written = os.write(fd, view)
+                    except OSError as e:
+                        if e.errno != errno.EAGAIN:
+                            raise
+                        time.sleep(0.01)
+                        continue
+                    view = view[written:]
+                    self.transferred_bytes += written
+        except (IOError, OSError) as e:
+            raise exception.DiskStreamFailed(path=self.path, reason=e)
+        finally:
+            os.close(fd)
+            self.remove()
+        if (expected_size is not None and
+                self.transferred_bytes != expected_size):
+            raise exception.DiskStreamFailed(
+                path=self.path,
+                reason='streamed %d of %d bytes' % (self.transferred_bytes,
+                                                    expected_size))
+        LOG.info(_LI('Streamed %(bytes)d bytes through %(path)s.'),
+                 {'bytes': self.transferred_bytes, 'path': self.path})
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def close_chunks(chunks):
+    """Release what a source holds for a stream, read or not."""
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+
+
+def feed_all(streams):
+    """Feed every (DiskPipe, chunks, expected size) tuple concurrently.
+
+    The destination may read the disks in any order, so all pipes are fed
+    at the same time. The chunks are closed once fed, even if feeding
+    failed.
+    """
+    pool = greenpool.GreenPool(max(len(streams), 1))
+    errors = []
+
+    def _feed(pipe, chunks, expected_size):
+        try:
+            pipe.feed(chunks, expected_size=expected_size)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            close_chunks(chunks)
+
+    for pipe, chunks, expected_size in streams:
+        pool.spawn_n(_feed, pipe, chunks, expected_size)
+    pool.waitall()
+    if errors:
+        raise errors[0]
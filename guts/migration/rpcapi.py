@@ -50,14 +50,24 @@ class SourceAPI(rpc.RPCAPI):
         cctxt = self.client.prepare(version='1.8')
         cctxt.cast(ctxt, 'create_migration', migration_ref=migration_ref)
 
+    def start_queued_migrations(self, ctxt, host, destination_limits):
+        cctxt = self.client.prepare(server=host,
+                                    version=self.BASE_RPC_API_VERSION)
+        cctxt.cast(ctxt, 'start_queued_migrations',
+                   destination_limits=destination_limits)
+
     def fetch_vms(self, ctxt, source_hypervisor_id):
         cctxt = self.client.prepare(version=self.BASE_RPC_API_VERSION)
         cctxt.cast(ctxt, 'fetch_vms',
                    source_hypervisor_id=source_hypervisor_id)
 
-    def publish_service_capabilities(self, ctxt):
-        cctxt = self.client.prepare(fanout=True,
-                                    version=self.BASE_RPC_API_VERSION)
+    def publish_service_capabilities(self, ctxt, host=None):
+        if host:
+            cctxt = self.client.prepare(server=host,
+                                        version=self.BASE_RPC_API_VERSION)
+        else:
+            cctxt = self.client.prepare(fanout=True,
+                                        version=self.BASE_RPC_API_VERSION)
         cctxt.cast(ctxt, 'publish_service_capabilities')
 
 
@@ -75,7 +85,22 @@ class DestinationAPI(rpc.RPCAPI):
         self.client = rpc.get_client(target, version_cap=None,
                                      serializer=serializer)
 
-    def publish_service_capabilities(self, ctxt):
-        cctxt = self.client.prepare(fanout=True,
-                                    version=self.BASE_RPC_API_VERSION)
+    def publish_service_capabilities(self, ctxt, host=None):
+        if host:
+            cctxt = self.client.prepare(server=host,
+                                        version=self.BASE_RPC_API_VERSION)
+        else:
+            cctxt = self.client.prepare(fanout=True,
+                                        version=self.BASE_RPC_API_VERSION)
         cctxt.cast(ctxt, 'publish_service_capabilities')
+
+    def reserve_space(self, ctxt, host, migration_id, size):
+        cctxt = self.client.prepare(server=host,
+                                    version=self.BASE_RPC_API_VERSION)
+        cctxt.cast(ctxt, 'reserve_space', migration_id=migration_id,
+                   size=size)
+
+    def release_space(self, ctxt, host, migration_id):
+        cctxt = self.client.prepare(server=host,
+                                    version=self.BASE_RPC_API_VERSION)
+        cctxt.cast(ctxt, 'release_space', migration_id=migration_id)
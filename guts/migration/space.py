@@ -0,0 +1,265 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Free space accounting of the conversion directory.
+
+The free space reported by the file system does not know about the disks
+in-flight migrations are about to write. Every migration reserves the
+size of its disks in the ledger of the conversion directory before they
+are written, so concurrent migrations do not all start on the same free
+space. The files a migration stages are tracked by the ledger: the space
+they already take is no longer counted as reserved, and the reservation
+is released once they are all deleted, or when the migration fails.
+
+The space and inode counts are read in-process with statvfs and cached
+for a few seconds. The type of the file system and whether it stores
+sparse files and shares blocks between files (reflinks) are probed once.
+"""
+
+import errno
+import fcntl
+import os
+import tempfile
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import units
+
+from guts import exception
+from guts.i18n import _, _LW
+
+
+space_opts = [
+    cfg.FloatOpt('filesystem_stats_ttl',
+                 default=10.0,
+                 min=0,
+                 help='Seconds the free space and inode counts of a '
+                      'conversion directory are cached for.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(space_opts)
+
+LOG = logging.getLogger(__name__)
+
+# ioctl cloning a whole file into another one, as cp --reflink does.
+FICLONE = 0x40049409
+
+# Size of the hole probing whether a file system stores sparse files.
+_SPARSE_PROBE_SIZE = units.Mi
+
+# Cached file system stats, by path, along with the time they were taken.
+_STATS_CACHE = {}
+
+# Features of the file system of a path, which do not change while the
+# service runs.
+_FEATURES_CACHE = {}
+
+
+def _get_mount(path):
+    """Return the mount point and file system type of a path."""
+    path = os.path.realpath(path)
+    mount_point, fs_type = '/', None
+    try:
+        with open('/proc/mounts') as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Spaces in mount points are escaped as \040.
+                point = fields[1].replace('\\040', ' ')
+                if (path == point or
+                        path.startswith(point.rstrip('/') + '/')):
+                    if len(point) >= len(mount_point):
+                        mount_point, fs_type = point, fields[2]
+    except IOError:
+        pass
+    return mount_point, fs_type
+
+
+def _supports_sparse(path):
+    """Check whether a hole in a file takes no space in path."""
+    with tempfile.NamedTemporaryFile(dir=path) as probe:
+        probe.truncate(_SPARSE_PROBE_SIZE)
+        probe.flush()
+        return os.fstat(probe.fileno()).st_blocks * 512 < _SPARSE_PROBE_SIZE
+
+
+def _supports_reflink(path):
+    """Check whether files in path can share their blocks."""
+    with tempfile.NamedTemporaryFile(dir=path) as source:
+        source.write(b'\0' * 4096)
+        source.flush()
+        with tempfile.NamedTemporaryFile(dir=path) as clone:
+            try:
+                fcntl.ioctl(clone.fileno(), FICLONE, source.fileno())
+            except (IOError, OSError) as e:
+                if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                               errno.EINVAL, errno.EBADF):
+                    return False
+                raise
+    return True
+
+
+def get_features(path):
+    """Return the type of the file system of path and what it supports."""
+    features = _FEATURES_CACHE.get(path)
+    if features is not None:
+        return features
+
+    _mount_point, fs_type = _get_mount(path)
+    features = {'type': fs_type, 'sparse': False, 'reflink': False}
+    probed = True
+    for feature, probe in (('sparse', _supports_sparse),
+                           ('reflink', _supports_reflink)):
+        try:
+            features[feature] = probe(path)
+        except (IOError, OSError) as e:
+            LOG.warning(_LW('Unable to check the %(feature)s file support '
+                            'of %(path)s: %(err)s'),
+                        {'feature': feature, 'path': path, 'err': e})
+            probed = False
+    # Probed again at the next report when the directory was not usable.
+    if probed:
+        _FEATURES_CACHE[path] = features
+    return features
+
+
+def get_stats(path):
+    """Return the space and inode counts of the file system of path.
+
+    Stats are cached for filesystem_stats_ttl seconds.
+    """
+    now = time.time()
+    cached = _STATS_CACHE.get(path)
+    if cached is not None and now - cached[0] < CONF.filesystem_stats_ttl:
+        return cached[1]
+
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        msg = _("Failed to get the available free space.")
+        LOG.exception(msg)
+        raise exception.GutsException(msg)
+
+    stats = {'free_space': st.f_bavail * st.f_frsize,
+             'total_space': st.f_blocks * st.f_frsize,
+             'free_inodes': st.f_favail,
+             'total_inodes': st.f_files}
+    _STATS_CACHE[path] = (now, stats)
+    return stats
+
+
+def get_free_space(path):
+    """Calculate and return free space available."""
+    return get_stats(path)['free_space']
+
+
+def expected_size(resource_ref):
+    """Return the bytes the disks of a resource take once exported.
+
+    The virtual size of the disks is used when the source reports it, as
+    raw exports and conversions may write all of it.
+    """
+    properties = resource_ref.properties or {}
+    for key in ('virtual_size', 'allocated_size'):
+        if properties.get(key):
+            return int(properties[key])
+    return (resource_ref.size or 0) * units.Gi
+
+
+class SpaceLedger(object):
+    """Space reserved in a directory by the migrations, by migration id."""
+
+    def __init__(self, path):
+        self.path = path
+        self._reservations = {}
+        self._paths = {}
+
+    @property
+    def reserved(self):
+        """Reserved space the migrations did not write yet."""
+        return sum(max(size - self.used(migration_id), 0)
+                   for migration_id, size in self._reservations.items())
+
+    def used(self, migration_id):
+        """Return the space taken by the files tracked for a migration."""
+        used = 0
+        for path in self._paths.get(migration_id, ()):
+            try:
+                used += os.stat(path).st_blocks * 512
+            except OSError:
+                pass
+        return used
+
+    def track(self, migration_id, paths):
+        """Set the files holding the data of a migration."""
+        self._paths[migration_id] = list(paths)
+
+    def release_untracked(self, migration_id):
+        """Release the reservation of a migration which staged no file."""
+        if not self._paths.get(migration_id):
+            self.release(migration_id)
+
+    def release_deleted(self):
+        """Release the reservations whose tracked files were all deleted."""
+        for migration_id, paths in list(self._paths.items()):
+            if paths and not any(os.path.exists(path) for path in paths):
+                self.release(migration_id)
+
+    def get_available(self, free_space=None):
+        """Return the free space which is not reserved yet."""
+        if free_space is None:
+            free_space = get_free_space(self.path)
+        return free_space - self.reserved
+
+    def reserve(self, migration_id, size, check=True):
+        """Reserve size bytes for a migration.
+
+        :param check: raise InsufficientConversionSpace, instead of
+                      overcommitting, when the space is not available.
+        """
+        # Reserved before checking, the check yields to the migrations
+        # reserving concurrently.
+        self._reservations[migration_id] = size
+        if check:
+            needed = max(size - self.used(migration_id), 0)
+            available = self.get_available() + needed
+            if needed > available:
+                del self._reservations[migration_id]
+                raise exception.InsufficientConversionSpace(
+                    path=self.path, id=migration_id, requested=size,
+                    available=available)
+        LOG.debug("Reserved %(size)s bytes in %(path)s for %(id)s",
+                  {'size': size, 'path': self.path, 'id': migration_id})
+
+    def release(self, migration_id):
+        self._paths.pop(migration_id, None)
+        size = self._reservations.pop(migration_id, None)
+        if size is not None:
+            # What the migration wrote is only seen by fresh stats.
+            _STATS_CACHE.pop(self.path, None)
+            LOG.debug("Released %(size)s bytes in %(path)s for %(id)s",
+                      {'size': size, 'path': self.path, 'id': migration_id})
+
+    def report(self, status):
+        """Add the space and file system facts to a capabilities report."""
+        self.release_deleted()
+        stats = get_stats(self.path)
+        status['free_space'] = stats['free_space']
+        status['reserved_space'] = self.reserved
+        status['filesystem'] = dict(get_features(self.path), **stats)
+        return status
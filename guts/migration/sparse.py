@@ -0,0 +1,144 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Sparse writing and allocation maps of the disks in the conversion dir.
+
+Exported disks are mostly zeroes. Blocks of zeroes received from a source
+are not written to the conversion directory, they are left as holes in the
+disk file instead. Once written, the allocation map of a disk, read with
+SEEK_DATA and SEEK_HOLE, tells which of its bytes actually have to be moved
+to the destination.
+"""
+
+import errno
+import os
+
+from oslo_config import cfg
+from oslo_utils import units
+
+
+sparse_opts = [
+    cfg.IntOpt('sparse_block_size',
+               default=64,
+               min=4,
+               help='Size in KiB of the blocks scanned for zeroes while '
+                    'writing disks to the conversion directory. Blocks '
+                    'of zeroes are left as holes in the disk files.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(sparse_opts)
+
+# lseek whence values, Linux only and missing from the os module of
+# python 2.
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+
+# Blocks of zeroes compared against, by size.
+_ZEROES = {}
+
+
+def is_zero(data):
+    """Return True if the given block only holds zeroes."""
+    zeroes = _ZEROES.get(len(data))
+    if zeroes is None:
+        zeroes = _ZEROES[len(data)] = b'\0' * len(data)
+    return data == zeroes
+
+
+class SparseWriter(object):
+    """Writes a disk file, leaving holes in place of blocks of zeroes.
+
+    Blocks are aligned on their offset in the file, so the holes line up
+    with the blocks of the file system. Parts of the file which are not
+    written to must already read as zeroes, :meth:`finish` extends the
+    file over the zeroes at its end.
+    """
+
+    def __init__(self, fileobj, offset=0, block_size=None):
+        self.fileobj = fileobj
+        self.offset = offset
+        self.block_size = (block_size or
+                           CONF.sparse_block_size * units.Ki)
+        self.written_bytes = 0
+        self.skipped_bytes = 0
+        self._seek_pending = False
+        self.fileobj.seek(offset)
+
+    def _write_block(self, block):
+        if is_zero(block):
+            self.skipped_bytes += len(block)
+            self._seek_pending = True
+        else:
+            if self._seek_pending:
+                self.fileobj.seek(self.offset)
+                self._seek_pending = False
+            self.fileobj.write(block)
+            self.written_bytes += len(block)
+        self.offset += len(block)
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view):
+            length = self.block_size - self.offset % self.block_size
+            block = view[:length].tobytes()
+            self._write_block(block)
+            view = view[len(block):]
+
+    def finish(self):
+        """Extend the file to the end of the written data."""
+        self.fileobj.flush()
+        if self._seek_pending:
+            if os.fstat(self.fileobj.fileno()).st_size < self.offset:
+                self.fileobj.truncate(self.offset)
+            self._seek_pending = False
+
+
+def get_data_extents(path):
+    """Return the (offset, length) extents of path holding data.
+
+    Returns None when the file system does not expose the allocation map
+    of its files.
+    """
+    extents = []
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        offset = 0
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # Only a hole is left up to the end of the file.
+                    break
+                if e.errno == errno.EINVAL:
+                    return None
+                raise
+            end = os.lseek(fd, start, SEEK_HOLE)
+            extents.append((start, end - start))
+            offset = end
+    finally:
+        os.close(fd)
+    return extents
+
+
+def get_usage(path):
+    """Return the logical size of path and how many bytes hold data."""
+    size = os.path.getsize(path)
+    extents = get_data_extents(path)
+    if extents is None:
+        return size, size
+    return size, sum(length for _offset, length in extents)
@@ -0,0 +1,328 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""HTTP transfer engine for exporting disks from source hypervisors.
+
+All the disks of a resource are downloaded concurrently. Each disk is split
+into byte ranges which are fetched over a pooled set of keep-alive
+connections, and every completed range is checkpointed next to the
+destination file so that an interrupted export resumes where it stopped
+instead of starting again from zero. Blocks of zeroes are left as holes in
+the destination file rather than written to it.
+"""
+
+import json
+import os
+import threading
+
+from eventlet import greenpool
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import units
+import requests
+from requests import adapters
+import six
+
+from guts import exception
+from guts.i18n import _LI, _LW
+from guts.migration import sparse
+
+
+transfer_opts = [
+    cfg.IntOpt('transfer_max_connections',
+               default=8,
+               min=1,
+               help='Maximum number of concurrent HTTP connections used '
+                    'to export the disks of a single resource.'),
+    cfg.IntOpt('transfer_range_size',
+               default=64,
+               min=1,
+               help='Size in MiB of the byte ranges a disk is split into '
+                    'when the source supports ranged requests.'),
+    cfg.IntOpt('transfer_chunk_size',
+               default=1024,
+               min=4,
+               help='Size in KiB of the blocks read from the network and '
+                    'written to the conversion directory.'),
+    cfg.IntOpt('transfer_retries',
+               default=3,
+               min=0,
+               help='Number of times a failed byte range is retried before '
+                    'the transfer is aborted.'),
+    cfg.BoolOpt('transfer_verify_ssl',
+                default=False,
+                help='Verify the SSL certificate of the server disks are '
+                     'exported from.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(transfer_opts)
+
+LOG = logging.getLogger(__name__)
+
+
+class RangeCheckpoint(object):
+    """Completed byte ranges of a partially downloaded disk.
+
+    The checkpoint is stored as a small JSON file next to the disk. A disk
+    file without a checkpoint is considered complete.
+    """
+
+    SUFFIX = '.ranges'
+
+    def __init__(self, disk_path, size):
+        self.path = disk_path + self.SUFFIX
+        self.size = size
+        self.completed = set()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        # A different size means the source disk changed, start over.
+        if data.get('size') != self.size:
+            return
+        self.completed = set(tuple(r) for r in data.get('ranges', []))
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'size': self.size,
+                       'ranges': sorted(self.completed)}, f)
+        os.rename(tmp_path, self.path)
+
+    def mark(self, start, end):
+        with self._lock:
+            self.completed.add((start, end))
+            self.save()
+
+    def is_completed(self, start, end):
+        return (start, end) in self.completed
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _ByteRange(object):
+    """Part of a disk fetched by a single request."""
+
+    def __init__(self, url, path, start=0, end=None, checkpoint=None):
+        self.url = url
+        self.path = path
+        self.start = start
+        self.end = end
+        self.checkpoint = checkpoint
+
+    @property
+    def ranged(self):
+        return self.end is not None
+
+
+class HttpTransferEngine(object):
+    """Downloads disks over HTTP(S) in parallel, resumable byte ranges."""
+
+    def __init__(self, configuration, headers=None):
+        self.max_connections = configuration.transfer_max_connections
+        self.range_size = configuration.transfer_range_size * units.Mi
+        self.chunk_size = configuration.transfer_chunk_size * units.Ki
+        self.retries = configuration.transfer_retries
+
+        self.session = requests.Session()
+        adapter = adapters.HTTPAdapter(pool_connections=1,
+                                       pool_maxsize=self.max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.verify = configuration.transfer_verify_ssl
+        if headers:
+            self.session.headers.update(headers)
+
+        self.total_bytes = 0
+        self.transferred_bytes = 0
+        self.skipped_bytes = 0
+        self._checkpoints = []
+        self._lock = threading.Lock()
+
+    @property
+    def progress(self):
+        """Percentage of the transfer completed so far."""
+        if not self.total_bytes:
+            return 0
+        return min(100, self.transferred_bytes * 100 // self.total_bytes)
+
+    def _advance(self, nbytes, skipped=0):
+        with self._lock:
+            self.transferred_bytes += nbytes
+            self.skipped_bytes += skipped
+
+    def _probe(self, url):
+        """Return the size of the remote file and if it accepts ranges."""
+        try:
+            resp = self.session.head(url, allow_redirects=True)
+        except requests.RequestException as e:
+            LOG.warning(_LW('Unable to probe %(url)s, falling back to a '
+                            'single stream: %(err)s'), {'url': url, 'err': e})
+            return None, False
+        if resp.status_code != 200:
+            return None, False
+        size = resp.headers.get('Content-Length')
+        size = int(size) if size and size.isdigit() else None
+        ranged = (resp.headers.get('Accept-Ranges') == 'bytes' and
+                  size is not None)
+        return size, ranged
+
+    def _plan(self, url, path):
+        """Return the byte ranges still missing for the given disk."""
+        checkpoint_path = path + RangeCheckpoint.SUFFIX
+        if os.path.exists(path) and not os.path.exists(checkpoint_path):
+            LOG.info(_LI('Disk %s already downloaded, skipping.'), path)
+            return []
+
+        size, ranged = self._probe(url)
+        if not ranged:
+            self.total_bytes += size or 0
+            return [_ByteRange(url, path)]
+
+        checkpoint = RangeCheckpoint(path, size)
+        # Persist the checkpoint before the disk file is created so that a
+        # crash in between is never mistaken for a finished download.
+        checkpoint.save()
+        self._checkpoints.append(checkpoint)
+        flags = os.O_WRONLY | os.O_CREAT
+        if not checkpoint.completed:
+            # Zeroes are not written, the holes must not keep the data of
+            # an earlier download.
+            flags |= os.O_TRUNC
+        fd = os.open(path, flags, 0o644)
+        try:
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+        self.total_bytes += size
+        pending = []
+        for start in range(0, size, self.range_size):
+            end = min(start + self.range_size, size)
+            if checkpoint.is_completed(start, end):
+                self.transferred_bytes += end - start
+                continue
+            pending.append(_ByteRange(url, path, start, end, checkpoint))
+        if checkpoint.completed:
+            LOG.info(_LI('Resuming download of %(path)s, %(count)d ranges '
+                         'left.'), {'path': path, 'count': len(pending)})
+        return pending
+
+    def _fetch(self, byte_range):
+        headers = {}
+        if byte_range.ranged:
+            headers['Range'] = 'bytes=%d-%d' % (byte_range.start,
+                                                byte_range.end - 1)
+            mode = 'r+b'
+            write_path = byte_range.path
+        else:
+            mode = 'wb'
+            write_path = byte_range.path + '.part'
+
+        resp = self.session.get(byte_range.url, headers=headers, stream=True)
+        try:
+            expected = 206 if byte_range.ranged else 200
+            if resp.status_code != expected:
+                raise exception.DiskTransferFailed(
+                    url=byte_range.url,
+                    reason='HTTP %s' % resp.status_code)
+            written = 0
+            with open(write_path, mode) as f:
+                writer = sparse.SparseWriter(f, byte_range.start)
+                try:
+                    for chunk in resp.iter_content(self.chunk_size):
+                        writer.write(chunk)
+                        written += len(chunk)
+                        self._advance(len(chunk))
+                    writer.finish()
+                except Exception:
+                    # Do not count bytes that will be fetched again.
+                    self._advance(-written)
+                    raise
+            self._advance(0, skipped=writer.skipped_bytes)
+        finally:
+            resp.close()
+
+        if byte_range.ranged:
+            byte_range.checkpoint.mark(byte_range.start, byte_range.end)
+        else:
+            os.rename(write_path, byte_range.path)
+
+    def _fetch_with_retries(self, byte_range):
+        attempt = 0
+        while True:
+            try:
+                return self._fetch(byte_range)
+            except (requests.RequestException, IOError) as e:
+                if attempt >= self.retries:
+                    raise exception.DiskTransferFailed(url=byte_range.url,
+                                                       reason=e)
+                attempt += 1
+                LOG.warning(_LW('Retrying range %(start)s-%(end)s of '
+                                '%(path)s (attempt %(attempt)d): %(err)s'),
+                            {'start': byte_range.start,
+                             'end': byte_range.end,
+                             'path': byte_range.path,
+                             'attempt': attempt, 'err': e})
+
+    def download(self, disks, expected_size=None):
+        """Download the given disks.
+
+        :param disks: list of (url, destination path) tuples.
+        :param expected_size: total size in bytes to report progress
+                              against when the server does not announce
+                              the size of the disks.
+        """
+        # Interleave the ranges of all disks so they progress together.
+        planned = [self._plan(url, path) for url, path in disks]
+        ranges = [r for group in six.moves.zip_longest(*planned)
+                  for r in group if r is not None]
+        if not self.total_bytes and expected_size:
+            self.total_bytes = expected_size
+
+        pool = greenpool.GreenPool(self.max_connections)
+        errors = []
+
+        def _worker(byte_range):
+            try:
+                self._fetch_with_retries(byte_range)
+            except Exception as e:
+                errors.append(e)
+
+        for byte_range in ranges:
+            if errors:
+                break
+            pool.spawn_n(_worker, byte_range)
+        pool.waitall()
+        if errors:
+            raise errors[0]
+
+        for checkpoint in self._checkpoints:
+            checkpoint.remove()
+        LOG.info(_LI('Transferred %(bytes)d bytes for %(count)d disk(s), '
+                     '%(skipped)d bytes of zeroes left as holes.'),
+                 {'bytes': self.transferred_bytes, 'count': len(disks),
+                  'skipped': self.skipped_bytes})
+
+    def close(self):
+        self.session.close()
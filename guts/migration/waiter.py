@@ -0,0 +1,243 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Waiting for remote resources to reach a status.
+
+Drivers register the images, volumes, etc. they wait for with a
+ResourceWaiter. A single poller per waiter checks all of them at once,
+backing off while nothing changes. When several are pending, the ones
+still in the status they were last seen in are found with one list
+request per status, filtered on it, and only the others are fetched one
+by one. Requests of all the waiters sharing an endpoint are throttled by
+a common budget.
+"""
+
+import random
+import time
+
+from eventlet import event
+from eventlet import greenthread
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from guts import exception
+from guts.i18n import _LW
+
+
+waiter_opts = [
+    cfg.FloatOpt('waiter_initial_interval',
+                 default=2.0,
+                 min=0.1,
+                 help='Seconds between the first status checks of a '
+                      'resource being waited for.'),
+    cfg.FloatOpt('waiter_max_interval',
+                 default=30.0,
+                 min=1.0,
+                 help='Maximum number of seconds between two status checks '
+                      'when the status of the resources does not change.'),
+    cfg.IntOpt('waiter_timeout',
+               default=3600,
+               min=1,
+               help='Seconds to wait for a resource to reach the expected '
+                    'status before the migration fails.'),
+    cfg.FloatOpt('waiter_endpoint_rate',
+                 default=1.0,
+                 min=0.01,
+                 help='Maximum number of status requests per second sent '
+                      'to a single endpoint by this service.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(waiter_opts)
+
+LOG = logging.getLogger(__name__)
+
+
+def _is_not_found(error):
+    # The clients of the services all carry the HTTP status of the error.
+    return (getattr(error, 'code', None) == 404 or
+            getattr(error, 'http_status', None) == 404)
+
+
+class EndpointBudget(object):
+    """Token bucket shared by all the waiters polling one endpoint."""
+
+    _budgets = {}
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.time()
+
+    @classmethod
+    def get(cls, endpoint, rate):
+        budget = cls._budgets.get(endpoint)
+        if budget is None:
+            budget = cls._budgets[endpoint] = cls(rate)
+        return budget
+
+    def consume(self):
+        """Take one request from the budget, sleeping until there is one."""
+        while True:
+            now = time.time()
+            refill = (now - self.updated_at) * self.rate
+            self.tokens = min(self.capacity, self.tokens + refill)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+class _PendingResource(object):
+
+    def __init__(self, resource_id, ready, failed, deadline):
+        self.resource_id = resource_id
+        self.ready = ready
+        self.failed = failed
+        self.deadline = deadline
+        self.status = None
+        self.event = event.Event()
+
+
+class ResourceWaiter(object):
+    """Waits for resources of one kind to reach a status.
+
+    :param name: name of the resources in messages, e.g. 'image'.
+    :param endpoint: key of the request budget, waiters polling the same
+                     service share it.
+    :param get_func: returns a single resource by id.
+    :param list_func: returns the resources visible to the driver which
+                      are in the given status.
+    """
+
+    def __init__(self, name, endpoint, get_func, list_func, configuration):
+        self.name = name
+        self._get = get_func
+        self._list = list_func
+        self.initial_interval = configuration.waiter_initial_interval
+        self.max_interval = configuration.waiter_max_interval
+        self.timeout = configuration.waiter_timeout
+        self.budget = EndpointBudget.get(endpoint,
+                                         configuration.waiter_endpoint_rate)
+        self._pending = {}
+        self._poller = None
+
+    def wait(self, resource_id, ready, failed=('error',), timeout=None):
+        """Wait for the given resource to reach one of the ready statuses.
+
+        :returns: the resource, as last returned by the remote service.
+        :raises: ResourceWaitFailed if it reaches one of the failed
+                 statuses, ResourceWaitTimeout if it does not get ready in
+                 time.
+        """
+        deadline = time.time() + (timeout or self.timeout)
+        pending = _PendingResource(resource_id, ready, failed, deadline)
+        self._pending[resource_id] = pending
+        if self._poller is None:
+            self._poller = greenthread.spawn(self._poll_loop)
+        return pending.event.wait()
+
+    def _resolve(self, pending, resource=None, error=None):
+        del self._pending[pending.resource_id]
+        if error is not None:
+            pending.event.send_exception(error)
+        else:
+            pending.event.send(resource)
+
+    def _check(self, pending, resource):
+        """Resolve pending if resource reached an end status.
+
+        Returns True if the status of the resource changed.
+        """
+        changed = resource.status != pending.status
+        pending.status = resource.status
+        if resource.status in pending.ready:
+            self._resolve(pending, resource=resource)
+        elif resource.status in pending.failed:
+            self._resolve(pending, error=exception.ResourceWaitFailed(
+                resource=self.name, id=pending.resource_id,
+                status=resource.status))
+        return changed
+
+    def _list_unchanged(self):
+        """Return the pending resources still in their last seen status."""
+        resources = {}
+        statuses = set(pending.status for pending in self._pending.values()
+                       if pending.status is not None)
+        for status in statuses:
+            self.budget.consume()
+            for resource in self._list(status):
+                if resource.id in self._pending:
+                    resources[resource.id] = resource
+        return resources
+
+    def _poll_once(self):
+        """Check all pending resources, return True if any changed."""
+        resources = {}
+        if len(self._pending) > 1:
+            resources = self._list_unchanged()
+
+        changed = False
+        for pending in list(self._pending.values()):
+            resource = resources.get(pending.resource_id)
+            if resource is None:
+                self.budget.consume()
+                try:
+                    resource = self._get(pending.resource_id)
+                except Exception as e:
+                    if not _is_not_found(e):
+                        LOG.warning(_LW('Failed to get the status of '
+                                        '%(name)s %(id)s: %(err)s'),
+                                    {'name': self.name,
+                                     'id': pending.resource_id, 'err': e})
+                        continue
+                    self._resolve(pending, error=exception.ResourceWaitFailed(
+                        resource=self.name, id=pending.resource_id,
+                        status='deleted'))
+                    changed = True
+                    continue
+            changed = self._check(pending, resource) or changed
+        return changed
+
+    def _expire(self):
+        now = time.time()
+        for pending in list(self._pending.values()):
+            if now > pending.deadline:
+                self._resolve(pending, error=exception.ResourceWaitTimeout(
+                    resource=self.name, id=pending.resource_id,
+                    status=pending.status))
+
+    def _poll_loop(self):
+        interval = self.initial_interval
+        try:
+            while self._pending:
+                # Jitter keeps the pollers of a host from synchronizing.
+                time.sleep(interval * random.uniform(0.5, 1.5))
+                try:
+                    changed = self._poll_once()
+                except Exception as e:
+                    LOG.warning(_LW('Failed to poll the status of %(name)s '
+                                    'resources: %(err)s'),
+                                {'name': self.name, 'err': e})
+                    changed = False
+                self._expire()
+                if changed:
+                    interval = self.initial_interval
+                else:
+                    interval = min(interval * 2, self.max_interval)
+        finally:
+            self._poller = None
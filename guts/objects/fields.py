@@ -0,0 +1,42 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Field types of guts objects."""
+
+from oslo_versionedobjects import fields
+import six
+
+from guts.i18n import _
+from guts import utils
+
+
+class Json(fields.FieldType):
+    """Dictionary of JSON serializable values.
+
+    JSON text is decoded, so values can be set from the database column
+    as well as from the API.
+    """
+
+    def coerce(self, obj, attr, value):
+        if isinstance(value, six.string_types):
+            value = utils.load_properties(value)
+        if not isinstance(value, dict):
+            raise ValueError(_('A dictionary is required in field %s, '
+                               'not %s') % (attr, type(value).__name__))
+        return value
+
+
+class JsonField(fields.AutoTypedField):
+    AUTO_TYPE = Json()
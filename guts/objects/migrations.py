@@ -34,7 +34,11 @@ class Migration(base.GutsPersistentObject, base.GutsObject,
                 base.GutsObjectDictCompat,
                 base.GutsComparableObject):
     # Version 1.0: Initial version
-    VERSION = '1.0'
+    # Version 1.1: Added disk_conversion and conversion_time_saved
+    # Version 1.2: Added resource_type and destination_host
+    # Version 1.3: Added source_host, project_id and priority
+    # Version 1.4: Added bytes_logical and bytes_transferred
+    VERSION = '1.4'
 
     fields = {
         'id': fields.StringField(),
@@ -44,30 +48,71 @@ class Migration(base.GutsPersistentObject, base.GutsObject,
         'migration_status': fields.StringField(nullable=True),
         'migration_event': fields.StringField(nullable=True),
         'destination_hypervisor': fields.StringField(nullable=True),
+        'disk_conversion': fields.StringField(nullable=True),
+        'conversion_time_saved': fields.FloatField(nullable=True),
+        'source_host': fields.StringField(nullable=True),
+        'project_id': fields.StringField(nullable=True),
+        'priority': fields.IntegerField(default=0),
+        'bytes_logical': fields.IntegerField(nullable=True),
+        'bytes_transferred': fields.IntegerField(nullable=True),
+        # Read only, from the resource and the destination service.
+        'resource_type': fields.StringField(nullable=True),
+        'destination_host': fields.StringField(nullable=True),
+    }
+
+    # Fields loaded from related rows, by the name of the relationship.
+    RELATED_FIELDS = {
+        'resource': ('resource_type', 'type'),
+        'destination': ('destination_host', 'host'),
     }
 
     def obj_make_compatible(self, primitive, target_version):
         """Make an object representation compatible with a target version."""
         target_version = utils.convert_version_to_tuple(target_version)
+        if target_version < (1, 1):
+            primitive.pop('disk_conversion', None)
+            primitive.pop('conversion_time_saved', None)
+        if target_version < (1, 2):
+            primitive.pop('resource_type', None)
+            primitive.pop('destination_host', None)
+        if target_version < (1, 3):
+            primitive.pop('source_host', None)
+            primitive.pop('project_id', None)
+            primitive.pop('priority', None)
+        if target_version < (1, 4):
+            primitive.pop('bytes_logical', None)
+            primitive.pop('bytes_transferred', None)
 
     @staticmethod
-    def _from_db_object(context, migration, db_migration):
+    def _from_db_object(context, migration, db_migration,
+                        expected_attrs=None):
+        related_fields = [field for field, _column
+                          in Migration.RELATED_FIELDS.values()]
         for name, field in migration.fields.items():
+            if name in related_fields:
+                continue
             value = db_migration.get(name)
-            if isinstance(field, fields.IntegerField):
+            if isinstance(field, fields.IntegerField) and not field.nullable:
                 value = value or 0
             elif isinstance(field, fields.DateTimeField):
                 value = value or None
             migration[name] = value
 
+        for relation in expected_attrs or []:
+            field, column = Migration.RELATED_FIELDS[relation]
+            related = db_migration.get(relation)
+            migration[field] = related[column] if related else None
+
         migration._context = context
         migration.obj_reset_changes()
         return migration
 
     @base.remotable_classmethod
-    def get(cls, context, migration_id):
-        db_migration = db.migration_get(context, migration_id)
-        return cls._from_db_object(context, cls(context), db_migration)
+    def get(cls, context, migration_id, expected_attrs=None):
+        db_migration = db.migration_get(context, migration_id,
+                                        expected_fields=expected_attrs)
+        return cls._from_db_object(context, cls(context), db_migration,
+                                   expected_attrs=expected_attrs)
 
     @base.remotable
     def create(self):
@@ -93,17 +138,69 @@ class Migration(base.GutsPersistentObject, base.GutsObject,
 
 @base.GutsObjectRegistry.register
 class MigrationList(base.ObjectListBase, base.GutsObject):
-    VERSION = '1.0'
+    # Version 1.1: Migration version 1.1
+    # Version 1.2: Migration version 1.2, added expected_attrs to get_all
+    # Version 1.3: Added pagination and sorting to get_all
+    # Version 1.4: Added create_all
+    # Version 1.5: Migration version 1.3, added claim_queued
+    # Version 1.6: Migration version 1.4
+    # Version 1.7: Added fail_stale
+    VERSION = '1.7'
 
     fields = {
         'objects': fields.ListOfObjectsField('Migration'),
     }
     child_versions = {
-        '1.0': '1.0'
+        '1.0': '1.0',
+        '1.1': '1.1',
+        '1.2': '1.2',
+        '1.3': '1.2',
+        '1.4': '1.2',
+        '1.5': '1.3',
+        '1.6': '1.4',
+        '1.7': '1.4',
     }
 
     @base.remotable_classmethod
-    def get_all(cls, context, filters=None):
-        migrations = db.migration_get_all(context, filters)
+    def get_all(cls, context, filters=None, expected_attrs=None,
+                marker=None, limit=None, sort_keys=None, sort_dirs=None):
+        """Return all migrations.
+
+        :param expected_attrs: related rows loaded in the same query,
+                               'resource' sets resource_type and
+                               'destination' sets destination_host.
+        """
+        migrations = db.migration_get_all(context,
+                                          expected_fields=expected_attrs,
+                                          filters=filters, marker=marker,
+                                          limit=limit, sort_keys=sort_keys,
+                                          sort_dirs=sort_dirs)
+        return base.obj_make_list(context, cls(context), objects.Migration,
+                                  migrations, expected_attrs=expected_attrs)
+
+    @base.remotable_classmethod
+    def create_all(cls, context, values_list):
+        """Create a migration for each of the given values at once."""
+        migrations = db.migration_create_all(context, values_list)
         return base.obj_make_list(context, cls(context), objects.Migration,
                                   migrations)
+
+    @base.remotable_classmethod
+    def claim_queued(cls, context, source_host, count, destination_limits,
+                     default_destination_limit, expected_attrs=None):
+        """Start up to count queued migrations of the given source host."""
+        migrations = db.migration_claim_queued(
+            context, source_host, count, destination_limits,
+            default_destination_limit, expected_fields=expected_attrs)
+        return base.obj_make_list(context, cls(context), objects.Migration,
+                                  migrations, expected_attrs=expected_attrs)
+
+    @base.remotable_classmethod
+    def fail_stale(cls, context, service_down_time, timeout,
+                   expected_attrs=None):
+        """Fail the running migrations which cannot complete anymore."""
+        migrations = db.migration_fail_stale(
+            context, service_down_time, timeout,
+            expected_fields=expected_attrs)
+        return base.obj_make_list(context, cls(context), objects.Migration,
+                                  migrations, expected_attrs=expected_attrs)
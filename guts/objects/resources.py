@@ -23,6 +23,7 @@ from guts import exception
 from guts.i18n import _
 from guts import objects
 from guts.objects import base
+from guts.objects import fields as guts_fields
 from guts import utils
 
 CONF = cfg.CONF
@@ -34,7 +35,8 @@ class Resource(base.GutsPersistentObject, base.GutsObject,
                base.GutsObjectDictCompat,
                base.GutsComparableObject):
     # Version 1.0: Initial version
-    VERSION = '1.0'
+    # Version 1.1: properties is a dictionary, added memory, vcpus and size
+    VERSION = '1.1'
 
     fields = {
         'id': fields.StringField(),
@@ -42,7 +44,10 @@ class Resource(base.GutsPersistentObject, base.GutsObject,
         'name': fields.StringField(nullable=True),
         'type': fields.StringField(nullable=True),
         'source': fields.StringField(nullable=True),
-        'properties': fields.StringField(nullable=True),
+        'properties': guts_fields.JsonField(nullable=True),
+        'memory': fields.IntegerField(nullable=True),
+        'vcpus': fields.IntegerField(nullable=True),
+        'size': fields.IntegerField(nullable=True),
         'migrated': fields.BooleanField(default=False),
         'deleted': fields.BooleanField(default=False),
     }
@@ -50,12 +55,17 @@ class Resource(base.GutsPersistentObject, base.GutsObject,
     def obj_make_compatible(self, primitive, target_version):
         """Make an object representation compatible with a target version."""
         target_version = utils.convert_version_to_tuple(target_version)
+        if target_version < (1, 1):
+            for key in utils.INDEXED_RESOURCE_PROPERTIES:
+                primitive.pop(key, None)
+            if primitive.get('properties') is not None:
+                primitive['properties'] = str(primitive['properties'])
 
     @staticmethod
     def _from_db_object(context, resource, db_service):
         for name, field in resource.fields.items():
             value = db_service.get(name)
-            if isinstance(field, fields.IntegerField):
+            if isinstance(field, fields.IntegerField) and not field.nullable:
                 value = value or 0
             elif isinstance(field, fields.DateTimeField):
                 value = value or None
@@ -99,18 +109,29 @@ class Resource(base.GutsPersistentObject, base.GutsObject,
 
 @base.GutsObjectRegistry.register
 class ResourceList(base.ObjectListBase, base.GutsObject):
-    VERSION = '1.0'
+    # Version 1.0: Initial version
+    # Version 1.1: Added sync_by_source
+    # Version 1.2: Added pagination and sorting to get_all
+    # Version 1.3: Resource version 1.1
+    VERSION = '1.3'
 
     fields = {
         'objects': fields.ListOfObjectsField('Resource'),
     }
     child_versions = {
-        '1.0': '1.0'
+        '1.0': '1.0',
+        '1.1': '1.0',
+        '1.2': '1.0',
+        '1.3': '1.1',
     }
 
     @base.remotable_classmethod
-    def get_all(cls, context, filters=None):
-        resources = db.resource_get_all(context, filters)
+    def get_all(cls, context, filters=None, marker=None, limit=None,
+                sort_keys=None, sort_dirs=None):
+        resources = db.resource_get_all(context, filters=filters,
+                                        marker=marker, limit=limit,
+                                        sort_keys=sort_keys,
+                                        sort_dirs=sort_dirs)
         return base.obj_make_list(context, cls(context), objects.Resource,
                                   resources)
 
@@ -129,3 +150,11 @@ class ResourceList(base.ObjectListBase, base.GutsObject):
     @base.remotable_classmethod
     def delete_all_by_source(cls, context, source, disabled=None):
         db.resource_delete_all_by_source(context, source)
+
+    @base.remotable_classmethod
+    def sync_by_source(cls, context, source, resources, removed=None,
+                       complete=False):
+        """Create, update and delete the resources of a source at once."""
+        return db.resource_sync_by_source(context, source, resources,
+                                          removed=removed,
+                                          complete=complete)
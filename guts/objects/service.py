@@ -105,24 +105,38 @@ class Service(base.GutsPersistentObject, base.GutsObject,
 
 @base.GutsObjectRegistry.register
 class ServiceList(base.ObjectListBase, base.GutsObject):
-    VERSION = '1.0'
+    # Version 1.0: Initial version
+    # Version 1.1: Added pagination and sorting to get_all and
+    #              get_all_by_topic
+    VERSION = '1.1'
 
     fields = {
         'objects': fields.ListOfObjectsField('Service'),
     }
     child_versions = {
-        '1.0': '1.0'
+        '1.0': '1.0',
+        '1.1': '1.0',
     }
 
     @base.remotable_classmethod
-    def get_all(cls, context, filters=None):
-        services = db.service_get_all(context, filters)
+    def get_all(cls, context, filters=None, marker=None, limit=None,
+                sort_keys=None, sort_dirs=None):
+        services = db.service_get_all(context, filters=filters,
+                                      marker=marker, limit=limit,
+                                      sort_keys=sort_keys,
+                                      sort_dirs=sort_dirs)
         return base.obj_make_list(context, cls(context), objects.Service,
                                   services)
 
     @base.remotable_classmethod
-    def get_all_by_topic(cls, context, topic, disabled=None):
+    def get_all_by_topic(cls, context, topic, disabled=None, filters=None,
+                         marker=None, limit=None, sort_keys=None,
+                         sort_dirs=None):
         services = db.service_get_all_by_topic(context, topic,
-                                               disabled=disabled)
+                                               disabled=disabled,
+                                               filters=filters,
+                                               marker=marker, limit=limit,
+                                               sort_keys=sort_keys,
+                                               sort_dirs=sort_dirs)
         return base.obj_make_list(context, cls(context), objects.Service,
                                   services)
@@ -22,11 +22,15 @@ __all__ = [
     'get_allowed_exmods',
     'RequestContextSerializer',
     'get_client',
+    'get_cached_client',
+    'reset',
     'get_server',
     'get_notifier',
     'TRANSPORT_ALIASES',
 ]
 
+import collections
+
 from oslo_config import cfg
 import oslo_messaging as messaging
 from oslo_serialization import jsonutils
@@ -40,6 +44,10 @@ CONF = cfg.CONF
 TRANSPORT = None
 NOTIFIER = None
 
+# Prepared clients by (topic, version), least recently used first.
+_CLIENTS = collections.OrderedDict()
+CLIENT_CACHE_SIZE = 128
+
 ALLOWED_EXMODS = [
     guts.exception.__name__,
 ]
@@ -64,6 +72,7 @@ def init(conf):
 
     serializer = RequestContextSerializer(JsonPayloadSerializer())
     NOTIFIER = messaging.Notifier(TRANSPORT, serializer=serializer)
+    reset()
 
 
 def initialized():
@@ -74,6 +83,7 @@ def cleanup():
     global TRANSPORT, NOTIFIER
     assert TRANSPORT is not None
     assert NOTIFIER is not None
+    reset()
     TRANSPORT.cleanup()
     TRANSPORT = NOTIFIER = None
 
@@ -144,6 +154,30 @@ def get_client(target, version_cap=None, serializer=None):
                                serializer=serializer)
 
 
+def get_cached_client(topic, version):
+    """Return a client prepared to send to the given topic.
+
+    Clients are shared by all the callers of the process and kept in a
+    least recently used cache, they use the guts object serializer.
+    """
+    key = (topic, version)
+    client = _CLIENTS.pop(key, None)
+    if client is None:
+        target = messaging.Target(topic=topic, version=version)
+        client = get_client(target, version_cap=None,
+                            serializer=base.GutsObjectSerializer())
+        client = client.prepare(version=version)
+        if len(_CLIENTS) >= CLIENT_CACHE_SIZE:
+            _CLIENTS.popitem(last=False)
+    _CLIENTS[key] = client
+    return client
+
+
+def reset():
+    """Drop the cached clients, they are created again when next used."""
+    _CLIENTS.clear()
+
+
 def get_server(target, endpoints, serializer=None):
     assert TRANSPORT is not None
     serializer = RequestContextSerializer(serializer)
@@ -0,0 +1,129 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Versioned capability reports.
+
+Services report their capabilities to the schedulers at every periodic
+interval. Every report has a generation number, and either carries all the
+capabilities of the service or only what changed since the report of the
+previous generation. Resources are compared by their id.
+
+A full report looks like::
+
+    {'generation': 12, 'capabilities': {...}}
+
+and a delta report like::
+
+    {'generation': 13, 'base_generation': 12,
+     'delta': {'changed': {'free_space': 42},
+               'removed': [],
+               'resources': {'instance': {'updated': [{...}],
+                                          'removed': ['<id>']}}}}
+"""
+
+
+def _index(resources):
+    return {resource.get('id'): resource for resource in resources}
+
+
+def make_full_report(generation, capabilities):
+    return {'generation': generation, 'capabilities': capabilities}
+
+
+def make_delta_report(generation, old, new):
+    """Report the differences from the old to the new capabilities."""
+    delta = {'changed': {}, 'removed': [], 'resources': {}}
+    for key, value in new.items():
+        if key != 'resources' and old.get(key) != value:
+            delta['changed'][key] = value
+    delta['removed'] = [key for key in old if key not in new]
+
+    old_resources = old.get('resources', {})
+    new_resources = new.get('resources', {})
+    for resource_type in set(old_resources) | set(new_resources):
+        old_index = _index(old_resources.get(resource_type, []))
+        new_index = _index(new_resources.get(resource_type, []))
+        updated = [resource for resource_id, resource in new_index.items()
+                   if old_index.get(resource_id) != resource]
+        removed = [resource_id for resource_id in old_index
+                   if resource_id not in new_index]
+        if updated or removed:
+            delta['resources'][resource_type] = {'updated': updated,
+                                                 'removed': removed}
+    return {'generation': generation,
+            'base_generation': generation - 1,
+            'delta': delta}
+
+
+def is_delta(report):
+    return 'delta' in report
+
+
+def is_empty(report):
+    """Return True for a delta report without any change."""
+    delta = report.get('delta')
+    return (delta is not None and not delta['changed'] and
+            not delta['removed'] and not delta['resources'])
+
+
+def apply_resource_changes(resources, changes):
+    """Return the list of resources with the given changes applied."""
+    index = _index(resources)
+    for resource in changes.get('updated', []):
+        index[resource.get('id')] = resource
+    for resource_id in changes.get('removed', []):
+        index.pop(resource_id, None)
+    return list(index.values())
+
+
+def apply_delta(capabilities, delta):
+    """Return the capabilities updated with the given delta."""
+    updated = dict(capabilities)
+    updated.update(delta['changed'])
+    for key in delta['removed']:
+        updated.pop(key, None)
+
+    resources = dict(capabilities.get('resources', {}))
+    for resource_type, changes in delta['resources'].items():
+        resources[resource_type] = apply_resource_changes(
+            resources.get(resource_type, []), changes)
+        if not resources[resource_type]:
+            del resources[resource_type]
+    updated['resources'] = resources
+    return updated
+
+
+def get_resource_changes(report):
+    """Return the resource changes carried by a report, by resource type.
+
+    A full report updates every resource it lists.
+    """
+    if is_delta(report):
+        return report['delta']['resources']
+    resources = get_capabilities(report).get('resources', {})
+    return {resource_type: {'updated': resources[resource_type],
+                            'removed': []}
+            for resource_type in resources}
+
+
+def get_capabilities(report):
+    """Return the capabilities of a full report.
+
+    Services which do not version their reports send the capabilities
+    themselves.
+    """
+    if 'generation' not in report:
+        return report
+    return report['capabilities']
@@ -20,6 +20,7 @@ Scheduler base class that all Schedulers should inherit from
 from oslo_config import cfg
 from oslo_utils import importutils
 
+from guts import context
 from guts.i18n import _
 from guts.migration import rpcapi as migration_rpcapi
 
@@ -61,9 +62,16 @@ class Scheduler(object):
 
     def update_service_capabilities(self, service_name, host, capabilities):
         """Process a capability update from a service node."""
-        self.host_manager.update_service_capabilities(service_name,
-                                                      host,
-                                                      capabilities)
+        if self.host_manager.update_service_capabilities(service_name,
+                                                         host,
+                                                         capabilities):
+            return
+        if service_name == 'source':
+            rpcapi = self.source_rpcapi
+        else:
+            rpcapi = self.destination_rpcapi
+        rpcapi.publish_service_capabilities(context.get_admin_context(),
+                                            host=host)
 
     def host_passes_filters(self, context, migration_id, host,
                             filter_properties):
@@ -79,3 +87,9 @@ class Scheduler(object):
         """Must override schedule method for scheduler to work."""
         raise NotImplementedError(_("Must implement "
                                     "schedule_create_migration"))
+
+    def schedule_create_migrations(self, context, migrations,
+                                   filter_properties):
+        """Must override schedule method for scheduler to work."""
+        raise NotImplementedError(_("Must implement "
+                                    "schedule_create_migrations"))
@@ -19,15 +19,34 @@ You can customize this scheduler by specifying your own migration Filters and
 Weighing Functions.
 """
 
+import datetime
+
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import timeutils
+from oslo_utils import units
 
 from guts import exception
-from guts.i18n import _
+from guts.i18n import _, _LW
+from guts.migration import space
 from guts.scheduler import driver
 from guts.scheduler import scheduler_options
 
+filter_scheduler_opts = [
+    cfg.IntOpt('scheduler_migration_throughput',
+               default=50 * units.Mi,
+               min=1,
+               help='Bytes per second a destination is assumed to convert '
+                    'when estimating the duration of a migration.'),
+    cfg.IntOpt('scheduler_min_migration_duration',
+               default=300,
+               min=1,
+               help='Minimum number of seconds a migration is assumed to '
+                    'take when estimating the next free slot of a host.'),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(filter_scheduler_opts)
 LOG = logging.getLogger(__name__)
 
 
@@ -40,7 +59,117 @@ class FilterScheduler(driver.Scheduler):
 
     def schedule(self, context, topic, method, *args, **kwargs):
         """Schedule contract that returns best-suited host for this request."""
-        pass
+        filter_properties = kwargs.get('filter_properties') or {}
+        host_state, _start = self._schedule(context, kwargs['request_spec'],
+                                            filter_properties, topic=topic)
+        return host_state
+
+    def host_passes_filters(self, context, migration_id, host,
+                            filter_properties):
+        """Check if the specified host passes the filters."""
+        hosts = self.host_manager.get_all_host_states(
+            context, topic=CONF.destination_topic)
+        hosts = [state for state in hosts if state.host == host]
+        if self.host_manager.get_filtered_hosts(hosts, filter_properties):
+            return hosts[0]
+        raise exception.NoValidHost(
+            reason=_('Cannot place migration %(id)s on %(host)s') %
+            {'id': migration_id, 'host': host})
+
+    def schedule_create_migrations(self, context, migrations,
+                                   filter_properties):
+        """Choose the destination and start time of every migration.
+
+        The migrations are queued on their source host, which starts them
+        as its own and the destination limits allow.
+
+        :param migrations: list of dictionaries with the migration_ref and
+                           resource_ref of every migration.
+        :param filter_properties: may restrict the candidates to the
+                                  'destination_hosts' it lists.
+        """
+        hosts = self.host_manager.get_all_host_states(
+            context, topic=CONF.destination_topic)
+        now = timeutils.utcnow()
+        sources = set()
+        for migration in migrations:
+            migration_ref = migration['migration_ref']
+            resource_ref = migration['resource_ref']
+            request_spec = {'migration_id': migration_ref.id,
+                            'resource_type': resource_ref.type,
+                            'size': space.expected_size(resource_ref)}
+            properties = dict(filter_properties, request_spec=request_spec,
+                              now=now)
+            try:
+                host_state, start = self._place(hosts, request_spec,
+                                                properties, now)
+            except exception.NoValidHost as e:
+                LOG.warning(_LW('Failed to schedule migration %(id)s: '
+                                '%(err)s'),
+                            {'id': migration_ref.id, 'err': e})
+                migration_ref.migration_status = 'ERROR'
+                migration_ref.migration_event = e.msg
+                migration_ref.save()
+                continue
+
+            migration_ref.destination_hypervisor = host_state.service['id']
+            migration_ref.source_host = resource_ref.source
+            migration_ref.migration_status = 'Queued'
+            if request_spec['size']:
+                self.destination_rpcapi.reserve_space(
+                    context, host_state.host, migration_ref.id,
+                    request_spec['size'])
+            if start > now:
+                migration_ref.migration_event = (
+                    'Scheduled for %s' % start.isoformat())
+            else:
+                migration_ref.migration_event = 'Scheduled'
+            migration_ref.save()
+            sources.add(resource_ref.source)
+
+        destination_limits = {state.service['id']: state.migration_slots
+                              for state in hosts}
+        for src_host in sources:
+            self.source_rpcapi.start_queued_migrations(context, src_host,
+                                                       destination_limits)
+
+    def _get_weighted_candidates(self, hosts, filter_properties):
+        destination_hosts = filter_properties.get('destination_hosts')
+        if destination_hosts:
+            hosts = [state for state in hosts
+                     if state.host in destination_hosts]
+        hosts = self.host_manager.get_filtered_hosts(hosts, filter_properties)
+        if not hosts:
+            return []
+        return self.host_manager.get_weighed_hosts(hosts, filter_properties)
+
+    def _estimate_duration(self, size):
+        seconds = max(size // CONF.scheduler_migration_throughput,
+                      CONF.scheduler_min_migration_duration)
+        return datetime.timedelta(seconds=seconds)
+
+    def _place(self, hosts, request_spec, filter_properties, now):
+        weighed_hosts = self._get_weighted_candidates(hosts,
+                                                      filter_properties)
+        if not weighed_hosts:
+            raise exception.NoValidHost(
+                reason=_('No destination can migrate this %s.') %
+                request_spec.get('resource_type'))
+        host_state = weighed_hosts[0].obj
+        LOG.debug("Choosing %s", host_state)
+        size = request_spec.get('size') or 0
+        start = host_state.consume_from_migration(
+            size, self._estimate_duration(size), now)
+        return host_state, start
+
+    def _schedule(self, context, request_spec, filter_properties,
+                  topic=None):
+        hosts = self.host_manager.get_all_host_states(
+            context, topic=topic or CONF.destination_topic)
+        now = timeutils.utcnow()
+        filter_properties = dict(filter_properties,
+                                 request_spec=request_spec, now=now)
+        return self._place(hosts, request_spec, filter_properties, now)
 
     def _max_attempts(self):
         max_attempts = CONF.scheduler_max_attempts
@@ -0,0 +1,35 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_log import log as logging
+
+from guts.scheduler import filters
+
+
+LOG = logging.getLogger(__name__)
+
+
+class CapabilitiesFilter(filters.BaseHostFilter):
+    """CapabilitiesFilter keeps the hosts able to migrate the resource."""
+
+    def host_passes(self, host_state, filter_properties):
+        """Return True if the host supports the type of the resource."""
+        request_spec = filter_properties.get('request_spec') or {}
+        resource_type = request_spec.get('resource_type')
+        if resource_type and resource_type not in host_state.resource_types:
+            LOG.debug("%(host)s can not migrate %(type)s resources",
+                      {'host': host_state.host, 'type': resource_type})
+            return False
+        return True
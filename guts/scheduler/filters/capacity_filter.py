@@ -0,0 +1,40 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_log import log as logging
+
+from guts.scheduler import filters
+
+
+LOG = logging.getLogger(__name__)
+
+
+class CapacityFilter(filters.BaseHostFilter):
+    """CapacityFilter filters based on the free space of the host."""
+
+    def host_passes(self, host_state, filter_properties):
+        """Return True if the host has room to convert the resource."""
+        request_spec = filter_properties.get('request_spec') or {}
+        size = request_spec.get('size') or 0
+        if host_state.free_space < size:
+            LOG.debug("Insufficient free space on %(host)s: requested "
+                      "%(requested)s, available %(available)s",
+                      {'host': host_state.host, 'requested': size,
+                       'available': host_state.free_space})
+            return False
+        if host_state.filesystem.get('free_inodes') == 0:
+            LOG.debug("No free inode on %s", host_state.host)
+            return False
+        return True
@@ -22,12 +22,14 @@ import collections
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import timeutils
+import six
 
 from guts import context as guts_context
 from guts import exception
 from guts import objects
 from guts import utils
 from guts.i18n import _LI, _LW
+from guts.scheduler import capabilities as capabilities_report
 from guts.scheduler import filters
 from guts.scheduler import weights
 
@@ -42,9 +44,15 @@ host_manager_opts = [
                      'when not specified in the request.'),
     cfg.ListOpt('scheduler_default_weighers',
                 default=[
-                    'CapacityWeigher'
+                    'CapacityWeigher',
+                    'SlotWeigher'
                 ],
-                help='Which weigher class names to use for weighing hosts.')
+                help='Which weigher class names to use for weighing hosts.'),
+    cfg.IntOpt('scheduler_default_migration_slots',
+               default=4,
+               min=1,
+               help='Number of concurrent migrations assumed for the '
+                    'destinations which do not report it.'),
 ]
 
 CONF = cfg.CONF
@@ -86,6 +94,11 @@ class HostState(object):
 
         self.migration_host_name = None
         self.total_capacity_gb = 0
+        self.free_space = 0
+        self.filesystem = {}
+        self.migration_slots = CONF.scheduler_default_migration_slots
+        # End times of the migrations placed on this host by the scheduler.
+        self.slot_ends = []
 
         self.updated = None
 
@@ -104,12 +117,56 @@ class HostState(object):
 
         'capability' is the status info reported by migration backend,
         a typical capability looks like this:
+
+            {'capabilities': ['instance', 'volume'],
+             'free_space': 107374182400,
+             'reserved_space': 21474836480,
+             'filesystem': {'type': 'xfs', 'sparse': True,
+                            'reflink': True, 'free_inodes': 52428000,
+                            ...},
+             'max_concurrent_migrations': 4}
+
+        The space reserved by the migrations in flight is not free for new
+        ones.
         """
         self.update_capabilities(capability, service)
 
         if capability:
             if self.updated and self.updated > capability['timestamp']:
                 return
+            self.free_space = ((capability.get('free_space') or 0) -
+                               (capability.get('reserved_space') or 0))
+            self.filesystem = capability.get('filesystem') or {}
+            self.migration_slots = capability.get(
+                'max_concurrent_migrations',
+                CONF.scheduler_default_migration_slots)
+            self.updated = capability['timestamp']
+
+    @property
+    def resource_types(self):
+        """Resource types the host can migrate."""
+        resource_types = self.capabilities.get('capabilities') or []
+        if isinstance(resource_types, six.string_types):
+            resource_types = resource_types.split(',')
+        return [resource_type.strip() for resource_type in resource_types]
+
+    def next_slot(self, now):
+        """Return when the next migration could start on this host."""
+        ends = sorted(end for end in self.slot_ends if end > now)
+        self.slot_ends = ends
+        if len(ends) < self.migration_slots:
+            return now
+        return ends[len(ends) - self.migration_slots]
+
+    def consume_from_migration(self, size, duration, now):
+        """Account a migration placed on this host.
+
+        :returns: the estimated start time of the migration.
+        """
+        start = self.next_slot(now)
+        self.slot_ends.append(start + duration)
+        self.free_space -= size
+        return start
 
     def update_backend(self, capability):
         self.volume_backend_name = capability.get('volume_backend_name', None)
@@ -119,8 +176,8 @@ class HostState(object):
         self.updated = capability['timestamp']
 
     def __repr__(self):
-        return ("host '%s': free_capacity_gb: %s, pools: %s" %
-                (self.host, self.free_capacity_gb, self.pools))
+        return ("host '%s': free_space: %s, migration_slots: %s" %
+                (self.host, self.free_space, self.migration_slots))
 
 
 class HostManager(object):
@@ -214,39 +271,37 @@ class HostManager(object):
                                                        weight_properties)
 
     def update_service_capabilities(self, service_name, host, capabilities):
-        """Update the per-service capabilities based on this notification."""
+        """Update the per-service capabilities based on this notification.
+
+        :returns: False when the report is the delta of a generation which
+                  was not received, a full report of the host is then
+                  needed.
+        """
         if not (service_name != 'source' or service_name != 'destination'):
             LOG.debug('Ignoring %(service_name)s service update '
                       'from %(host)s',
                       {'service_name': service_name, 'host': host})
-            return
+            return True
+
+        report = capabilities
+        if capabilities_report.is_delta(report):
+            previous = self.service_states.get(host)
+            if (previous is None or
+                    previous.get('generation') != report['base_generation']):
+                LOG.info(_LI('Missed capability reports of %(host)s, '
+                             'requesting a full report.'), {'host': host})
+                return False
+            capabilities = capabilities_report.apply_delta(previous,
+                                                           report['delta'])
+        else:
+            capabilities = capabilities_report.get_capabilities(report)
 
         if service_name == 'source':
-            resources = capabilities['resources']
-            # objects.ResourceList.delete_all_by_source(self._context, host)
-            for capab in resources.keys():
-                if capab not in capabilities['capabilities']:
-                    continue
-                for resource in resources[capab]:
-                    try:
-                        objects.Resource.get_by_id_at_source(
-                            self._context,
-                            resource.get('id'))
-                    except exception.ResourceNotFound:
-                        pass
-                    else:
-                        continue
-                    kwargs = {'type': capab,
-                              'source': host,
-                              'name': resource.get('name'),
-                              'id_at_source': resource.get('id'),
-                              'properties': str(resource)}
-                    resource_ref = objects.Resource(context=self._context,
-                                                    **kwargs)
-                    resource_ref.create()
+            self._sync_resources(host, capabilities, report)
 
         # Copy the capabilities, so we don't modify the original dict
         capab_copy = dict(capabilities)
+        capab_copy["generation"] = report.get('generation')
         capab_copy["timestamp"] = timeutils.utcnow()  # Reported time
 
         self.service_states[host] = capab_copy
@@ -254,9 +309,34 @@ class HostManager(object):
         LOG.debug("Received %(service_name)s service update from "
                   "%(host)s: %(cap)s",
                   {'service_name': service_name, 'host': host,
-                   'cap': capabilities})
+                   'cap': report})
 
         self._no_capabilities_hosts.discard(host)
+        return True
+
+    def _sync_resources(self, host, capabilities, report):
+        """Store the resource changes of a source report in one go."""
+        resources = []
+        removed = []
+        resource_changes = capabilities_report.get_resource_changes(report)
+        for capab, changes in resource_changes.items():
+            if capab not in capabilities['capabilities']:
+                continue
+            for resource in changes['updated']:
+                resources.append({'type': capab,
+                                  'name': resource.get('name'),
+                                  'id_at_source': resource.get('id'),
+                                  'properties': resource})
+            removed.extend(changes['removed'])
+
+        # A full report lists all the resources of the source.
+        complete = not capabilities_report.is_delta(report)
+        counts = objects.ResourceList.sync_by_source(self._context, host,
+                                                     resources,
+                                                     removed=removed,
+                                                     complete=complete)
+        LOG.debug("Synced resources of %(host)s: %(counts)s",
+                  {'host': host, 'counts': counts})
 
     def has_all_capabilities(self):
         return len(self._no_capabilities_hosts) == 0
@@ -302,25 +382,15 @@ class HostManager(object):
                          "scheduler cache."), {'host': host})
             del self.host_state_map[host]
 
-    def get_all_host_states(self, context):
-        """Returns a dict of all the hosts the HostManager knows about.
+    def get_all_host_states(self, context, topic=None):
+        """Returns the states of all the hosts the HostManager knows about.
 
         Each of the consumable resources in HostState are
         populated with capabilities scheduler received from RPC.
-
-        For example:
-          {'192.168.1.100': HostState(), ...}
+        Only the hosts of the given topic are returned, when one is given.
         """
 
         self._update_host_state_map(context)
 
-        # build a pool_state map and return that map instead of host_state_map
-        all_pools = {}
-        for host, state in self.host_state_map.items():
-            for key in state.pools:
-                pool = state.pools[key]
-                # use host.pool_name to make sure key is unique
-                pool_key = '.'.join([host, pool.pool_name])
-                all_pools[pool_key] = pool
-
-        return all_pools.values()
+        return [state for state in self.host_state_map.values()
+                if topic is None or state.service.get('topic') == topic]
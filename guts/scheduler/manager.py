@@ -21,11 +21,14 @@ import eventlet
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
+from oslo_service import periodic_task
 from oslo_utils import importutils
 
 from guts import context
+from guts.i18n import _LW
 from guts import manager
 from guts.migration import rpcapi as migration_rpcapi
+from guts import objects
 
 
 scheduler_driver_opt = cfg.StrOpt('scheduler_driver',
@@ -33,8 +36,17 @@ scheduler_driver_opt = cfg.StrOpt('scheduler_driver',
                                           'FilterScheduler',
                                   help='Default scheduler driver to use')
 
+migration_timeout_opt = cfg.IntOpt('migration_timeout',
+                                   default=86400,
+                                   min=0,
+                                   help='Seconds a running migration may go '
+                                        'without any update before it is '
+                                        'failed and its destination slot '
+                                        'freed, 0 to never time out.')
+
 CONF = cfg.CONF
 CONF.register_opt(scheduler_driver_opt)
+CONF.register_opt(migration_timeout_opt)
 
 LOG = logging.getLogger(__name__)
 
@@ -69,6 +81,35 @@ class SchedulerManager(manager.Manager):
         migration_rpcapi.SourceAPI().publish_service_capabilities(context)
         migration_rpcapi.DestinationAPI().publish_service_capabilities(context)
 
+    def _wait_for_scheduler(self):
+        # Migrations received before the hosts reported their capabilities
+        # would all fail to be placed.
+        while self._startup_delay and not self.driver.is_ready():
+            eventlet.sleep(1)
+
+    def create_migrations(self, context, migrations, filter_properties=None):
+        """Place the given migrations and start them."""
+        self._wait_for_scheduler()
+        self.driver.schedule_create_migrations(context, migrations,
+                                               filter_properties or {})
+
+    @periodic_task.periodic_task
+    def _fail_stale_migrations(self, context):
+        # A lost cast or a dead destination would otherwise hold the slot
+        # of a running migration forever.
+        migrations = objects.MigrationList.fail_stale(
+            context, CONF.service_down_time, CONF.migration_timeout,
+            expected_attrs=['destination'])
+        destination_api = migration_rpcapi.DestinationAPI()
+        for migration_ref in migrations:
+            LOG.warning(_LW('Migration %(migration)s failed: %(event)s.'),
+                        {'migration': migration_ref.id,
+                         'event': migration_ref.migration_event})
+            if migration_ref.destination_host:
+                destination_api.release_space(context,
+                                              migration_ref.destination_host,
+                                              migration_ref.id)
+
     def update_service_capabilities(self, context, service_name=None,
                                     host=None, capabilities=None, **kwargs):
         """Process a capability update from a service node."""
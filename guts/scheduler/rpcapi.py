@@ -32,6 +32,11 @@ class SchedulerAPI(rpc.RPCAPI):
     TOPIC = CONF.scheduler_topic
     BINARY = 'guts-scheduler'
 
+    def create_migrations(self, ctxt, migrations, filter_properties=None):
+        cctxt = self.client.prepare(version='1.8')
+        cctxt.cast(ctxt, 'create_migrations', migrations=migrations,
+                   filter_properties=filter_properties)
+
     def update_service_capabilities(self, ctxt,
                                     service_name, host,
                                     capabilities):
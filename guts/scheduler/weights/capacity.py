@@ -0,0 +1,48 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Capacity Weigher. Weigh hosts by their free space in the conversion
+directory.
+
+The default is to spread migrations across all hosts evenly. If you prefer
+stacking, you can set the 'capacity_weight_multiplier' option to a negative
+number and the weighing has the opposite effect of the default.
+"""
+
+from oslo_config import cfg
+
+from guts.scheduler import weights
+
+
+capacity_weight_opts = [
+    cfg.FloatOpt('capacity_weight_multiplier',
+                 default=1.0,
+                 help='Multiplier used for weighing free space. '
+                      'Negative numbers mean to stack vs spread.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(capacity_weight_opts)
+
+
+class CapacityWeigher(weights.BaseHostWeigher):
+    def weight_multiplier(self):
+        """Override the weight multiplier."""
+        return CONF.capacity_weight_multiplier
+
+    def _weigh_object(self, host_state, weight_properties):
+        """Higher weights win. We want spreading to be the default."""
+        return host_state.free_space
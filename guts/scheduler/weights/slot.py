@@ -0,0 +1,47 @@
+# Copyright (c) 2015 Aptira Pty Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Slot Weigher. Weigh hosts by how soon a new migration could start on them.
+
+Hosts with a free migration slot all get the same weight, the others are
+weighed by the time until their first running migration should complete.
+"""
+
+from oslo_config import cfg
+
+from guts.scheduler import weights
+
+
+slot_weight_opts = [
+    cfg.FloatOpt('slot_weight_multiplier',
+                 default=1.0,
+                 help='Multiplier used for weighing the time until the next '
+                      'free migration slot of a host.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(slot_weight_opts)
+
+
+class SlotWeigher(weights.BaseHostWeigher):
+    def weight_multiplier(self):
+        """Override the weight multiplier."""
+        return CONF.slot_weight_multiplier
+
+    def _weigh_object(self, host_state, weight_properties):
+        """Higher weights win, the sooner the better."""
+        now = weight_properties['now']
+        return -(host_state.next_slot(now) - now).total_seconds()
@@ -272,6 +272,11 @@ class Service(service.Service):
         self.timers = []
         super(Service, self).stop()
 
+    def reset(self):
+        self.manager.reset()
+        rpc.reset()
+        super(Service, self).reset()
+
     def wait(self):
         for x in self.timers:
             try:
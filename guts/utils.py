@@ -25,6 +25,7 @@ from oslo_concurrency import lockutils
 from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import importutils
 from oslo_utils import strutils
 from oslo_utils import timeutils
@@ -47,8 +48,11 @@ class QemuImgInfo(object):
     SIZE_RE = re.compile(r"(\d*\.?\d+)(\w+)?(\s*\(\s*(\d+)\s+bytes\s*\))?",
                          re.I)
 
-    def __init__(self, cmd_output=None):
-        details = self._parse(cmd_output or '')
+    def __init__(self, cmd_output=None, format='human'):
+        if format == 'json':
+            details = self._parse_json(cmd_output or '{}')
+        else:
+            details = self._parse(cmd_output or '')
         self.image = details.get('image')
         self.backing_file = details.get('backing_file')
         self.file_format = details.get('file_format')
@@ -57,6 +61,25 @@ class QemuImgInfo(object):
         self.disk_size = details.get('disk_size')
         self.snapshots = details.get('snapshot_list', [])
         self.encrypted = details.get('encrypted')
+        self.dirty = details.get('dirty_flag', False)
+        # VMDK specific information, used to find raw flat extents.
+        self.create_type = details.get('create_type')
+        self.extent_filename = details.get('filename')
+
+    @property
+    def allocation_ratio(self):
+        """Fraction of the virtual size actually allocated on disk.
+
+        Sparse images have a ratio well below 1, None when unknown.
+        """
+        if not self.virtual_size or self.disk_size is None:
+            return None
+        return min(1.0, float(self.disk_size) / self.virtual_size)
+
+    @property
+    def is_sparse(self):
+        ratio = self.allocation_ratio
+        return ratio is not None and ratio < 1.0
 
     def __str__(self):
         lines = [
@@ -71,6 +94,8 @@ class QemuImgInfo(object):
             lines.append("snapshots: %s" % self.snapshots)
         if self.encrypted:
             lines.append("encrypted: %s" % self.encrypted)
+        if self.create_type:
+            lines.append("create_type: %s" % self.create_type)
         return "\n".join(lines)
 
     def _canonicalize(self, field):
@@ -142,15 +167,45 @@ class QemuImgInfo(object):
                 })
         return real_details
 
+    def _parse_json(self, cmd_output):
+        try:
+            data = jsonutils.loads(cmd_output)
+        except ValueError:
+            raise ValueError(_('Invalid qemu-img info output "%s".') %
+                             cmd_output)
+        contents = {
+            'image': data.get('filename'),
+            'file_format': (data.get('format') or '').lower() or None,
+            'virtual_size': data.get('virtual-size'),
+            'cluster_size': data.get('cluster-size'),
+            'disk_size': data.get('actual-size'),
+            'backing_file': (data.get('full-backing-filename') or
+                             data.get('backing-filename')),
+            'encrypted': 'yes' if data.get('encrypted') else None,
+            'dirty_flag': data.get('dirty-flag', False),
+            'snapshot_list': [{
+                'id': snapshot.get('id'),
+                'tag': snapshot.get('name'),
+                'vm_size': snapshot.get('vm-state-size'),
+                'date': snapshot.get('date-sec'),
+                'vm_clock': snapshot.get('vm-clock-sec'),
+            } for snapshot in data.get('snapshots', [])],
+        }
+        format_specific = data.get('format-specific') or {}
+        if format_specific.get('type') == 'vmdk':
+            vmdk = format_specific.get('data') or {}
+            contents['create_type'] = vmdk.get('create-type')
+            extents = vmdk.get('extents') or []
+            # Only single extent disks can be used as they are.
+            if len(extents) == 1:
+                contents['filename'] = extents[0].get('filename')
+        return contents
+
     def _parse(self, cmd_output):
         # Analysis done of qemu-img.c to figure out what is going on here
         # Find all points start with some chars and then a ':' then a newline
         # and then handle the results of those 'top level' items in a separate
         # function.
-        #
-        # TODO(harlowja): newer versions might have a json output format
-        #                 we should switch to that whenever possible.
-        #                 see: http://bit.ly/XLJXDX
         contents = {}
         lines = [x for x in cmd_output.splitlines() if x.strip()]
         while lines:
@@ -283,11 +338,53 @@ def check_string_length(value, name, min_length=0, max_length=None):
         raise exception.InvalidInput(reason=msg)
 
 
-def convert_image(source, dest, out_format, run_as_root=True):
-    """Convert image to other format."""
+# Resource properties also stored in their own columns, to be queried on.
+INDEXED_RESOURCE_PROPERTIES = ('memory', 'vcpus', 'size')
+
+
+def dump_properties(properties):
+    """Serialize the properties of a resource to JSON."""
+    return jsonutils.dumps(properties, separators=(',', ':'))
+
+
+def load_properties(data):
+    """Deserialize the JSON properties of a resource."""
+    if not data:
+        return {}
+    return jsonutils.loads(data)
+
+
+def extract_indexed_properties(properties):
+    """Return the indexed properties of a resource, None when unknown."""
+    values = {}
+    for key in INDEXED_RESOURCE_PROPERTIES:
+        try:
+            values[key] = int((properties or {})[key])
+        except (KeyError, TypeError, ValueError):
+            values[key] = None
+    return values
+
+
+def convert_version_to_tuple(version_str):
+    """Convert a version string such as '1.2' into a tuple of ints."""
+    return tuple(int(part) for part in version_str.split('.'))
+
+
+def convert_image(source, dest, out_format, run_as_root=True,
+                  coroutines=None, out_of_order=False):
+    """Convert image to other format.
 
-    cmd = ('qemu-img', 'convert',
-           '-O', out_format, source, dest)
+    :param coroutines: number of parallel qemu-img coroutines, qemu-img
+                       picks its default when not given.
+    :param out_of_order: allow qemu-img to write the target out of order.
+    """
+
+    cmd = ['qemu-img', 'convert', '-O', out_format]
+    if coroutines:
+        cmd += ['-m', str(coroutines)]
+    if out_of_order:
+        cmd.append('-W')
+    cmd += [source, dest]
 
     start_time = timeutils.utcnow()
     execute(*cmd, run_as_root=True)
@@ -296,6 +393,8 @@ def convert_image(source, dest, out_format, run_as_root=True):
     if duration < 1:
         duration = 1
     try:
+        # The source is not modified by the conversion, so this is served
+        # from the cache filled when it was probed before converting.
         image_size = qemu_img_info(source, run_as_root=True).virtual_size
     except ValueError as e:
         msg = _LI("The image was successfully converted, but image size "
@@ -318,13 +417,55 @@ def convert_image(source, dest, out_format, run_as_root=True):
     LOG.info(msg, {"sz": fsz_mb, "mbps": mbps})
 
 
-def qemu_img_info(path, run_as_root=True):
-    """Return an object containing the parsed output from qemu-img info."""
-    cmd = ('env', 'LC_ALL=C', 'qemu-img', 'info', path)
+# Parsed qemu-img info results, by path, along with the mtime and size of
+# the file when it was probed.
+_QEMU_IMG_INFO_CACHE = {}
+_QEMU_IMG_INFO_CACHE_SIZE = 256
+
+
+def _get_file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def _cache_qemu_img_info(path, signature, info):
+    if (path not in _QEMU_IMG_INFO_CACHE and
+            len(_QEMU_IMG_INFO_CACHE) >= _QEMU_IMG_INFO_CACHE_SIZE):
+        _QEMU_IMG_INFO_CACHE.pop(next(iter(_QEMU_IMG_INFO_CACHE)))
+    _QEMU_IMG_INFO_CACHE[path] = (signature, info)
+
+
+def qemu_img_info(path, run_as_root=True, disk_format=None):
+    """Return an object containing the parsed output from qemu-img info.
+
+    Results are cached until the mtime or the size of the file changes, so
+    probing the same image again does not spawn another process.
+
+    :param disk_format: format of the image, probed by qemu-img if None.
+                        Pass it for images of untrusted origin, whose
+                        content could pass for another format.
+    """
+    signature = _get_file_signature(path)
+    if signature is not None:
+        signature += (disk_format,)
+    cached = _QEMU_IMG_INFO_CACHE.get(path)
+    if signature is not None and cached and cached[0] == signature:
+        return cached[1]
+
+    cmd = ('env', 'LC_ALL=C', 'qemu-img', 'info', '--output=json')
+    if disk_format:
+        cmd += ('-f', disk_format)
+    cmd += (path,)
     if os.name == 'nt':
         cmd = cmd[2:]
     out, _err = execute(*cmd, run_as_root=run_as_root)
-    return QemuImgInfo(out)
+    info = QemuImgInfo(out, format='json')
+    if signature is not None:
+        _cache_qemu_img_info(path, signature, info)
+    return info
 
 
 def service_is_up(service):